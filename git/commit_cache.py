@@ -0,0 +1,235 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""A content addressed cache of data derived from commits (which, being
+immutable, never goes stale) keyed by the commits' full shas.  There's an
+LRU cache in memory and (optionally) a compressed one on disk in our
+configuration directory keyed by repository.
+"""
+
+__all__ = ["resolve_commit", "get_commit_show", "get_commit_patch", "get_commit_message", "get_stash_diff"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import codecs
+import collections
+import hashlib
+import io
+import os
+import re
+import subprocess
+import threading
+import zlib
+
+from ..bab import options
+from ..bab import runext
+
+from ..patch_diff import patchlib
+
+from . import git_utils
+
+from ... import CONFIG_DIR_PATH
+
+options.define("commit_cache", "on_disk", options.Defn(bool, False, _("Also keep (compressed) copies of commit data on disk so that it survives between sessions")))
+
+_FULL_SHA_RE = re.compile("[0-9a-f]{40}$")
+_ABBREV_SHA_RE = re.compile("[0-9a-fA-F]{4,39}$")
+
+CommitPatch = collections.namedtuple("CommitPatch", ["header", "diff_pluses"])
+
+class CommitCache:
+    '''A process wide LRU cache of (kind, sha) -> value that keeps within
+    both an entry count and a (rough) memory budget.  The values that it
+    returns are shared and must not be modified.'''
+    _CacheEntry = collections.namedtuple("_CacheEntry", ["value", "size"])
+    def __init__(self, max_entries=512, max_size=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._total_size = 0
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+    def put(self, key, value, size):
+        if size > self.max_size:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._total_size -= old_entry.size
+            self._entries[key] = self._CacheEntry(value, size)
+            self._total_size += size
+            while len(self._entries) > self.max_entries or self._total_size > self.max_size:
+                _key, entry = self._entries.popitem(last=False)
+                self._total_size -= entry.size
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_size = 0
+
+COMMIT_CACHE = CommitCache()
+
+# (common git dir, abbreviated sha) -> full sha
+_RESOLVED = dict()
+_RESOLVED_LOCK = threading.Lock()
+
+def resolve_commit(rev=None):
+    '''Return the full sha of the commit rev (default HEAD) refers to or None'''
+    rev = rev or "HEAD"
+    if _FULL_SHA_RE.match(rev):
+        return rev
+    git_dirs = git_utils.get_git_dirs()
+    # an abbreviated sha always means the same object (refs don't)
+    key = (git_dirs[1] if git_dirs else None, rev) if _ABBREV_SHA_RE.match(rev) else None
+    if key is not None:
+        with _RESOLVED_LOCK:
+            sha = _RESOLVED.get(key)
+        if sha is not None:
+            return sha
+    sha = runext.run_get_cmd(["git", "rev-parse", "--verify", "-q", rev + "^{commit}"], default=None)
+    if not sha or not _FULL_SHA_RE.match(sha):
+        return None
+    # but a branch or tag can look like one (e.g. "cafe") and takes precedence
+    if key is not None and sha.startswith(rev.lower()) and not runext.run_get_cmd(["git", "rev-parse", "--symbolic-full-name", rev], default="x"):
+        with _RESOLVED_LOCK:
+            if len(_RESOLVED) > 4096:
+                _RESOLVED.clear()
+            _RESOLVED[key] = sha
+    return sha
+
+def _get_disk_file_path(kind, sha):
+    if not options.get("commit_cache", "on_disk"):
+        return None
+    git_dirs = git_utils.get_git_dirs()
+    if git_dirs is None:
+        return None
+    # per user data so it lives in our config directory keyed by repository
+    repo_key = hashlib.sha1(os.path.abspath(git_dirs[1]).encode()).hexdigest()
+    return os.path.join(CONFIG_DIR_PATH, "commit-cache", repo_key, kind, sha[:2], sha[2:] + ".z")
+
+def _decode(data):
+    # commits needn't be UTF-8 so don't let bad bytes stop them being shown
+    return data.decode(errors="replace")
+
+class _RecordingReader:
+    '''Read and decode a binary file object keeping the raw bytes'''
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._chunks = list()
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._chunks.append(data)
+        return self._decoder.decode(data, final=not data)
+    def get_data(self):
+        return b"".join(self._chunks)
+
+def _read_from_disk(kind, sha):
+    file_path = _get_disk_file_path(kind, sha)
+    if file_path is None:
+        return None
+    try:
+        with open(file_path, "rb") as fobj:
+            return zlib.decompress(fobj.read())
+    except (OSError, zlib.error):
+        return None
+
+def _write_to_disk(kind, sha, data):
+    file_path = _get_disk_file_path(kind, sha)
+    if file_path is None:
+        return
+    tmp_file_path = file_path + ".tmp{0}".format(os.getpid())
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(tmp_file_path, "wb") as fobj:
+            fobj.write(zlib.compress(data))
+        os.replace(tmp_file_path, file_path)
+    except OSError:
+        pass
+
+def _get_text(kind, sha, cmd):
+    key = (kind, sha)
+    text = COMMIT_CACHE.get(key)
+    if text is not None:
+        return text
+    # the disk holds exactly what git output
+    data = _read_from_disk(kind, sha)
+    if data is None:
+        data = runext.run_get_cmd(cmd, default=None, do_rstrip=False, decode_stdout=False)
+        if data is None:
+            return None
+        _write_to_disk(kind, sha, data)
+    text = _decode(data)
+    COMMIT_CACHE.put(key, text, len(text))
+    return text
+
+def _parse_patch(fileobj):
+    diff_pluses = list()
+    header = ""
+    for item in patchlib.Patch.iter_diff_pluses(fileobj):
+        if isinstance(item, patchlib.Header):
+            header = str(item)
+        else:
+            diff_pluses.append(item)
+    return CommitPatch(header, tuple(diff_pluses))
+
+def get_commit_patch(rev):
+    '''Return the CommitPatch (header text and DiffPlus list) for "git
+    show rev" (or None if it doesn't exist) parsed as it's streamed'''
+    sha = resolve_commit(rev)
+    if sha is None:
+        return None
+    key = ("patch", sha)
+    commit_patch = COMMIT_CACHE.get(key)
+    if commit_patch is not None:
+        return commit_patch
+    text = COMMIT_CACHE.get(("show", sha))
+    if text is None:
+        data = _read_from_disk("show", sha)
+        text = None if data is None else _decode(data)
+    if text is not None:
+        commit_patch = _parse_patch(io.StringIO(text))
+        size = len(text)
+    else:
+        with subprocess.Popen(["git", "show", sha], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+            reader = _RecordingReader(process.stdout)
+            commit_patch = _parse_patch(reader)
+        if process.returncode != 0:
+            return None
+        data = reader.get_data()
+        _write_to_disk("show", sha, data)
+        size = len(data)
+    # NB: the text's size is only a rough guide to the parsed data's
+    COMMIT_CACHE.put(key, commit_patch, 2 * size)
+    return commit_patch
+
+def get_commit_show(rev):
+    sha = resolve_commit(rev)
+    return None if sha is None else _get_text("show", sha, ["git", "show", sha])
+
+def get_commit_message(rev=None):
+    sha = resolve_commit(rev)
+    return None if sha is None else _get_text("message", sha, ["git", "log", "-n", "1", "--pretty=format:%s%n%n%b", sha])
+
+def get_stash_diff(stash=None):
+    # a stash is a commit so its diff is just as immutable
+    sha = resolve_commit(stash or "stash@{0}")
+    return None if sha is None else _get_text("stash-diff", sha, ["git", "stash", "show", "-p", sha])
@@ -22,8 +22,12 @@ __author__ = "Peter Williams <pwil3058@gmail.com>"
 
 from ..bab import runext
 
+from ..scm import backend_caps
+
 from ..patch_diff import patchlib
 
+from . import git_utils
+
 def index_is_empty():
     stdout = runext.run_get_cmd(["git", "status", "--porcelain", "--untracked-files=no"])
     for line in stdout.splitlines():
@@ -35,15 +39,8 @@ class Interface:
     name = "git"
     @staticmethod
     def __getattr__(attr_name):
-        if attr_name == "is_available":
-            try:
-                return runext.run_cmd(["git", "version"]).is_ok
-            except OSError as edata:
-                if edata.errno == errno.ENOENT:
-                    return False
-                else:
-                    raise
-        if attr_name == "in_valid_wspce": return runext.run_cmd(["git", "config", "--local", "-l"]).is_ok
+        if attr_name == "is_available": return backend_caps.get_tool("git").is_available
+        if attr_name == "in_valid_wspce": return backend_caps.get_in_valid_wspce("git", lambda: runext.run_cmd(["git", "config", "--local", "-l"]).is_ok)
         raise AttributeError(attr_name)
     @staticmethod
     def dir_is_in_valid_pgnd(dir_path=None):
@@ -72,7 +69,7 @@ class Interface:
         return runext.run_cmd(["git", "commit", "-q", "-m", description])
     @staticmethod
     def get_clean_contents(file_path):
-        return runext.run_get_cmd(["git", "cat-file", "blob", "HEAD:{}".format(file_path)], do_rstrip=False, default=None, decode_stdout=False)
+        return git_utils.get_clean_contents(file_path)
     @staticmethod
     def get_files_with_uncommitted_changes(files=None):
         cmd = ["git", "status", "--porcelain", "--untracked-files=no",]
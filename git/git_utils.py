@@ -15,21 +15,532 @@
 ### along with this program; if not, write to the Free Software
 ### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import codecs
+import collections
 import os
 import re
 import subprocess
+import threading
 
 from ..bab import runext
 
 def check_ignored(paths):
     return subprocess.run(["git", "check-ignore"] + paths, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
+def _get_mtime(file_path, stat_memo):
+    try:
+        return stat_memo[file_path]
+    except KeyError:
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        stat_memo[file_path] = mtime
+        return mtime
+
+def _iter_ignore_records(data):
+    # each record is "<source> NUL <linenum> NUL <pattern> NUL <pathname> NUL"
+    fields = data.split(b"\0")
+    for index in range(0, len(fields) - 4, 4):
+        source, _linenum, pattern = fields[index:index + 3]
+        yield bool(source) and not pattern.startswith(b"!")
+
+class _IgnoreChecker:
+    '''Answer "is this path ignored?" for paths relative to the current
+    directory without forking a "git check-ignore" per path.  Answers are
+    cached until one of the ignore files (.gitignore, info/exclude or the
+    global excludes file) that could affect them changes.'''
+    CMD = ["git", "check-ignore", "--stdin", "-z", "--non-matching", "-v"]
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cwd = None
+        self._process = None
+        self._buffer = b""
+        self._process_rules = dict()
+        self._cache = dict()
+        self._fixed_ignore_files = None
+    def _reset(self):
+        self._stop_process()
+        self._cwd = os.getcwd()
+        self._cache = dict()
+        self._fixed_ignore_files = self._get_fixed_ignore_files()
+    def _check_cwd(self):
+        if self._cwd != os.getcwd():
+            self._reset()
+    @staticmethod
+    def _get_fixed_ignore_files():
+        '''Return the ignore files that apply to every path (or None if we're not in a work tree)'''
+        result = subprocess.run(["git", "rev-parse", "--git-path", "info/exclude", "--show-toplevel", "--show-prefix"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        lines = result.stdout.splitlines()
+        if result.returncode != 0 or len(lines) != 3:
+            return None
+        ignore_files = [lines[0]]
+        result = subprocess.run(["git", "config", "--path", "--get", "core.excludesFile"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        if result.stdout.strip():
+            ignore_files.append(result.stdout.strip())
+        else:
+            config_dir = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+            ignore_files.append(os.path.join(config_dir, "git", "ignore"))
+        # the .gitignore files between the top of the work tree and here
+        dir_path = lines[1]
+        for part in [""] + lines[2].strip("/").split("/"):
+            if part:
+                dir_path = os.path.join(dir_path, part)
+            ignore_files.append(os.path.join(dir_path, ".gitignore"))
+        return ignore_files
+    def _get_ignore_files(self, path):
+        ignore_files = list(self._fixed_ignore_files)
+        dir_path = os.path.dirname(os.path.normpath(path))
+        while dir_path and dir_path not in (os.curdir, os.pardir):
+            ignore_files.append(os.path.join(dir_path, ".gitignore"))
+            dir_path = os.path.dirname(dir_path)
+        return ignore_files
+    def _get_rules_state(self, path, stat_memo):
+        return tuple(_get_mtime(file_path, stat_memo) for file_path in self._get_ignore_files(path))
+    def _note_rules_used(self, paths, stat_memo):
+        # "git check-ignore" reads each ignore file once so restart it if one has changed since
+        rules_used = dict()
+        for path in paths:
+            for file_path in self._get_ignore_files(path):
+                rules_used[file_path] = _get_mtime(file_path, stat_memo)
+        if any(self._process_rules.get(file_path, mtime) != mtime for file_path, mtime in rules_used.items()):
+            self._stop_process()
+        self._process_rules.update(rules_used)
+    def _stop_process(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            self._process.wait()
+            self._process = None
+            self._buffer = b""
+        self._process_rules = dict()
+    def _query_process(self, path):
+        if self._process is None:
+            env = dict(os.environ, GIT_FLUSH="1")
+            self._process = subprocess.Popen(self.CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0, env=env)
+        try:
+            self._process.stdin.write(os.fsencode(path) + b"\0")
+            while self._buffer.count(b"\0") < 4:
+                data = os.read(self._process.stdout.fileno(), 65536)
+                if not data:
+                    raise EOFError
+                self._buffer += data
+        except (OSError, EOFError):
+            self._stop_process()
+            return None
+        fields = self._buffer.split(b"\0", 4)
+        self._buffer = fields.pop()
+        return next(_iter_ignore_records(b"\0".join(fields) + b"\0"))
+    def _query_batch(self, paths):
+        data = b"".join(os.fsencode(path) + b"\0" for path in paths)
+        result = subprocess.run(self.CMD, input=data, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        answers = list(_iter_ignore_records(result.stdout))
+        if result.returncode not in (0, 1) or len(answers) != len(paths):
+            return [None] * len(paths)
+        return answers
+    def check_paths(self, paths):
+        '''Return a list of True (ignored), False (not ignored) or None (unknown)'''
+        with self._lock:
+            self._check_cwd()
+            if self._fixed_ignore_files is None:
+                return [None] * len(paths)
+            stat_memo = dict()
+            answers = list()
+            misses = list()
+            for index, path in enumerate(paths):
+                rules_state = self._get_rules_state(path, stat_memo)
+                cached = self._cache.get(path)
+                if cached is not None and cached[0] == rules_state:
+                    answers.append(cached[1])
+                else:
+                    answers.append(None)
+                    misses.append((index, path, rules_state))
+            if len(misses) == 1:
+                self._note_rules_used([misses[0][1]], stat_memo)
+                fresh_answers = [self._query_process(misses[0][1])]
+            elif misses:
+                fresh_answers = self._query_batch([path for _index, path, _state in misses])
+            else:
+                fresh_answers = []
+            for (index, path, rules_state), answer in zip(misses, fresh_answers):
+                answers[index] = answer
+                # don't cache if the rules changed while we were asking
+                if answer is not None and self._get_rules_state(path, dict()) == rules_state:
+                    self._cache[path] = (rules_state, answer)
+            return answers
+
+_IGNORE_CHECKER = _IgnoreChecker()
+
 def is_ignored_path(path):
-    return check_ignored([path]).returncode == 0
+    return _IGNORE_CHECKER.check_paths([path])[0] is True
 
 def get_recognized_subdirs(base_dir_path="."):
-    path_iter = (os.path.join(dp, sdn) for dp, sdns, _fns in os.walk(base_dir_path) for sdn in sdns)
-    return [path for path in path_iter if check_ignored([path]).returncode == 1 and not path.startswith("./.git")]
+    paths = [os.path.join(dp, sdn) for dp, sdns, _fns in os.walk(base_dir_path) for sdn in sdns]
+    return [path for path, ignored in zip(paths, _IGNORE_CHECKER.check_paths(paths)) if ignored is False and not path.startswith("./.git")]
+
+class _BlobReader:
+    '''Fetch object contents from a single long running "git cat-file
+    --batch" (per current directory) rather than a process per object.
+    Requests are pipelined and recently fetched blobs are kept (keyed by
+    object id) in a size limited LRU cache.'''
+    CMD = ["git", "cat-file", "--batch"]
+    CACHE_MAX_BYTES = 32 * 1024 * 1024
+    CACHE_MAX_BLOB_SIZE = 1024 * 1024
+    CHUNK_SIZE = 65536
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cwd = None
+        self._process = None
+        self._cache = collections.OrderedDict()
+        self._cache_size = 0
+        # (commit object id, path) -> blob object id (commits are immutable)
+        self._path_oids = dict()
+    def _check_cwd(self):
+        if self._cwd != os.getcwd():
+            self._stop_process()
+            self._cwd = os.getcwd()
+            self._path_oids = dict()
+    def _stop_process(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            self._process.kill()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+    def _get_process(self):
+        if self._process is None:
+            self._process = subprocess.Popen(self.CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return self._process
+    def _send_requests(self, process, specs):
+        data = b"".join(os.fsencode(spec) + b"\n" for spec in specs)
+        def write():
+            try:
+                process.stdin.write(data)
+                process.stdin.flush()
+            except OSError:
+                pass
+        if len(data) < 4096:
+            write()
+            return None
+        # write from another thread so that neither side blocks on a full pipe
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+        return writer
+    def _read_header(self, process):
+        '''Return (object id, type, size) or None if the object is missing'''
+        header = process.stdout.readline()
+        if not header.endswith(b"\n"):
+            raise EOFError
+        # the spec echoed in these may contain spaces so don't count fields
+        if header.endswith((b" missing\n", b" ambiguous\n")):
+            return None
+        fields = header.split()
+        if len(fields) != 3 or not fields[2].isdigit():
+            raise ValueError(header)
+        return (fields[0].decode(), fields[1].decode(), int(fields[2]))
+    def _read_body(self, process, size):
+        body = process.stdout.read(size + 1)
+        if len(body) != size + 1:
+            raise EOFError
+        return body[:-1]
+    def _copy_body(self, process, size, fobj):
+        remaining = size
+        while remaining:
+            chunk = process.stdout.read(min(remaining, self.CHUNK_SIZE))
+            if not chunk:
+                raise EOFError
+            fobj.write(chunk)
+            remaining -= len(chunk)
+        if process.stdout.read(1) != b"\n":
+            raise EOFError
+    def _cache_get(self, oid):
+        try:
+            self._cache.move_to_end(oid)
+            return self._cache[oid]
+        except KeyError:
+            return None
+    def _cache_put(self, oid, contents):
+        if len(contents) > self.CACHE_MAX_BLOB_SIZE or oid in self._cache:
+            return
+        self._cache[oid] = contents
+        self._cache_size += len(contents)
+        while self._cache_size > self.CACHE_MAX_BYTES:
+            _oid, old_contents = self._cache.popitem(last=False)
+            self._cache_size -= len(old_contents)
+    def _get_commit_oid(self, process, rev):
+        self._send_requests(process, [rev])
+        header = self._read_header(process)
+        if header is None:
+            return None
+        self._read_body(process, header[2])
+        return header[0] if header[1] == "commit" else None
+    def _fetch(self, rev, file_paths, handle_contents, handle_body):
+        # one round trip to pin the commit then the paths whose blobs
+        # aren't in the cache all pipelined in one go (paths containing a
+        # newline can't be sent and are left as None for the caller)
+        results = [None] * len(file_paths)
+        indexed_file_paths = [(index, file_path) for index, file_path in enumerate(file_paths) if "\n" not in file_path]
+        if not indexed_file_paths:
+            return results
+        process = self._get_process()
+        commit_oid = self._get_commit_oid(process, rev)
+        if commit_oid is None:
+            for index, _file_path in indexed_file_paths:
+                results[index] = False
+            return results
+        requests = []
+        for index, file_path in indexed_file_paths:
+            oid = self._path_oids.get((commit_oid, file_path))
+            contents = None if oid is None else self._cache_get(oid)
+            if contents is not None:
+                results[index] = handle_contents(index, contents)
+            else:
+                requests.append((index, file_path))
+        if not requests:
+            return results
+        writer = self._send_requests(process, ["{0}:{1}".format(commit_oid, file_path) for _index, file_path in requests])
+        try:
+            for index, file_path in requests:
+                header = self._read_header(process)
+                if header is None:
+                    results[index] = False
+                    continue
+                oid, obj_type, size = header
+                if obj_type != "blob":
+                    self._read_body(process, size)
+                    results[index] = False
+                    continue
+                self._path_oids[(commit_oid, file_path)] = oid
+                results[index] = handle_body(index, process, oid, size)
+        except BaseException:
+            # once we stop reading cat-file blocks on its output and the
+            # writer on its input so kill it before waiting for the writer
+            process.kill()
+            if writer is not None:
+                writer.join()
+            self._stop_process()
+            raise
+        if writer is not None:
+            writer.join()
+        return results
+    def _run(self, rev, file_paths, handle_contents, handle_body):
+        with self._lock:
+            self._check_cwd()
+            # a newline would split a spec in two and desynchronise us
+            if "\n" in rev:
+                return None
+            for attempt in range(2):
+                try:
+                    return self._fetch(rev, file_paths, handle_contents, handle_body)
+                except (EOFError, ValueError, BrokenPipeError):
+                    # it's died (or we lost sync) so try a new one once
+                    self._stop_process()
+                except OSError:
+                    self._stop_process()
+                    raise
+            return None
+    def get_blobs(self, file_paths, rev="HEAD"):
+        '''Return a list of the contents (bytes or None if it doesn't exist)
+        of the file_paths as they are in rev'''
+        def handle_contents(index, contents):
+            return contents
+        def handle_body(index, process, oid, size):
+            contents = self._read_body(process, size)
+            self._cache_put(oid, contents)
+            return contents
+        contents_list = self._run(rev, file_paths, handle_contents, handle_body)
+        if contents_list is None:
+            contents_list = [None] * len(file_paths)
+        # None means that it still needs fetching
+        return [_get_blob_with_fork(rev, file_path) if contents is None else contents if contents is not False else None for file_path, contents in zip(file_paths, contents_list)]
+    def copy_blobs_to(self, file_path_targets, rev="HEAD"):
+        '''Write the contents of each file_path (as it is in rev) to its
+        target (creating the target's directory if need be) and return a
+        list of whether each was found'''
+        def handle_contents(index, contents):
+            with _open_target(file_path_targets[index][1]) as fobj:
+                fobj.write(contents)
+            return True
+        def handle_body(index, process, oid, size):
+            with _open_target(file_path_targets[index][1]) as fobj:
+                if size <= self.CACHE_MAX_BLOB_SIZE:
+                    contents = self._read_body(process, size)
+                    self._cache_put(oid, contents)
+                    fobj.write(contents)
+                else:
+                    self._copy_body(process, size, fobj)
+            return True
+        results = self._run(rev, [file_path for file_path, _target in file_path_targets], handle_contents, handle_body)
+        if results is None:
+            results = [None] * len(file_path_targets)
+        for index, (file_path, target) in enumerate(file_path_targets):
+            if results[index] is not None:
+                continue
+            contents = _get_blob_with_fork(rev, file_path)
+            if contents is not None:
+                with _open_target(target) as fobj:
+                    fobj.write(contents)
+            results[index] = contents is not None
+        return results
+
+def _open_target(target):
+    dir_path = os.path.dirname(target)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    return open(target, "wb")
+
+def _get_blob_with_fork(rev, file_path):
+    return runext.run_get_cmd(["git", "cat-file", "blob", "{0}:{1}".format(rev, file_path)], do_rstrip=False, default=None, decode_stdout=False)
+
+_BLOB_READER = _BlobReader()
+
+def get_clean_contents(file_path):
+    '''Return the contents (as bytes) of file_path in HEAD or None'''
+    return _BLOB_READER.get_blobs([file_path])[0]
+
+def get_clean_contents_list(file_paths):
+    return _BLOB_READER.get_blobs(file_paths)
+
+def copy_clean_version_to(file_path, target_name):
+    '''Copy file_path's contents in HEAD (byte for byte) to target_name
+    and return whether it was in HEAD'''
+    return _BLOB_READER.copy_blobs_to([(file_path, target_name)])[0]
+
+def copy_clean_versions_to(file_path_targets):
+    return _BLOB_READER.copy_blobs_to(file_path_targets)
+
+# cwd -> (git dir, common git dir) as absolute paths
+_GIT_DIRS = dict()
+_GIT_DIRS_LOCK = threading.Lock()
+
+def get_git_dirs():
+    '''Return the (absolute) git directory and common git directory (which
+    differ for linked work trees) for the current directory or None'''
+    cwd = os.getcwd()
+    with _GIT_DIRS_LOCK:
+        git_dirs = _GIT_DIRS.get(cwd)
+    if git_dirs is not None and os.path.isdir(git_dirs[0]):
+        return git_dirs
+    result = subprocess.run(["git", "rev-parse", "--git-dir", "--git-common-dir"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    lines = result.stdout.splitlines()
+    if result.returncode != 0 or not lines:
+        git_dirs = None
+    else:
+        git_dir = os.path.abspath(lines[0])
+        # older gits echo "--git-common-dir" back at us
+        common_dir = git_dir if len(lines) < 2 or lines[1] == "--git-common-dir" else os.path.abspath(lines[1])
+        git_dirs = (git_dir, common_dir)
+    if git_dirs is not None:
+        with _GIT_DIRS_LOCK:
+            if len(_GIT_DIRS) > 64:
+                _GIT_DIRS.clear()
+            _GIT_DIRS[cwd] = git_dirs
+    return git_dirs
+
+def _stat_key(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def get_refs_state(ref_dir_names, git_dirs=None, extra_file_names=()):
+    '''Return a value that changes whenever the refs in the named ref
+    directories (e.g. "refs/tags"), packed-refs, HEAD or the named extra
+    files (relative to the common git directory) change'''
+    if git_dirs is None:
+        git_dirs = get_git_dirs()
+    if git_dirs is None:
+        return None
+    git_dir, common_dir = git_dirs
+    state = [_stat_key(os.path.join(git_dir, "HEAD")), _stat_key(os.path.join(common_dir, "packed-refs")), _stat_key(os.path.join(common_dir, "reftable", "tables.list"))]
+    state += [_stat_key(os.path.join(common_dir, file_name)) for file_name in extra_file_names]
+    # loose refs are created, updated (via a lock file and rename) and
+    # deleted by directory operations so the directories' mtimes suffice
+    for ref_dir_name in ref_dir_names:
+        for dir_path, _sub_dir_names, _file_names in os.walk(os.path.join(common_dir, ref_dir_name)):
+            state.append((dir_path, _stat_key(dir_path)))
+    return tuple(state)
+
+# (common git dir, cmd) -> (refs state, output)
+_REFS_OUTPUT_CACHE = dict()
+_REFS_OUTPUT_CACHE_LOCK = threading.Lock()
+
+def get_refs_cmd_output(cmd, ref_dir_names, extra_file_names=()):
+    '''Return the output (bytes) of cmd (which should depend only on the
+    refs in ref_dir_names, HEAD and extra_file_names) rerunning it only if
+    they've changed'''
+    git_dirs = get_git_dirs()
+    state = get_refs_state(ref_dir_names, git_dirs, extra_file_names)
+    if state is None:
+        return runext.run_get_cmd(cmd, default=b"", do_rstrip=False, decode_stdout=False)
+    key = (git_dirs[1], tuple(cmd))
+    with _REFS_OUTPUT_CACHE_LOCK:
+        cached = _REFS_OUTPUT_CACHE.get(key)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+    output = runext.run_get_cmd(cmd, default=b"", do_rstrip=False, decode_stdout=False)
+    # don't cache if the refs changed while we were running
+    if get_refs_state(ref_dir_names, git_dirs, extra_file_names) == state:
+        with _REFS_OUTPUT_CACHE_LOCK:
+            if len(_REFS_OUTPUT_CACHE) > 64:
+                _REFS_OUTPUT_CACHE.clear()
+            _REFS_OUTPUT_CACHE[key] = (state, output)
+    return output
+
+def iter_for_each_ref_records(data, num_fields):
+    '''Iterate over the records (lists of str fields) in the output of
+    "git for-each-ref" (or "git log --pretty=tformat:") run with a format
+    of NUL terminated fields'''
+    for record in data.split(b"\0\n"):
+        fields = record.split(b"\0")
+        if len(fields) == num_fields:
+            yield [field.decode(errors="replace") for field in fields]
+
+# old_file_path is None unless the file has been renamed
+DiffFile = collections.namedtuple("DiffFile", ["file_path", "old_file_path", "adds_tws"])
+
+_CHECK_TWS_RE = re.compile(r"^(.*):\d+: trailing whitespace\.$", re.M)
+
+def _unquote_path(path):
+    if path.startswith('"') and path.endswith('"'):
+        return codecs.escape_decode(path[1:-1].encode())[0].decode(errors="replace")
+    return path
+
+def get_diff_files(diff_args):
+    '''Return the DiffFile for each file in "git diff diff_args" without
+    generating (or parsing) the diff itself'''
+    data = runext.run_get_cmd(["git", "diff", "--no-ext-diff", "--name-status", "-z"] + list(diff_args), do_rstrip=False)
+    # "--check" exits non zero when it finds problems so ignore the result
+    check_text = runext.run_cmd(["git", "-c", "core.quotepath=off", "diff", "--no-ext-diff", "--check"] + list(diff_args)).stdout
+    tws_file_paths = set(_unquote_path(path) for path in _CHECK_TWS_RE.findall(check_text))
+    diff_files = list()
+    seen = set()
+    fields = data.split("\0")
+    index = 0
+    while index + 1 < len(fields):
+        status = fields[index]
+        if status[:1] in ("R", "C"):
+            old_file_path, file_path = fields[index + 1], fields[index + 2]
+            index += 3
+        else:
+            old_file_path, file_path = None, fields[index + 1]
+            index += 2
+        # unmerged files can be listed twice
+        if file_path not in seen:
+            seen.add(file_path)
+            diff_files.append(DiffFile(file_path, old_file_path, file_path in tws_file_paths))
+    return diff_files
+
+def get_file_diff(diff_args, diff_file):
+    '''Return the text of "git diff diff_args" for just diff_file'''
+    file_paths = [diff_file.file_path] if diff_file.old_file_path is None else [diff_file.old_file_path, diff_file.file_path]
+    return runext.run_get_cmd(["git", "--literal-pathspecs", "diff", "--no-ext-diff"] + list(diff_args) + ["--"] + file_paths, do_rstrip=False)
 
 _SUBMODULE_PATH_RE = re.compile(r"[a-fA-F0-9]+\s+(\S+)(\s+\S*)?")
 def get_submodule_paths():
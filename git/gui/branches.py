@@ -14,13 +14,14 @@
 ### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import collections
-import re
+import os
 
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GObject
 
 from ... import scm
+from ...scm import backend_caps
 from ...scm.gui import scm_actions
 
 from ...bab import enotify
@@ -33,6 +34,8 @@ from ...gtx import table
 from ...gtx import tlview
 from ... import wsm_icons
 
+from .. import git_utils
+
 from . import git_do_opn
 
 BranchListRow = collections.namedtuple("BranchListRow", ["name", "is_current", "is_merged", "rev", "synopsis"])
@@ -69,23 +72,79 @@ class BranchListModel(table.MapManagedTableView.MODEL):
     def get_branch_is_merged(self, plist_iter):
         return self.get_value_named(plist_iter, "is_merged")
 
+_BRANCH_REF_DIRS = ["refs/heads", "refs/remotes"]
+# the upstreams are in the config
+_BRANCH_EXTRA_FILES = ["config"]
+
 class BranchTableData(table.TableData):
-    RE = re.compile("(([^ (]+)|(\([^)]+\)))\s+([a-fA-F0-9]{7}[a-fA-F0-9]*)?\s*([^\s].*)")
+    FIELDS = ["%(HEAD)", "%(refname)", "%(symref)", "%(objectname:short)", "%(upstream:short)", "%(upstream:track)", "%(contents:subject)"]
     def _get_data_text(self, h):
-        all_branches_text = runext.run_get_cmd(["git", "branch", "-vv"], default="")
-        h.update(all_branches_text.encode())
-        merged_branches_text = runext.run_get_cmd(["git", "branch", "--merged"], default="")
-        h.update(merged_branches_text.encode())
-        return (all_branches_text, merged_branches_text)
+        fields = list(self.FIELDS)
+        if backend_caps.get_tool("git").has_feature("for_each_ref_ahead_behind"):
+            # merged iff HEAD isn't behind it (all in the one pass)
+            fields.append("%(ahead-behind:HEAD)")
+        cmd = ["git", "for-each-ref", "--format=" + "%00".join(fields) + "%00"] + _BRANCH_REF_DIRS
+        all_branches_data = git_utils.get_refs_cmd_output(cmd, _BRANCH_REF_DIRS, _BRANCH_EXTRA_FILES)
+        h.update(all_branches_data)
+        if len(fields) > len(self.FIELDS):
+            merged_branches_data = None
+        elif backend_caps.get_tool("git").has_feature("for_each_ref_merged"):
+            merged_branches_data = git_utils.get_refs_cmd_output(["git", "for-each-ref", "--merged", "HEAD", "--format=%(refname)%00"] + _BRANCH_REF_DIRS, _BRANCH_REF_DIRS)
+            h.update(merged_branches_data)
+        else:
+            merged_branches_data = runext.run_get_cmd(["git", "branch", "-a", "--merged"], default="")
+            h.update(merged_branches_data.encode())
+        detached_head_data = None
+        if all_branches_data and not self._head_is_symref():
+            detached_head_data = runext.run_get_cmd(["git", "log", "-1", "--format=%h%x00%s", "HEAD"], default="")
+            h.update(detached_head_data.encode())
+        return (all_branches_data, len(fields), merged_branches_data, detached_head_data)
+    @staticmethod
+    def _head_is_symref():
+        git_dirs = git_utils.get_git_dirs()
+        try:
+            with open(os.path.join(git_dirs[0], "HEAD")) as fobj:
+                return fobj.read().startswith("ref:")
+        except (OSError, TypeError, UnicodeError):
+            return True
+    @staticmethod
+    def _get_display_name(refname):
+        for prefix in ("refs/heads/", "refs/remotes/"):
+            if refname.startswith(prefix):
+                return refname[len(prefix):]
+        return refname
+    @staticmethod
+    def _get_synopsis(upstream, track, subject):
+        # the same as "git branch -vv" e.g. "[origin/master: ahead 1] subject"
+        if not upstream:
+            return subject
+        track = track.strip("[]")
+        return "[{0}{1}{2}] {3}".format(upstream, ": " if track else "", track, subject)
     def _finalize(self, pdt):
-        all_branches_text, merged_branches_text = pdt
-        self._merged_branches = {line[2:].strip() for line in merged_branches_text.splitlines()}
-        def line_to_row(line):
-            is_current = line[0]
-            name, rev, synopsis = self.RE.match(line[2:]).group(1, 4, 5)
-            is_merged = name in self._merged_branches
-            return BranchListRow(name=name, is_current=is_current, is_merged=is_merged, rev=rev, synopsis=synopsis)
-        self._rows = (line_to_row(line) for line in all_branches_text.splitlines())
+        all_branches_data, num_fields, merged_branches_data, detached_head_data = pdt
+        if merged_branches_data is None:
+            merged_refnames = None
+        elif isinstance(merged_branches_data, bytes):
+            merged_refnames = {record[0] for record in git_utils.iter_for_each_ref_records(merged_branches_data, 1)}
+        else:
+            merged_refnames = set()
+            for line in merged_branches_data.splitlines():
+                name = line[2:].split(" -> ")[0].strip()
+                merged_refnames.add(("refs/" if name.startswith("remotes/") else "refs/heads/") + name)
+        rows = []
+        if detached_head_data:
+            rev, subject = detached_head_data.split("\0", 1)
+            rows.append(BranchListRow(name="(HEAD detached at {0})".format(rev), is_current="*", is_merged=True, rev=rev, synopsis=subject))
+        for fields in git_utils.iter_for_each_ref_records(all_branches_data, num_fields):
+            head, refname, symref, rev, upstream, track, subject = fields[:7]
+            if symref:
+                continue # e.g. refs/remotes/origin/HEAD
+            if merged_refnames is None:
+                is_merged = fields[7].split(" ")[0] == "0"
+            else:
+                is_merged = refname in merged_refnames
+            rows.append(BranchListRow(name=self._get_display_name(refname), is_current=head, is_merged=is_merged, rev=rev, synopsis=self._get_synopsis(upstream, track, subject)))
+        self._rows = rows
 
 class BranchListView(table.MapManagedTableView, scm_actions.WDListenerMixin, git_do_opn.DoOpnMixin):
     MODEL = BranchListModel
@@ -35,9 +35,17 @@ from ...patch_diff.gui import diff
 
 from . import git_gui_ifce
 
-class StagedDiffNotebook(diff.DiffTextsWidget):
+class StagedDiffNotebook(diff.LazyDiffTextsWidget):
     def __init__(self):
-        diff.DiffTextsWidget.__init__(self)
+        diff.LazyDiffTextsWidget.__init__(self)
+    def _get_diff_files(self):
+        try:
+            return git_gui_ifce.SCM.get_diff_files('-M', '--staged')
+        except CmdFailure as failure:
+            dialogue.main_window.report_failure(failure)
+            return []
+    def _get_file_diff_text(self, diff_args, diff_file):
+        return git_gui_ifce.SCM.get_file_diff(diff_file, '-M', '--staged')
     def _get_diff_text(self):
         # TODO: think about making -M a selectable option
         try:
@@ -172,25 +180,10 @@ class ShowCommitData:
     def __init__(self, commit_hash):
         self.source_name = commit_hash
         self.num_strip_levels = 1
-        lines = git_gui_ifce.SCM.get_commit_show(commit_hash).splitlines(True)
-        diff_starts_at = None
-        self.diff_pluses = list()
-        index = 0
-        last_diff_plus = None
-        while index < len(lines):
-            raise_if_malformed = diff_starts_at is not None
-            starts_at = index
-            diff_plus, index = patchlib.DiffPlus.get_diff_plus_at(lines, index, raise_if_malformed)
-            if diff_plus:
-                if diff_starts_at is None:
-                    diff_starts_at = starts_at
-                self.diff_pluses.append(diff_plus)
-                last_diff_plus = diff_plus
-                continue
-            elif last_diff_plus:
-                last_diff_plus.trailing_junk.append(lines[index])
-            index += 1
-        self.header = ''.join(lines[0:diff_starts_at])
+        # NB: the (cached) DiffPlus instances are shared so mustn't be modified
+        commit_patch = git_gui_ifce.SCM.get_commit_patch(commit_hash)
+        self.header = commit_patch.header if commit_patch else ''
+        self.diff_pluses = list(commit_patch.diff_pluses) if commit_patch else list()
     def __str__(self):
         string = '' if self.header is None else str(self.header)
         for diff_plus in self.diff_pluses:
@@ -26,11 +26,12 @@ from ...bab import runext
 from ...patch_diff.gui import diff
 
 from ...gtx import dialogue
-from ...gtx import gutils
 from ...gtx import actions
 from ... import wsm_icons
 
-class WdDiffTextWidget(diff.DiffTextsWidget, diff.FileAndRefreshActions):
+from .. import git_utils
+
+class WdDiffTextWidget(diff.LazyDiffTextsWidget):
     DIFF_MODES = ["git diff", "git diff --staged", "git diff HEAD"]
     def __init__(self):
         self.mode_button = {}
@@ -38,28 +39,31 @@ class WdDiffTextWidget(diff.DiffTextsWidget, diff.FileAndRefreshActions):
         for mode in self.DIFF_MODES:
             self.mode_button[mode] = button = Gtk.RadioButton.new_with_label_from_widget(button, mode)
             button.connect("toggled", self._diff_mode_toggled_cb)
-        diff.DiffTextsWidget.__init__(self)
-        diff.FileAndRefreshActions.__init__(self)
-        self.a_name_list = ["diff_save", "diff_save_as", "diff_refresh"]
-        self.diff_buttons = gutils.ActionButtonList([self._action_group], self.a_name_list)
-    def _get_diff_text(self):
+        diff.LazyDiffTextsWidget.__init__(self)
+    def _get_diff_args(self):
         # TODO: think about making -M a selectable option
-        cmd = ["git", "diff", "--no-ext-diff", "-M"]
+        diff_args = ["-M"]
         if self.mode_button["git diff --staged"].get_active():
-            cmd.append("--staged")
+            diff_args.append("--staged")
         elif self.mode_button["git diff HEAD"].get_active():
-            cmd.append("HEAD")
+            diff_args.append("HEAD")
+        return diff_args
+    def _get_diff_files(self):
         try:
-            return runext.run_get_cmd(cmd, do_rstrip=False)
+            return git_utils.get_diff_files(self._get_diff_args())
+        except CmdFailure as failure:
+            dialogue.main_window.report_failure(failure)
+            return []
+    def _get_file_diff_text(self, diff_args, diff_file):
+        return git_utils.get_file_diff(diff_args, diff_file)
+    def _get_diff_text(self):
+        try:
+            return runext.run_get_cmd(["git", "diff", "--no-ext-diff"] + self._get_diff_args(), do_rstrip=False)
         except CmdFailure as failure:
             dialogue.main_window.report_failure(failure)
             return failure.result.stdout
     def _diff_mode_toggled_cb(self, _data=None):
         self.update()
-    def _refresh_acb(self, _action):
-        self.update()
-    def _get_text_to_save(self):
-        return str(self)
 
 class WdDiffTextDialog(dialogue.ListenerDialog):
     def __init__(self, parent=None):
@@ -17,11 +17,20 @@ import os
 import re
 import hashlib
 import collections
+import threading
 
 from gi.repository import Pango
 
 from .. import git_utils
 
+from ... import scm
+from ...scm import backend_caps
+from ...scm import fs_watcher
+from ...scm import fsdb_delta
+from ...scm import status_trie
+
+from ...bab import enotify
+from ...bab import os_utils
 from ...bab import runext
 
 from ...gtx import fsdb
@@ -73,6 +82,10 @@ class FileStatus:
     CLEAN_SET = set([UNMODIFIED, MODIFIED, ADDED, DELETED, RENAMED, COPIED, IGNORED, None])
     SIGNIFICANT_SET = frozenset(MODIFIED_LIST + [NOT_TRACKED])
 
+# the preference order for directory decoration based on contents' states
+DIR_STATUS_RANKING = status_trie.StatusRanking(FileStatus.MODIFIED_LIST + [FileStatus.NOT_TRACKED])
+DIR_CLEAN_STATUS_RANKING = status_trie.StatusRanking([x for x in FileStatus.MODIFIED_LIST if x not in FileStatus.CLEAN_SET] + [FileStatus.NOT_TRACKED])
+
 _WD_DECO_MAP = {
         None: fsdb.Deco(Pango.Style.NORMAL, "black"),
         FileStatus.UNMODIFIED: fsdb.Deco(Pango.Style.NORMAL, "black"),
@@ -117,7 +130,7 @@ def get_git_file_data(string):
     match = _FILE_DATA_RE.match(string[3:])
     path = match.group(3) if match.group(3) else match.group(4)
     if match.group(5):
-        extra_data = fsdb.RFD(extradatamatch.group(8) if match.group(8) else match.group(9), '->')
+        extra_data = fsdb.RFD(match.group(8) if match.group(8) else match.group(9), '->')
     else:
         extra_data = None
     return GitFileData(path, string[:2], extra_data)
@@ -129,6 +142,163 @@ def iter_git_file_data_text(text, related_file_path_data):
             related_file_path_data.append((file_path, extra_data.path))
         yield (file_path, line[:2], extra_data)
 
+# the number of space separated fields before the path in each type of
+# "git status --porcelain=v2" record
+_V2_PATH_FIELD_INDEX = {b"1": 8, b"2": 9, b"u": 10}
+
+def _v2_related_file_status(status):
+    # what git would say about a rename/copy target if asked about it alone
+    return "".join("A" if char in "RC" else char for char in status)
+
+def iter_git_file_data_z(data, related_file_path_data):
+    '''Iterate over the (file_path, status, related_file_data) of the raw
+    bytes output by "git status --porcelain=v2 -z" in a single pass.
+    Rename/copy sources appear as in the v1 format i.e. with the status
+    and a "->" to the target and (source, target, target status) is
+    added to related_file_path_data.
+    '''
+    fields = iter(data.split(b"\0"))
+    for record in fields:
+        kind = record[:1]
+        if kind in (b"?", b"!"):
+            yield (os.fsdecode(record[2:]), kind.decode() * 2, None)
+            continue
+        path_index = _V2_PATH_FIELD_INDEX.get(kind)
+        if path_index is None:
+            continue # headers and the trailing empty field
+        file_path = os.fsdecode(record.split(b" ", path_index)[path_index])
+        status = record[2:4].decode().replace(".", " ")
+        if kind == b"2":
+            orig_file_path = os.fsdecode(next(fields))
+            related_file_path_data.append((orig_file_path, file_path, _v2_related_file_status(status)))
+            yield (orig_file_path, status, fsdb.RFD(file_path, '->'))
+        else:
+            yield (file_path, status, None)
+
+class StatusSnapshot:
+    '''The output of a single "git status" from which the work space and
+    index file trees, the status digest, whether the index is empty and
+    the files with uncommitted changes are all derived'''
+    CMD = ["status", "--porcelain=v2", "-z", "--ignored", "--untracked=all", "--ignore-submodules=none"]
+    def __init__(self):
+        self.cwd = os.getcwd()
+        # NB: before running the command so that changes made meanwhile aren't missed
+        self.fs_generation = fs_watcher.get_generation()
+        # stop "git status" updating the index and thereby waking the watcher
+        git_cmd = ["git", "--no-optional-locks"] if backend_caps.get_tool("git").has_feature("no_optional_locks") else ["git"]
+        self.data = runext.run_get_cmd(git_cmd + self.CMD, default=b"", do_rstrip=False, decode_stdout=False)
+        self.digest = hashlib.sha1(self.data).digest()
+        self._lock = threading.Lock()
+        self._fsd = None
+        self._index_file_data = None
+        self._index_digest = None
+    def _get_fsd(self):
+        with self._lock:
+            if self._fsd is None:
+                self._fsd = WsFileDb._extract_file_status_snapshot_z(self.data)
+            return self._fsd
+    def get_ws_snapshot(self):
+        return fsdb.Snapshot(dict(self._get_fsd()))
+    def get_ws_delta(self, since):
+        '''Return the fsdb_delta.SnapshotDelta from the "since" snapshot to this one'''
+        if since is self:
+            return fsdb_delta.SnapshotDelta(dict())
+        return fsdb_delta.get_snapshot_delta(since._get_fsd(), self._get_fsd())
+    def _iter_tracked_file_data(self):
+        for file_path, (status, related_file_data) in self._get_fsd().items():
+            if status not in (FileStatus.NOT_TRACKED, FileStatus.IGNORED):
+                yield (file_path, status, related_file_data)
+    @property
+    def index_file_data(self):
+        '''The data for the files with changes in the index (in the same
+        form as "git status --porcelain --untracked-files=no" would give)'''
+        with self._lock:
+            if self._index_file_data is not None:
+                return self._index_file_data
+        index_file_data = sorted((file_path, status, related_file_data) for file_path, status, related_file_data in self._iter_tracked_file_data() if status[0] != " " and not (related_file_data and related_file_data.relation == "<-"))
+        h = hashlib.sha1()
+        for file_path, status, related_file_data in index_file_data:
+            h.update("{0}{1}\0{2}\0".format(status, file_path, related_file_data.path if related_file_data else "").encode())
+        with self._lock:
+            self._index_file_data, self._index_digest = index_file_data, h.digest()
+        return index_file_data
+    @property
+    def index_digest(self):
+        self.index_file_data # make sure that it's been calculated
+        return self._index_digest
+    @property
+    def index_is_empty(self):
+        return len(self.index_file_data) == 0
+    def get_status_trie(self):
+        '''Return the status_trie.StatusTrie for this snapshot (brought up
+        to date from the last one built rather than built from scratch)'''
+        global _STATUS_TRIE
+        with _STATUS_TRIE_LOCK:
+            if _STATUS_TRIE is not None and _STATUS_TRIE[0].cwd == self.cwd:
+                trie_snapshot, trie = _STATUS_TRIE
+                if trie_snapshot is not self:
+                    trie.apply_delta(self.get_ws_delta(trie_snapshot))
+            else:
+                trie = status_trie.StatusTrie(self._get_fsd())
+            _STATUS_TRIE = (self, trie)
+            return trie
+    def get_files_with_uncommitted_changes(self, files=None):
+        file_paths = [file_path for file_path, _status, _related_file_data in self._iter_tracked_file_data()]
+        if files:
+            prefixes = [os.path.normpath(file_path) for file_path in files]
+            file_paths = [file_path for file_path in file_paths if any(file_path == prefix or file_path.startswith(prefix + os.sep) or prefix == os.curdir for prefix in prefixes)]
+        return sorted(file_paths)
+
+_STATUS_SNAPSHOT = None
+_STATUS_SNAPSHOT_LOCK = threading.Lock()
+
+# (snapshot, trie) for the most recently requested status trie which is
+# kept up to date incrementally rather than rebuilt for each snapshot
+_STATUS_TRIE = None
+_STATUS_TRIE_LOCK = threading.RLock()
+
+def get_dir_status(dir_path, clean=False):
+    '''Return the decoration status of dir_path's contents according to
+    the status trie or NotImplemented if there isn't one for the current
+    directory (e.g. git is too old to provide the status snapshot)'''
+    ranking = DIR_CLEAN_STATUS_RANKING if clean else DIR_STATUS_RANKING
+    with _STATUS_TRIE_LOCK:
+        if _STATUS_TRIE is None or _STATUS_TRIE[0].cwd != os.getcwd():
+            return NotImplemented
+        return _STATUS_TRIE[1].get_dir_status(dir_path, ranking)
+
+def get_status_snapshot():
+    '''Return the status snapshot for the current refresh generation
+    (running "git status" if it's the first request) or None if git is
+    too old to provide a porcelain v2 status'''
+    global _STATUS_SNAPSHOT
+    if not backend_caps.get_tool("git").has_feature("status_porcelain_v2"):
+        return None
+    with _STATUS_SNAPSHOT_LOCK:
+        if _STATUS_SNAPSHOT is None or _STATUS_SNAPSHOT.cwd != os.getcwd():
+            _STATUS_SNAPSHOT = StatusSnapshot()
+        return _STATUS_SNAPSHOT
+
+def new_status_generation(*args, **kwargs):
+    '''Start a new refresh generation i.e. the next status request will
+    run "git status" again'''
+    global _STATUS_SNAPSHOT
+    with _STATUS_SNAPSHOT_LOCK:
+        _STATUS_SNAPSHOT = None
+
+def refresh_status_generation():
+    '''Start a new refresh generation unless the file watcher says that
+    nothing that could change the status has changed'''
+    global _STATUS_SNAPSHOT
+    with _STATUS_SNAPSHOT_LOCK:
+        if _STATUS_SNAPSHOT is None or _STATUS_SNAPSHOT.fs_generation is None:
+            _STATUS_SNAPSHOT = None
+        elif _STATUS_SNAPSHOT.cwd != os.getcwd() or _STATUS_SNAPSHOT.fs_generation != fs_watcher.get_generation():
+            _STATUS_SNAPSHOT = None
+
+# NB: registered at import so that it runs before the file tree models' callbacks
+enotify.add_notification_cb(os_utils.E_FILE_CHANGES|scm.E_FILE_CHANGES|scm.E_INDEX_MOD|scm.E_CS_CHANGES|scm.E_WD_CHANGES|scm.E_NEW_SCM|enotify.E_CHANGE_WD, new_status_generation)
+
 # TODO: rewrite fsdb_git.WsFileDb to better handle submodules
 class WsFileDb(fsdb.GenericSnapshotWsFileDb):
     class FileDir(fsdb.GenericSnapshotWsFileDb.FileDir):
@@ -137,30 +307,41 @@ class WsFileDb(fsdb.GenericSnapshotWsFileDb):
         IGNORED_STATUS_SET = set([FileStatus.IGNORED])
         CLEAN_STATUS_SET = FileStatus.CLEAN_SET
         SIGNIFICANT_DATA_SET = FileStatus.SIGNIFICANT_SET
-        ORDERED_DIR_STATUS_LIST = FileStatus.MODIFIED_LIST + [FileStatus.NOT_TRACKED]
-        ORDERED_DIR_CLEAN_STATUS_LIST = [x for x in FileStatus.MODIFIED_LIST if x not in FileStatus.CLEAN_SET] + [FileStatus.NOT_TRACKED]
+        ORDERED_DIR_STATUS_LIST = list(DIR_STATUS_RANKING.statuses)
+        ORDERED_DIR_CLEAN_STATUS_LIST = list(DIR_CLEAN_STATUS_RANKING.statuses)
         def _get_initial_status(self, dir_path):
-            if self._file_status_snapshot.status_set:
-                for status in self.ORDERED_DIR_STATUS_LIST:
-                    if status in self._file_status_snapshot.status_set:
-                        return status
+            status = get_dir_status(dir_path)
+            if status is NotImplemented:
+                status = DIR_STATUS_RANKING.select(self._file_status_snapshot.status_set)
+            if status is not None:
+                return status
             return FileStatus.IGNORED if git_utils.is_ignored_path(dir_path) else None
         def _get_initial_clean_status(self, dir_path):
-            if self._file_status_snapshot.status_set:
-                for status in self.ORDERED_DIR_CLEAN_STATUS_LIST:
-                    if status in self._file_status_snapshot.status_set:
-                        return status
+            status = get_dir_status(dir_path, clean=True)
+            if status is NotImplemented:
+                status = DIR_CLEAN_STATUS_RANKING.select(self._file_status_snapshot.status_set)
+            if status is not None:
+                return status
             return FileStatus.IGNORED if git_utils.is_ignored_path(dir_path) else None
         def _is_hidden_dir(self, ddata):
             if ddata.name[0] == ".":
                 return ddata.status not in self.SIGNIFICANT_DATA_SET and ddata.clean_status not in self.SIGNIFICANT_DATA_SET
             return ddata.status == FileStatus.IGNORED
     def _get_file_data_text(self, h):
+        status_snapshot = get_status_snapshot()
+        if status_snapshot is not None:
+            self._status_snapshot = status_snapshot
+            # bring the trie that the FileDirs get their status from up to date
+            status_snapshot.get_status_trie()
+            h.update(status_snapshot.digest)
+            return status_snapshot
         file_data_text = runext.run_get_cmd(["git", "status", "--porcelain", "--ignored", "--untracked=all", "--ignore-submodules=none"])
         h.update(file_data_text.encode())
         return file_data_text
     @staticmethod
     def _extract_file_status_snapshot(file_data_text):
+        if isinstance(file_data_text, StatusSnapshot):
+            return file_data_text.get_ws_snapshot()
         related_file_path_data = []
         fsd = {file_path: (status, related_file_data) for file_path, status, related_file_data in iter_git_file_data_text(file_data_text, related_file_path_data)}
         for file_path, related_file_path in related_file_path_data:
@@ -174,6 +355,18 @@ class WsFileDb(fsdb.GenericSnapshotWsFileDb):
                 status = stdout[:2] if stdout else None
             fsd[related_file_path] = (status, fsdb.RFD(path=file_path, relation="<-"))
         return fsdb.Snapshot(fsd)
+    @staticmethod
+    def _extract_file_status_snapshot_z(file_data):
+        related_file_path_data = []
+        fsd = {file_path: (status, related_file_data) for file_path, status, related_file_data in iter_git_file_data_z(file_data, related_file_path_data)}
+        for file_path, related_file_path, status in related_file_path_data:
+            data = fsd.get(related_file_path, None)
+            if data is not None:
+                # don't overwrite git's opinion on related file data if it had one
+                if data[1] is not None: continue
+                status = data[0]
+            fsd[related_file_path] = (status, fsdb.RFD(path=file_path, relation="<-"))
+        return fsdb.Snapshot(fsd)
 
 class IndexFileDb(fsdb.GenericChangeFileDb):
     class FileDir(fsdb.GenericChangeFileDb.FileDir):
@@ -181,23 +374,25 @@ class IndexFileDb(fsdb.GenericChangeFileDb):
         FILE_DATA = GitFileData
         CLEAN_STATUS_SET = FileStatus.CLEAN_SET
         def _calculate_status(self):
-            for status in FileStatus.MODIFIED_LIST + [FileStatus.NOT_TRACKED]:
-                if status in self._status_set:
-                    return status
-            return FileStatus.UNMODIFIED
+            return DIR_STATUS_RANKING.select(self._status_set, FileStatus.UNMODIFIED)
         def _calculate_clean_status(self):
-            for status in FileStatus.MODIFIED_LIST + [FileStatus.NOT_TRACKED]:
-                if status in self._status_set:
-                    return status
-            return FileStatus.UNMODIFIED
+            return DIR_STATUS_RANKING.select(self._status_set, FileStatus.UNMODIFIED)
     def __init__(self):
         fsdb.GenericChangeFileDb.__init__(self)
     def _get_patch_data_text(self, h):
+        status_snapshot = get_status_snapshot()
+        if status_snapshot is not None:
+            h.update(status_snapshot.index_digest)
+            return status_snapshot
         patch_status_text = runext.run_get_cmd(["git", "status", "--porcelain", "--untracked-files=no"], default="")
         h.update(patch_status_text.encode())
         return (patch_status_text)
     @staticmethod
     def _iterate_file_data(pdt):
+        if isinstance(pdt, StatusSnapshot):
+            for file_data in pdt.index_file_data:
+                yield file_data
+            return
         for line in pdt.splitlines():
             if line[0] == " ": continue # not in the index
             file_path, status, extra_data = get_git_file_data(line)
@@ -20,11 +20,12 @@
 import os
 import re
 import hashlib
-import errno
 
 from gi.repository import Pango
 
 from ... import scm
+from ...scm import backend_caps
+from ...scm import pgnd_markers
 
 from ...bab import CmdResult
 from ...bab import runext
@@ -37,6 +38,9 @@ from ...patch_diff import patchlib
 
 from ...gtx import table
 
+from .. import commit_cache
+from .. import git_utils
+
 from . import fsdb_git
 
 def do_action_cmd(cmd, success_emask, fail_emask, eflag_modifiers):
@@ -63,23 +67,12 @@ class Interface:
     name = "git"
     @staticmethod
     def __getattr__(attr_name):
-        if attr_name == "is_available":
-            try:
-                return runext.run_cmd(["git", "version"]).is_ok
-            except OSError as edata:
-                if edata.errno == errno.ENOENT:
-                    return False
-                else:
-                    raise
-        if attr_name == "in_valid_wspce": return runext.run_cmd(["git", "config", "--local", "-l"]).is_ok
+        if attr_name == "is_available": return backend_caps.get_tool("git").is_available
+        if attr_name == "in_valid_wspce": return backend_caps.get_in_valid_wspce("git", lambda: runext.run_cmd(["git", "config", "--local", "-l"]).is_ok)
         raise AttributeError(attr_name)
     @staticmethod
     def copy_clean_version_to(filepath, target_name):
-        contents = runext.run_get_cmd(["git", "cat-file", "blob", "HEAD:{}".format(filepath)])
-        if contents:
-            utils.ensure_file_dir_exists(target_name)
-            with open(target_name, "w") as fobj:
-                fobj.write(contents)
+        git_utils.copy_clean_version_to(filepath, target_name)
     @staticmethod
     def dir_is_in_valid_pgnd(dir_path=None):
         if dir_path:
@@ -259,36 +252,41 @@ class Interface:
         return open(file_path).read() if os.path.exists(file_path) else ""
     @staticmethod
     def get_clean_contents(file_path):
-        return runext.run_get_cmd(["git", "cat-file", "blob", "HEAD:{}".format(file_path)], do_rstrip=False, default=None, decode_stdout=False)
+        return git_utils.get_clean_contents(file_path)
     @staticmethod
     def get_log_table_data():
         from . import log
         return log.LogTableData()
     @staticmethod
     def get_commit_message(commit=None):
-        cmd = ["git", "log", "-n", "1", "--pretty=format:%s%n%n%b"]
-        if commit:
-            cmd.append(commit)
-        result = runext.run_cmd(cmd)
-        if result.is_ok:
-            return result.stdout
-        return None
+        return commit_cache.get_commit_message(commit)
     @staticmethod
     def get_commit_show(commit):
-        cmd = ["git", "show", commit]
-        result = runext.run_cmd(cmd)
-        if result.is_ok:
-            return result.stdout
-        return None
+        return commit_cache.get_commit_show(commit)
+    @staticmethod
+    def get_commit_patch(commit):
+        return commit_cache.get_commit_patch(commit)
     @staticmethod
     def get_diff(*args):
         return runext.run_get_cmd(["git", "diff", "--no-ext-diff"] + list(args), do_rstrip=False)
     @staticmethod
+    def get_diff_files(*args):
+        return git_utils.get_diff_files(args)
+    @staticmethod
+    def get_file_diff(diff_file, *args):
+        return git_utils.get_file_diff(args, diff_file)
+    @staticmethod
     def get_file_status_digest():
+        status_snapshot = fsdb_git.get_status_snapshot()
+        if status_snapshot is not None:
+            return status_snapshot.digest
         stdout = runext.run_get_cmd(["git", "status", "--porcelain", "--ignored", "--untracked=all"], default=None)
         return None if stdout is None else hashlib.sha1(stdout).digest()
     @staticmethod
     def get_files_with_uncommitted_changes(files=None):
+        status_snapshot = fsdb_git.get_status_snapshot()
+        if status_snapshot is not None:
+            return status_snapshot.get_files_with_uncommitted_changes(files)
         cmd = ["git", "status", "--porcelain", "--untracked-files=no",]
         if files:
             cmd += files
@@ -298,6 +296,9 @@ class Interface:
         return fsdb_git.IndexFileDb()
     @staticmethod
     def get_playground_root():
+        root = pgnd_markers.get_playground_root("git")
+        if root is not NotImplemented:
+            return root
         if not runext.run_cmd(["git", "config", "--local", "-l"]).is_ok:
             return None
         dirpath = os.getcwd()
@@ -311,6 +312,9 @@ class Interface:
         return None
     @staticmethod
     def get_superproject_root():
+        root = pgnd_markers.get_superproject_root()
+        if root is not NotImplemented:
+            return root
         if not runext.run_cmd(["git", "config", "--local", "-l"]).is_ok:
             return None
         dirpath = os.getcwd()
@@ -333,7 +337,8 @@ class Interface:
         return runext.run_get_cmd(cmd).stdout.splitlines()[0][7:]
     @staticmethod
     def get_stash_diff(stash=None):
-        return runext.run_get_cmd(["git", "stash", "show", "-p"] + runext.OPTNL_ARG(stash), default="", do_rstrip=False)
+        stash_diff = commit_cache.get_stash_diff(stash)
+        return "" if stash_diff is None else stash_diff
     @staticmethod
     def get_stashes_table_data():
         from . import stashes
@@ -351,8 +356,14 @@ class Interface:
     @staticmethod
     def launch_difftool(*args):
         return runext.run_cmd_in_bgnd(["git", "difftool", "--noprompt"] + list(args))
+    @staticmethod
+    def new_refresh_generation():
+        fsdb_git.refresh_status_generation()
 
 def index_is_empty():
+    status_snapshot = fsdb_git.get_status_snapshot()
+    if status_snapshot is not None:
+        return status_snapshot.index_is_empty
     stdout = runext.run_get_cmd(["git", "status", "--porcelain", "--untracked-files=no"])
     for line in stdout.splitlines():
         if line[0] != " ":
@@ -14,10 +14,12 @@
 ### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import collections
+import time
 
 from gi.repository import Gdk
 from gi.repository import Gtk
 from gi.repository import GObject
+from gi.repository import GLib
 
 from ... import scm
 from ...scm.gui import scm_actions
@@ -30,37 +32,140 @@ from ...gtx import actions
 from ...gtx import table
 from ... import wsm_icons
 
+from .. import git_utils
+from .. import log_index
+
 from . import git_gui_ifce
 from . import commit
 
+# NB: "when" is the commit time (seconds since the epoch) which is only
+# made relative to now when it's drawn
 LogListRow = collections.namedtuple("LogListRow",    ["commit", "abbrevcommit", "author", "when", "subject"])
 
+def format_relative_time(timestamp, now=None):
+    '''Format timestamp relative to now in the same way as git's "%cr"'''
+    diff = int((time.time() if now is None else now) - timestamp)
+    if diff < 0:
+        return _("in the future")
+    def ago(number, unit):
+        return _("{0} {1}{2} ago").format(number, unit, "" if number == 1 else "s")
+    if diff < 90:
+        return ago(diff, _("second"))
+    diff = (diff + 30) // 60
+    if diff < 90:
+        return ago(diff, _("minute"))
+    diff = (diff + 30) // 60
+    if diff < 36:
+        return ago(diff, _("hour"))
+    diff = (diff + 12) // 24
+    if diff < 14:
+        return ago(diff, _("day"))
+    if diff < 70:
+        return ago((diff + 3) // 7, _("week"))
+    if diff < 365:
+        return ago((diff + 15) // 30, _("month"))
+    if diff < 1825:
+        total_months = (diff * 12 * 2 + 365) // (365 * 2)
+        years, months = divmod(total_months, 12)
+        if months:
+            return _("{0} year{1}, {2} month{3} ago").format(years, "" if years == 1 else "s", months, "" if months == 1 else "s")
+        return ago(years, _("year"))
+    return ago((diff + 183) // 365, _("year"))
+
+class PagedLog:
+    '''The history from tip as a lazily filled sequence of LogListRow
+    fetched a page at a time (and only when asked for) from the log index
+    if there is one or "git log" otherwise'''
+    PAGE_SIZE = 500
+    # NUL terminated fields
+    FORMAT = "%H%x00%h%x00%an%x00%ct%x00%s%x00"
+    def __init__(self, tip, log_index_snapshot=None):
+        self.tip = tip
+        self._rows = list()
+        self._is_complete = not tip
+        self._length = None
+        self._log_index = log_index_snapshot
+    @property
+    def num_loaded(self):
+        return len(self._rows)
+    @property
+    def is_complete(self):
+        return self._is_complete
+    def _fetch_page_from_index(self):
+        start = len(self._rows)
+        stop = min(start + self.PAGE_SIZE, len(self._log_index))
+        page = list()
+        for index in range(start, stop):
+            sha, abbrev, author, _author_time, commit_time, subject = self._log_index.get_record(index)
+            page.append(LogListRow(commit=sha, abbrevcommit=abbrev, author=author, when=commit_time, subject=subject))
+        self._rows.extend(page)
+        if stop == len(self._log_index):
+            self._is_complete = True
+        return page
+    def _fetch_page(self):
+        if self._log_index is not None:
+            return self._fetch_page_from_index()
+        cmd = ["git", "log", "--pretty=tformat:" + self.FORMAT, "--skip={0}".format(len(self._rows)), "-n", str(self.PAGE_SIZE), self.tip]
+        data = runext.run_get_cmd(cmd, default=b"", do_rstrip=False, decode_stdout=False)
+        page = [LogListRow(commit, abbrev, author, int(when), subject) for commit, abbrev, author, when, subject in git_utils.iter_for_each_ref_records(data, len(LogListRow._fields))]
+        self._rows.extend(page)
+        if len(page) < self.PAGE_SIZE:
+            self._is_complete = True
+        return page
+    def load_more(self):
+        '''Fetch the next page and return its rows (empty if there are no more)'''
+        return [] if self._is_complete else self._fetch_page()
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        while index >= len(self._rows) and not self._is_complete:
+            self._fetch_page()
+        return self._rows[index]
+    def __len__(self):
+        if self._is_complete:
+            return len(self._rows)
+        if self._log_index is not None:
+            return len(self._log_index)
+        if self._length is None:
+            # much cheaper than fetching it all
+            count = runext.run_get_cmd(["git", "rev-list", "--count", self.tip], default="0")
+            self._length = int(count) if count.isdigit() else 0
+        return self._length
+    def __iter__(self):
+        index = 0
+        while True:
+            if index >= len(self._rows) and not self.load_more():
+                return
+            yield self._rows[index]
+            index += 1
+
 class LogTableData(table.TableData):
     def _get_data_text(self, h):
-        text = runext.run_get_cmd(["git", "log", "--pretty=format:%H%n%h%n%an%n%cr%n%s"], default="")
-        h.update(text.encode())
-        return text
+        # the history is identified by its tip so there's no need to get it
+        # all and (unlike relative times) it doesn't change as time passes
+        tip = runext.run_get_cmd(["git", "rev-parse", "--verify", "-q", "HEAD"], default="")
+        h.update(tip.encode())
+        return tip
     def _finalize(self, pdt):
-        self._rows = (LogListRow(*lines) for lines in utils.iter_chunks(pdt.splitlines(), 5))
-        #self._lines = pdt.splitlines()
-    #def iter_rows(self):
-        #for i, line in enumerate(self._lines):
-            #chooser = i % 5
-            #if chooser == 0:
-                #commit = line
-            #elif chooser == 1:
-                #abbrevcommit = line
-            #elif chooser == 2:
-                #author = line
-            #elif chooser == 3:
-                #when = line
-            #else:
-                #yield LogListRow(commit=commit, abbrevcommit=abbrevcommit, author=author, when=when, subject=line)
+        self._rows = PagedLog(pdt, log_index.get_log_index(pdt))
+    @property
+    def rows(self):
+        return self._rows
+    def iter_rows(self):
+        '''Iterate over the rows loaded so far (loading the first page if need be)'''
+        if self._rows.num_loaded == 0:
+            self._rows.load_more()
+        for index in range(self._rows.num_loaded):
+            yield self._rows[index]
+    def load_more(self):
+        return self._rows.load_more()
 
 class LogListView(table.MapManagedTableView, scm_actions.WDListenerMixin):
     class MODEL(table.MapManagedTableView.MODEL):
         ROW = LogListRow
-        TYPES = ROW(commit=GObject.TYPE_STRING, abbrevcommit=GObject.TYPE_STRING, author=GObject.TYPE_STRING, when=GObject.TYPE_STRING, subject=GObject.TYPE_STRING,)
+        TYPES = ROW(commit=GObject.TYPE_STRING, abbrevcommit=GObject.TYPE_STRING, author=GObject.TYPE_STRING, when=GObject.TYPE_INT64, subject=GObject.TYPE_STRING,)
         def get_commit_sha1(self, plist_iter):
             return self.get_value_named(plist_iter, "commit")
         def get_commit_abbrev_sha1(self, plist_iter):
@@ -79,10 +184,53 @@ class LogListView(table.MapManagedTableView, scm_actions.WDListenerMixin):
     </ui>
     """
     SPECIFICATION = table.simple_text_specification(MODEL, ("Commit", "abbrevcommit", 0.0), ("Author", "author", 0.0), ("When", "when", 0.0), ("Subject", "subject", 0.0))
+    WHEN_REDRAW_INTERVAL = 60 # seconds
     def __init__(self, size_req=None):
         table.MapManagedTableView.__init__(self, size_req=size_req)
         scm_actions.WDListenerMixin.__init__(self)
+        self._set_up_when_column()
+        self._vadjustment_handler = None
+        self.connect("notify::vadjustment", lambda _widget, _pspec: self._track_vadjustment())
+        self._track_vadjustment()
         self.set_contents()
+    def _set_up_when_column(self):
+        # render the relative time at draw time so that the rows (and the
+        # table's digest) don't change just because time has passed
+        when_index = self.MODEL.ROW._fields.index("when")
+        for column in self.get_columns():
+            if column.get_title() != "When":
+                continue
+            for cell in column.get_cells():
+                column.clear_attributes(cell)
+                column.set_cell_data_func(cell, self._when_cell_data_func, when_index)
+        # a redraw (rather than a reload) keeps the relative times fresh
+        timeout_id = GLib.timeout_add_seconds(self.WHEN_REDRAW_INTERVAL, self._redraw_when_cb)
+        self.connect("destroy", lambda _widget: GLib.source_remove(timeout_id))
+    @staticmethod
+    def _when_cell_data_func(_column, cell, model, model_iter, when_index):
+        cell.set_property("text", format_relative_time(model.get_value(model_iter, when_index)))
+    def _redraw_when_cb(self):
+        if self.get_mapped():
+            self.queue_draw()
+        return True
+    def _track_vadjustment(self):
+        # load further pages as the user scrolls towards the end
+        if self._vadjustment_handler is not None:
+            adjustment, handler_id = self._vadjustment_handler
+            adjustment.disconnect(handler_id)
+            self._vadjustment_handler = None
+        adjustment = self.get_vadjustment()
+        if adjustment is not None:
+            self._vadjustment_handler = (adjustment, adjustment.connect("value-changed", self._vadjustment_value_changed_cb))
+    def _vadjustment_value_changed_cb(self, adjustment):
+        if adjustment.get_value() + 2 * adjustment.get_page_size() >= adjustment.get_upper():
+            self._append_next_page()
+    def _append_next_page(self):
+        table_db = getattr(self, "_table_db", None)
+        if table_db is None or not hasattr(table_db, "load_more"):
+            return
+        for row in table_db.load_more():
+            self.get_model().append(row)
     def populate_action_groups(self):
         self.action_groups[actions.AC_SELN_UNIQUE].add_actions(
             [
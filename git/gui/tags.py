@@ -23,7 +23,6 @@ from ... import scm
 from ...scm.gui import scm_actions
 
 from ...bab import enotify
-from ...bab import runext
 from ...bab import utils
 
 from ...gtx import actions
@@ -32,6 +31,8 @@ from ...gtx import table
 from ...gtx import text_edit
 from ... import wsm_icons
 
+from .. import git_utils
+
 from . import git_gui_ifce
 
 TagListRow = collections.namedtuple("TagListRow",    ["name", "annotation"])
@@ -45,20 +46,15 @@ class TagListModel(table.MapManagedTableView.MODEL):
         return self.get_value_named(plist_iter, "annotation")
 
 class TagTableData(table.TableData):
+    # name, object type (only annotated tags are "tag"), target and the
+    # annotation's first line (NB: not its subject which joins the lines)
+    CMD = ["git", "for-each-ref", "--format=%(refname)%00%(objecttype)%00%(objectname)%00%(contents:lines=1)%00", "refs/tags"]
     def _get_data_text(self, h):
-        text = runext.run_get_cmd(["git", "tag"], default="")
-        h.update(text.encode())
-        return text
+        data = git_utils.get_refs_cmd_output(self.CMD, ["refs/tags"])
+        h.update(data)
+        return data
     def _finalize(self, pdt):
-        # for efficiency's sake we'll use a generator here
-        self._rows = (TagListRow(name=line, annotation=self._get_annotation(line)) for line in pdt.splitlines())
-    def _get_annotation(self, name):
-        result = runext.run_cmd(["git", "rev-parse", name])
-        result = runext.run_cmd(["git", "cat-file", "-p", result.stdout.strip()])
-        if result.stdout.startswith("object"):
-            cat_lines = result.stdout.splitlines()
-            return cat_lines[5] if len(cat_lines) > 5 else ""
-        return ""
+        self._rows = [TagListRow(name=refname[len("refs/tags/"):], annotation=first_line if obj_type == "tag" else "") for refname, obj_type, _target, first_line in git_utils.iter_for_each_ref_records(pdt, 4)]
 
 class TagListView(table.MapManagedTableView, scm_actions.WDListenerMixin):
     MODEL = TagListModel
@@ -0,0 +1,272 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""A persistent (on disk) index of a branch's commit log so that the log
+needn't be re-derived from "git log" every time that it's displayed.
+
+Each index is a directory of column files (oldest commit first so that
+new commits are appended) and a "meta" file recording the tip the index
+was built from and each column's valid length.  The meta file is always
+written last (and atomically) so an interrupted update just leaves some
+ignored bytes at the end of the columns.
+"""
+
+__all__ = ["LogIndex", "LogIndexSnapshot", "get_log_index"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import array
+import hashlib
+import os
+import threading
+
+from ..bab import runext
+
+from . import git_utils
+
+from ... import CONFIG_DIR_PATH
+
+LOG_FORMAT = "%H%x00%h%x00%an%x00%at%x00%ct%x00%s%x00"
+_NUM_FIELDS = 6
+
+_VERSION = "1"
+_SHA_LEN = 20
+_INT_COLUMNS = ("author_time", "commit_time")
+_STR_COLUMNS = ("abbrev", "author", "subject")
+
+def _iter_log_records(data):
+    for sha, abbrev, author, author_time, commit_time, subject in git_utils.iter_for_each_ref_records(data, _NUM_FIELDS):
+        yield (sha, abbrev, author, int(author_time), int(commit_time), subject)
+
+def _read_file(file_path, length):
+    with open(file_path, "rb") as fobj:
+        data = fobj.read(length)
+    if len(data) != length:
+        raise ValueError(file_path)
+    return data
+
+def _write_file(file_path, data, append):
+    with open(file_path, "ab" if append else "wb") as fobj:
+        fobj.write(data)
+
+class LogIndex:
+    '''The columns of a branch's commit log (indexed newest first)'''
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.tip = None
+        self._shas = b""
+        self._ints = {name: array.array("q") for name in _INT_COLUMNS}
+        self._strs = {name: b"" for name in _STR_COLUMNS}
+        self._offsets = {name: array.array("Q", [0]) for name in _STR_COLUMNS}
+    def __len__(self):
+        return len(self._shas) // _SHA_LEN
+    def _column_path(self, name):
+        return os.path.join(self.dir_path, name)
+    def _get_lengths(self):
+        lengths = {"sha": len(self._shas)}
+        for name in _INT_COLUMNS:
+            lengths[name] = len(self._ints[name]) * self._ints[name].itemsize
+        for name in _STR_COLUMNS:
+            lengths[name] = len(self._strs[name])
+            lengths[name + ".offsets"] = len(self._offsets[name]) * self._offsets[name].itemsize
+        return lengths
+    def load(self):
+        '''Load the index from disk returning whether it was (validly) there'''
+        try:
+            with open(self._column_path("meta")) as fobj:
+                lines = fobj.read().splitlines()
+            if not lines or lines[0] != _VERSION:
+                return False
+            tip = lines[1]
+            lengths = {name: int(length) for name, length in (line.split(" ") for line in lines[2:])}
+            shas = _read_file(self._column_path("sha"), lengths["sha"])
+            ints = dict()
+            for name in _INT_COLUMNS:
+                ints[name] = array.array("q")
+                ints[name].frombytes(_read_file(self._column_path(name), lengths[name]))
+            strs = dict()
+            offsets = dict()
+            for name in _STR_COLUMNS:
+                strs[name] = _read_file(self._column_path(name), lengths[name])
+                offsets[name] = array.array("Q")
+                offsets[name].frombytes(_read_file(self._column_path(name + ".offsets"), lengths[name + ".offsets"]))
+        except (OSError, ValueError, KeyError, IndexError):
+            return False
+        num_commits = len(shas) // _SHA_LEN
+        if any(len(column) != num_commits for column in ints.values()) or any(len(column) != num_commits + 1 for column in offsets.values()):
+            return False
+        self.tip, self._shas, self._ints, self._strs, self._offsets = tip, shas, ints, strs, offsets
+        return True
+    def _write_meta(self):
+        lines = [_VERSION, self.tip] + ["{0} {1}".format(name, length) for name, length in sorted(self._get_lengths().items())]
+        tmp_file_path = self._column_path("meta.tmp")
+        with open(tmp_file_path, "w") as fobj:
+            fobj.write("\n".join(lines) + "\n")
+        os.replace(tmp_file_path, self._column_path("meta"))
+    def _add(self, records, tip, append):
+        '''Add records (newest first) to the index (or replace it)'''
+        new_shas = bytearray()
+        new_ints = {name: array.array("q") for name in _INT_COLUMNS}
+        new_strs = {name: bytearray() for name in _STR_COLUMNS}
+        new_offsets = {name: array.array("Q") for name in _STR_COLUMNS}
+        base = {name: len(self._strs[name]) if append else 0 for name in _STR_COLUMNS}
+        for sha, abbrev, author, author_time, commit_time, subject in reversed(records):
+            new_shas += bytes.fromhex(sha)
+            new_ints["author_time"].append(author_time)
+            new_ints["commit_time"].append(commit_time)
+            for name, value in (("abbrev", abbrev), ("author", author), ("subject", subject)):
+                new_strs[name] += value.encode()
+                new_offsets[name].append(base[name] + len(new_strs[name]))
+        if append:
+            # discard any remnants of an interrupted update
+            for name, length in self._get_lengths().items():
+                with open(self._column_path(name), "ab") as fobj:
+                    fobj.truncate(length)
+        else:
+            os.makedirs(self.dir_path, exist_ok=True)
+            new_offsets = {name: array.array("Q", [0]) + column for name, column in new_offsets.items()}
+        _write_file(self._column_path("sha"), new_shas, append)
+        for name in _INT_COLUMNS:
+            _write_file(self._column_path(name), new_ints[name].tobytes(), append)
+        for name in _STR_COLUMNS:
+            _write_file(self._column_path(name), new_strs[name], append)
+            _write_file(self._column_path(name + ".offsets"), new_offsets[name].tobytes(), append)
+        # build the new columns before replacing the old so that readers
+        # (e.g. a view's paged log) never see them half done
+        if append:
+            shas = self._shas + new_shas
+            ints = {name: self._ints[name] + new_ints[name] for name in _INT_COLUMNS}
+            strs = {name: self._strs[name] + new_strs[name] for name in _STR_COLUMNS}
+            offsets = {name: self._offsets[name] + new_offsets[name] for name in _STR_COLUMNS}
+        else:
+            shas, ints, strs, offsets = bytes(new_shas), new_ints, {name: bytes(column) for name, column in new_strs.items()}, new_offsets
+        self._shas, self._ints, self._strs, self._offsets = shas, ints, strs, offsets
+        self.tip = tip
+        self._write_meta()
+    def append(self, records, tip):
+        self._add(records, tip, append=True)
+    def rebuild(self, records, tip):
+        self._add(records, tip, append=False)
+    def snapshot(self):
+        '''Return an unchanging view of the index as it is now (updates
+        replace the columns rather than modifying them)'''
+        return LogIndexSnapshot(self.tip, self._shas, self._ints, self._strs, self._offsets)
+    def get_record(self, index):
+        return self.snapshot().get_record(index)
+
+class LogIndexSnapshot:
+    __slots__ = ("tip", "_shas", "_ints", "_strs", "_offsets")
+    def __init__(self, tip, shas, ints, strs, offsets):
+        self.tip = tip
+        self._shas = shas
+        self._ints = ints
+        self._strs = strs
+        self._offsets = offsets
+    def __len__(self):
+        return len(self._shas) // _SHA_LEN
+    def _get_str(self, name, position):
+        offsets = self._offsets[name]
+        return self._strs[name][offsets[position]:offsets[position + 1]].decode(errors="replace")
+    def get_record(self, index):
+        '''Return (sha, abbrev, author, author_time, commit_time, subject)
+        for the index'th newest commit'''
+        num_commits = len(self)
+        if index < 0:
+            index += num_commits
+        position = num_commits - 1 - index
+        if position < 0 or index < 0:
+            raise IndexError(index)
+        sha = self._shas[position * _SHA_LEN:(position + 1) * _SHA_LEN].hex()
+        return (sha, self._get_str("abbrev", position), self._get_str("author", position), self._ints["author_time"][position], self._ints["commit_time"][position], self._get_str("subject", position))
+
+_INDICES = dict()
+_BUILDING = set()
+_LOCK = threading.Lock()
+
+def _get_index_dir_path(git_dirs, ref_name):
+    # per user data so it lives in our config directory keyed by repository
+    repo_key = hashlib.sha1(os.path.abspath(git_dirs[1]).encode()).hexdigest()
+    ref_key = hashlib.sha1(ref_name.encode()).hexdigest()
+    return os.path.join(CONFIG_DIR_PATH, "log-index", repo_key, ref_key)
+
+def _get_head_ref_name(git_dirs):
+    try:
+        with open(os.path.join(git_dirs[0], "HEAD")) as fobj:
+            head = fobj.read().strip()
+    except (OSError, UnicodeError):
+        return None
+    return head[len("ref:"):].strip() if head.startswith("ref:") else "HEAD"
+
+def _get_log_records(rev_spec):
+    data = runext.run_get_cmd(["git", "log", "--pretty=tformat:" + LOG_FORMAT, rev_spec], default=None, do_rstrip=False, decode_stdout=False)
+    return None if data is None else list(_iter_log_records(data))
+
+def _rebuild(index, tip):
+    try:
+        records = _get_log_records(tip)
+        if records is not None:
+            with _LOCK:
+                index.rebuild(records, tip)
+    except OSError:
+        pass
+    finally:
+        with _LOCK:
+            _BUILDING.discard(index.dir_path)
+
+def get_log_index(tip, wait=False):
+    '''Return a snapshot of the current branch's LogIndex brought up to date with tip
+    (by appending the commits since the recorded tip) or None if there
+    isn't one yet, in which case it is (re)built in the background (or
+    before returning if wait is True).'''
+    git_dirs = git_utils.get_git_dirs()
+    if not tip or git_dirs is None:
+        return None
+    ref_name = _get_head_ref_name(git_dirs)
+    if ref_name is None:
+        return None
+    dir_path = _get_index_dir_path(git_dirs, ref_name)
+    with _LOCK:
+        if dir_path in _BUILDING:
+            return None
+        index = _INDICES.get(dir_path)
+        if index is None:
+            index = LogIndex(dir_path)
+            if not index.load():
+                index.tip = None
+            _INDICES[dir_path] = index
+        if index.tip == tip:
+            return index.snapshot()
+    # "git log" orders the commits of a linear range on top of the old tip
+    # ahead of the old history but may interleave those merged from side
+    # branches with it so only the former can be appended
+    rev_range = "{0}..{1}".format(index.tip, tip)
+    if index.tip is not None and runext.run_cmd(["git", "merge-base", "--is-ancestor", index.tip, tip]).is_ok and not runext.run_get_cmd(["git", "rev-list", "-n", "1", "--merges", rev_range], default="x"):
+        records = _get_log_records(rev_range)
+        if records is not None:
+            try:
+                with _LOCK:
+                    index.append(records, tip)
+                return index.snapshot()
+            except OSError:
+                pass
+    # new, the history has been rewritten or there's been a merge
+    with _LOCK:
+        _BUILDING.add(dir_path)
+    if wait:
+        _rebuild(index, tip)
+        return index.snapshot() if index.tip == tip else None
+    threading.Thread(target=_rebuild, args=(index, tip), daemon=True).start()
+    return None
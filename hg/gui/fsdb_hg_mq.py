@@ -23,6 +23,8 @@ from ...bab import utils
 
 from ...patch_diff import patchlib
 
+from ...scm import fs_watcher
+
 from ...gtx import fsdb
 
 FSTATUS_MODIFIED = 'M'
@@ -57,6 +59,10 @@ class FileData(fsdb.FileData):
 class DirData(fsdb.DirData):
     STATUS_DECO_MAP = _STATUS_DECO_MAP
 
+def _run_get_cmd_cached(cmd, default=""):
+    # only rerun if the file watcher has seen something change since
+    return fs_watcher.get_cached_output(tuple(cmd), lambda: runext.run_get_cmd(cmd, default=default))
+
 def get_qparent():
     return runext.run_get_cmd(["hg", "log", "--template", "{rev}", "-rqparent"], default=None)
 
@@ -112,9 +118,9 @@ class WsFileDb(fsdb.GenericSnapshotWsFileDb):
         self._cmd_rev = ["--rev", "qparent"] if get_qparent() else []
         fsdb.GenericSnapshotWsFileDb.__init__(self, name=None, dir_path=None, status=None, clean_status=None, **kwargs)
     def _get_file_data_text(self, h):
-        file_data_text = runext.run_get_cmd(["hg", "status", "-marduiC"] + self._cmd_rev)
+        file_data_text = _run_get_cmd_cached(["hg", "status", "-marduiC"] + self._cmd_rev)
         h.update(file_data_text.encode())
-        unresolved_file_text = runext.run_get_cmd(["hg", "resolve", "--list"])
+        unresolved_file_text = _run_get_cmd_cached(["hg", "resolve", "--list"])
         h.update(unresolved_file_text.encode())
         return (file_data_text, unresolved_file_text)
     @staticmethod
@@ -152,10 +158,10 @@ class TopPatchFileDb(fsdb.GenericTopPatchFileDb):
         fsdb.GenericTopPatchFileDb.__init__(self)
     @staticmethod
     def _get_applied_patch_count():
-        return len(runext.run_get_cmd(["hg", "qapplied"], default="").splitlines())
+        return len(_run_get_cmd_cached(["hg", "qapplied"]).splitlines())
     @staticmethod
     def _get_parent_rev():
-        applied_patches = runext.run_get_cmd(["hg", "qapplied"], default="").splitlines()
+        applied_patches = _run_get_cmd_cached(["hg", "qapplied"]).splitlines()
         if not applied_patches:
             return None
         elif len(applied_patches) > 1:
@@ -165,9 +171,9 @@ class TopPatchFileDb(fsdb.GenericTopPatchFileDb):
     def _get_patch_data_text(self, h):
         if self._parent_rev is None:
             return ("", "")
-        patch_status_text = runext.run_get_cmd(["hg", "status", "-mardC", "--rev", self._parent_rev])
+        patch_status_text = _run_get_cmd_cached(["hg", "status", "-mardC", "--rev", self._parent_rev])
         h.update(patch_status_text.encode())
-        resolve_list_text = runext.run_get_cmd(["hg", "resolve", "--list"])
+        resolve_list_text = _run_get_cmd_cached(["hg", "resolve", "--list"])
         h.update(resolve_list_text.encode())
         return (patch_status_text, resolve_list_text)
     @staticmethod
@@ -188,7 +194,9 @@ PATCHLIB_TO_STATUS_MAP = {
 def iterate_patchlib_file_data(patch_text):
     if not patch_text:
         return
-    for fdata in patchlib.Patch.parse_text(patch_text).iterate_file_paths_plus(1):
+    # only (re)parsed if the text has changed since it was last parsed
+    epatch = patchlib.PATCH_FILE_CACHE.get_text_patch(patch_text)
+    for fdata in epatch.iterate_file_paths_plus(1):
         yield (fdata.path, PATCHLIB_TO_STATUS_MAP[fdata.status], fdata.expath)
 
 class PatchFileDb(fsdb.GenericPatchFileDb):
@@ -15,7 +15,6 @@
 
 '''SCM interface for Mercurial (hg)'''
 
-import errno
 import hashlib
 import re
 
@@ -36,6 +35,8 @@ from ...bab.runext import OPTNL_ARG_LIST
 from . import fsdb_hg_mq
 
 from ... import scm
+from ...scm import backend_caps
+from ...scm import pgnd_markers
 
 # TODO: replace "rollback" with "commit --amend"
 
@@ -87,16 +88,8 @@ class Mercurial:
     name = "hg"
     @staticmethod
     def __getattr__(attr_name):
-        if attr_name == "is_available":
-            '''Is the currend working directory in a valid git repository?'''
-            try:
-                return runext.run_cmd(["hg", "version"]).is_ok
-            except OSError as edata:
-                if edata.errno == errno.ENOENT:
-                    return False
-                else:
-                    raise
-        if attr_name == "in_valid_wspce": return runext.run_cmd(["hg", "root"]).is_ok
+        if attr_name == "is_available": return backend_caps.get_tool("hg").is_available
+        if attr_name == "in_valid_wspce": return backend_caps.get_in_valid_wspce("hg", lambda: runext.run_cmd(["hg", "root"]).is_ok)
     @staticmethod
     def dir_is_in_valid_pgnd(dir_path=None):
         '''Is the current working (or specified) directory in a valid hg repository?'''
@@ -330,6 +323,9 @@ class Mercurial:
         return [[match.group(1), match.group(2)] for match in (path_re.match(line) for line in runext.run_get_cmd(cmd).splitlines()) if match]
     @staticmethod
     def get_playground_root():
+        root = pgnd_markers.get_playground_root("hg")
+        if root is not NotImplemented:
+            return root
         return runext.run_get_cmd(["hg", "root"], default=None)
     @staticmethod
     def get_revision(file_path=None):
@@ -384,6 +380,9 @@ class Mercurial:
         elif len(result.stdout.splitlines()) > 1:
             return (False, _("There is an incomplete merge in progress."))
         return (True, "")
+    @staticmethod
+    def new_refresh_generation():
+        pass
 
 SCM = Mercurial()
 from ...scm.gui import scm_gui_ifce
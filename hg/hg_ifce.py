@@ -24,6 +24,8 @@ import re
 
 from ..bab import runext
 
+from ..scm import backend_caps
+
 from ..patch_diff import patchlib
 
 NOSUCH_RE = re.compile(_("^.*: No such file or directory$\n?"), re.M)
@@ -32,15 +34,8 @@ class Interface:
     name = "hg"
     @staticmethod
     def __getattr__(attr_name):
-        if attr_name == "is_available":
-            try:
-                return runext.run_cmd(["hg", "version"]).is_ok
-            except OSError as edata:
-                if edata.errno == errno.ENOENT:
-                    return False
-                else:
-                    raise
-        if attr_name == "in_valid_wspce": return runext.run_cmd(["hg", "root"]).is_ok
+        if attr_name == "is_available": return backend_caps.get_tool("hg").is_available
+        if attr_name == "in_valid_wspce": return backend_caps.get_in_valid_wspce("hg", lambda: runext.run_cmd(["hg", "root"]).is_ok)
         raise AttributeError(attr_name)
     @staticmethod
     def dir_is_in_valid_pgnd(dir_path=None):
@@ -15,18 +15,27 @@
 
 '''Encode/decode binary bytes to/from text strings using git's coding'''
 
+import array
 import collections
 import re
+import sys
 
 class Error(Exception): pass
 class ParseError(Error): pass
-class RangerError(Error): pass
+class RangeError(Error): pass
+RangerError = RangeError
 
 ENCODE = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!#$%&()*+-;<=>?@^_`{|}~"
 assert len(set(ENCODE)) == 85
 DECODE = { chr(ENCODE[index]) : index for index in range(len(ENCODE)) }
 assert len(DECODE) == 85
 
+# Translation tables for converting between base 85 digit values and
+# characters a whole string at a time (0xFF marks illegal characters)
+_ENCODE_TABLE = ENCODE + bytes(256 - len(ENCODE))
+_DECODE_TABLE = bytes(ENCODE.find(bytes([char])) & 0xFF for char in range(256))
+_ILLEGAL = 0xFF
+
 Encoding = collections.namedtuple("Encoding", ["string", "size"])
 
 def is_consistent(encoding):
@@ -35,51 +44,52 @@ def is_consistent(encoding):
     max_bytes = (len(encoding.string) // 5) * 4
     return (max_bytes >= encoding.size) and (max_bytes - encoding.size < 4)
 
+def _words_fm_bytes(data):
+    '''Return data (zero padded) as a list of big endian 32 bit values'''
+    words = array.array("I")
+    assert words.itemsize == 4
+    words.frombytes(bytes(data) + bytes(-len(data) % 4))
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tolist()
+
+def _bytes_fm_words(words):
+    words = array.array("I", words)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tobytes()
+
+def _encode_words(words):
+    digits = bytearray(len(words) * 5)
+    digits[0::5] = bytes(word // 52200625 for word in words)
+    digits[1::5] = bytes(word // 614125 % 85 for word in words)
+    digits[2::5] = bytes(word // 7225 % 85 for word in words)
+    digits[3::5] = bytes(word // 85 % 85 for word in words)
+    digits[4::5] = bytes(word % 85 for word in words)
+    return digits.translate(_ENCODE_TABLE).decode("ascii")
+
+def _decode_words(string):
+    try:
+        digits = string.encode("ascii").translate(_DECODE_TABLE)
+    except UnicodeEncodeError:
+        digits = bytes([_ILLEGAL])
+    if _ILLEGAL in digits:
+        raise ParseError(_("Illegal git base 85 character"))
+    words = [(((d0 * 85 + d1) * 85 + d2) * 85 + d3) * 85 + d4 for d0, d1, d2, d3, d4 in zip(digits[0::5], digits[1::5], digits[2::5], digits[3::5], digits[4::5])]
+    if words and max(words) > _MAX_VAL:
+        raise RangeError(_("{0} too big.").format(max(words)))
+    return words
+
 # bytes() in Encoding() out
 def encode(data):
-    index = 0
-    estring = bytes()
-    size = len(data)
-    while index < size:
-        acc = 0
-        for cnt in (24, 16, 8, 0):
-            acc |= data[index] << cnt
-            index += 1
-            if index == size:
-                break
-        snippet = bytes()
-        for _cnt in range(5):
-            val = acc % 85
-            acc //= 85
-            snippet = bytes([ENCODE[val]]) + snippet
-        estring += snippet
-    return Encoding(estring.decode("utf8"), size)
+    return Encoding(_encode_words(_words_fm_bytes(data)), len(data))
 
 _MAX_VAL = 0xFFFFFFFF
 
 # Encoding() in bytes() out
 def decode(encoding):
     assert is_consistent(encoding)
-    data = bytearray(encoding.size)
-    dindex = 0
-    sindex = 0
-    while dindex < encoding.size:
-        acc = 0
-        for _cnt in range(5):
-            try:
-                acc = acc * 85 + DECODE[encoding.string[sindex]]
-            except KeyError:
-                raise ParseError(_("Illegal git base 85 character"))
-            sindex += 1
-        if acc > _MAX_VAL:
-            raise RangeError(_("{0} too big.").format(acc))
-        for _cnt in range(4):
-            if dindex == encoding.size:
-                break
-            acc = (acc << 8) | (acc >> 24)
-            data[dindex] = acc % 256
-            dindex += 1
-    return data
+    return bytearray(_bytes_fm_words(_decode_words(encoding.string))[:encoding.size])
 
 # test over a range of data sizes
 _TESTDATA = b"uioyf2oyqo;3nhi8uydjauyo98ua 54\000jhkh\034hh;kjjh"
@@ -107,22 +117,36 @@ def decode_size(char):
 def encode_to_lines(data, max_line_length=1 + (MAX_BYTES_PER_LINE // 4) * 5):
     assert max_line_length > 5
     bytes_per_line = min(((max_line_length - 1) // 5) * 4, MAX_BYTES_PER_LINE)
-    index = 0
+    # lines hold whole groups so the data can be encoded in one go
+    estring = encode(data).string
     lines = []
-    while index < len(data):
-        encoding = encode(data[index:index + bytes_per_line])
-        lines.append("{0}{1}\n".format(encode_size(encoding.size), encoding.string))
-        index += bytes_per_line
+    for index in range(0, len(data), bytes_per_line):
+        size = min(bytes_per_line, len(data) - index)
+        start = (index // 4) * 5
+        lines.append("{0}{1}\n".format(encode_size(size), estring[start:start + ((size + 3) // 4) * 5]))
     return lines
 
 def decode_line(line):
     return decode(Encoding(line[1:].rstrip(), decode_size(line[0])))
 
 def decode_lines(lines):
-    data = bytes()
+    '''Decode a block of lines into one preallocated buffer'''
+    sizes = []
+    strings = []
     for line in lines:
-        data += decode_line(line)
-    return data
+        encoding = Encoding(line[1:].rstrip(), decode_size(line[0]))
+        assert is_consistent(encoding)
+        sizes.append(encoding.size)
+        strings.append(encoding.string)
+    raw = _bytes_fm_words(_decode_words("".join(strings)))
+    data = bytearray(sum(sizes))
+    dindex = 0
+    rindex = 0
+    for size, string in zip(sizes, strings):
+        data[dindex:dindex + size] = raw[rindex:rindex + size]
+        dindex += size
+        rindex += (len(string) // 5) * 4
+    return bytes(data)
 
 LINE_CRE = re.compile("^([a-zA-Z])(([0-9a-zA-Z" + re.sub("-", "", str(ENCODE[62:])) + "-]{5})+)$")
 
@@ -16,7 +16,12 @@
 
 '''Implement git's diff-delta.c, patch-delta.c and delta.h'''
 
+import array
 import copy
+import mmap
+import os
+import struct
+import sys
 
 from ..patch_diff import c_idioms
 
@@ -125,7 +130,11 @@ class EmptyTargetBuffer(EmptyBuffer): pass
 class InvalidDelta(PatchError): pass
 class InvalidSourceSize(PatchError): pass
 
-class DeltaIndex(object):
+# The following (c_idioms based) implementation is a direct translation of
+# the C code and is retained as the reference against which the faster
+# (native Python) implementation further down is checked.
+
+class CIdiomsDeltaIndex(object):
     # maximum hash entry list for the same hash bucket
     HASH_LIMIT = 64
     class Entry(object):
@@ -163,7 +172,7 @@ class DeltaIndex(object):
             else:
                 # Unlike C version we can put them into the correct place
                 # in the correct bucket correctly so we do.
-                prev_entry = DeltaIndex.Entry(data_ptr + RABIN_WINDOW, val)
+                prev_entry = CIdiomsDeltaIndex.Entry(data_ptr + RABIN_WINDOW, val)
                 self._hash_bucket[prev_entry.val & self._hash_mask].insert(0, prev_entry)
             data_ptr -= RABIN_WINDOW
         # Determine a limit on the number of entries in the same hash
@@ -177,29 +186,26 @@ class DeltaIndex(object):
         # uniformly to still preserve a good repartition across
         # the reference buffer.
         for hash_bucket in self._hash_bucket:
-            if len(hash_bucket) <= DeltaIndex.HASH_LIMIT:
+            if len(hash_bucket) <= CIdiomsDeltaIndex.HASH_LIMIT:
                 continue
-            # We leave exactly DeltaIndex.HASH_LIMIT entries in the bucket
+            # We leave exactly CIdiomsDeltaIndex.HASH_LIMIT entries in the bucket
             eindex = 1
             acc = 0
-            acc_step = len(hash_bucket) - DeltaIndex.HASH_LIMIT
-            for _dummy in range(DeltaIndex.HASH_LIMIT):
+            acc_step = len(hash_bucket) - CIdiomsDeltaIndex.HASH_LIMIT
+            for _dummy in range(CIdiomsDeltaIndex.HASH_LIMIT):
                 acc += acc_step
                 while acc > 0:
                     del hash_bucket[eindex]
-                    acc -= DeltaIndex.HASH_LIMIT
+                    acc -= CIdiomsDeltaIndex.HASH_LIMIT
                 eindex += 1
-            assert len(hash_bucket) == DeltaIndex.HASH_LIMIT
+            assert len(hash_bucket) == CIdiomsDeltaIndex.HASH_LIMIT
     def get_entries(self, val):
         return self._hash_bucket[val & self._hash_mask]
 
-def create_delta_index(data):
-    return DeltaIndex(data) if data and len(data) > 0 else 0
-
 MAX_OP_SIZE = (5 + 5 + 1 + RABIN_WINDOW + 7)
 DEFAULT_OUTSIZE = 8192
 
-def create_delta(delta_index, after_data, max_delta_size=None):
+def c_idioms_create_delta(delta_index, after_data, max_delta_size=None):
     class CountingIndex(c_idioms.Index):
         def __init__(self, start=0):
             c_idioms.Index.__init__(self, start)
@@ -307,7 +313,7 @@ def create_delta(delta_index, after_data, max_delta_size=None):
                 for jjj in range(-RABIN_WINDOW, 0):
                     val = (((val << 8) & 0xFFFFFFFF) | after_ptr[jjj]) ^ TANGO[val >> RABIN_SHIFT]
         if int(outpos) >= outsize - MAX_OP_SIZE:
-            outsize = outsize * 3 / 2
+            outsize = outsize * 3 // 2
             if max_delta_size and outsize >= max_delta_size:
                 outsize = max_delta_size + MAX_OP_SIZE + 1
             if max_delta_size and int(outpos) > max_delta_size:
@@ -317,12 +323,6 @@ def create_delta(delta_index, after_data, max_delta_size=None):
         out[outpos.inscnt_index] = outpos.inscnt
     return out[:int(outpos)]
 
-def diff_delta(before_data, after_data, max_delta_size=None):
-    delta_index = create_delta_index(before_data)
-    if delta_index:
-        return create_delta(delta_index, after_data, max_delta_size)
-    return None
-
 DELTA_SIZE_MIN = 4
 
 def get_delta_hdr_size(ptr):
@@ -336,7 +336,7 @@ def get_delta_hdr_size(ptr):
             break
     return size
 
-def patch_delta(src_data, delta):
+def c_idioms_patch_delta(src_data, delta):
     if not delta or len(delta) < DELTA_SIZE_MIN:
         raise InvalidDelta
     delta_ptr = c_idioms.Pointer(bytearray(delta))
@@ -376,3 +376,372 @@ def patch_delta(src_data, delta):
     if len(delta_ptr) != 0 or expected_result_size != len(out_data):
         raise PatchError("delta replay has gone wild {0}:{1}:{2}".format(len(delta_ptr), expected_result_size, len(out_data)))
     return out_data
+
+# Native Python implementation.  This works directly on bytes (or
+# memoryview) objects using integer offsets and stores the index in
+# flat arrays (in the manner of the C version's packed index) instead
+# of one Entry object per block.  It produces identical output to the
+# c_idioms implementation above.
+
+def _as_byte_buffer(data):
+    return data if isinstance(data, bytes) else memoryview(data).cast("B")
+
+# Rabin's polynomial is linear so two steps (i.e. a byte pair) can be
+# done with one look up in a table indexed by the top 16 bits of the value
+# (which is always less than 2^31).
+_TANGO_PAIRS = None
+_WINDOW_STRUCT = struct.Struct(">{0}H".format(RABIN_WINDOW // 2))
+
+def _get_tango_pairs():
+    global _TANGO_PAIRS
+    if _TANGO_PAIRS is None:
+        def two_steps(val):
+            for _dummy in range(2):
+                val = ((val << 8) & 0xFFFFFFFF) ^ TANGO[val >> RABIN_SHIFT]
+            return val
+        _TANGO_PAIRS = [two_steps(top << 15) for top in range(0x10000)]
+    return _TANGO_PAIRS
+
+def _rabin_window_hash(data, offset, tango_pairs, unpack_window=_WINDOW_STRUCT.unpack_from):
+    # unrolled for speed (RABIN_WINDOW == 16)
+    val, pr1, pr2, pr3, pr4, pr5, pr6, pr7 = unpack_window(data, offset)
+    val = (((val & 0x7FFF) << 16) | pr1) ^ tango_pairs[val >> 15]
+    val = (((val & 0x7FFF) << 16) | pr2) ^ tango_pairs[val >> 15]
+    val = (((val & 0x7FFF) << 16) | pr3) ^ tango_pairs[val >> 15]
+    val = (((val & 0x7FFF) << 16) | pr4) ^ tango_pairs[val >> 15]
+    val = (((val & 0x7FFF) << 16) | pr5) ^ tango_pairs[val >> 15]
+    val = (((val & 0x7FFF) << 16) | pr6) ^ tango_pairs[val >> 15]
+    return (((val & 0x7FFF) << 16) | pr7) ^ tango_pairs[val >> 15]
+
+def _common_prefix_length(ref_data, ref_off, trg_data, trg_off, limit):
+    '''Return the number of leading bytes (up to limit) that match'''
+    length = 0
+    step = 32
+    while length < limit:
+        step = min(step, limit - length)
+        if ref_data[ref_off + length:ref_off + length + step] != trg_data[trg_off + length:trg_off + length + step]:
+            break
+        length += step
+        step <<= 1
+    else:
+        return length
+    # the mismatch is somewhere in the last step so home in on it
+    while step > 1:
+        half = step >> 1
+        if ref_data[ref_off + length:ref_off + length + half] == trg_data[trg_off + length:trg_off + length + half]:
+            length += half
+            step -= half
+        else:
+            step = half
+    return length
+
+class DeltaIndex(object):
+    # maximum hash entry list for the same hash bucket
+    HASH_LIMIT = 64
+    def __init__(self, data):
+        if not data or len(data) == 0:
+            raise EmptySourceBuffer
+        entries = (min(len(data), 0xFFFFFFFF) - 1) // RABIN_WINDOW
+        hsize = entries // 4
+        lshft = 4
+        while (1 << lshft) < hsize and lshft < 31:
+            lshft += 1
+        hsize = 1 << lshft
+        self.data = _as_byte_buffer(data)
+        self._hash_mask = hash_mask = hsize - 1
+        # Record the blocks from the top down (as the C version does)
+        # keeping the first of consecutive identical blocks.
+        tango_pairs = _get_tango_pairs()
+        vals = array.array("I")
+        ptrs = array.array("I")
+        prev_val = None
+        counts = [0] * (hsize + 1)
+        # Hash all blocks at once a byte pair (column) at a time.
+        words = array.array("H")
+        words.frombytes(self.data[1:1 + entries * RABIN_WINDOW])
+        if sys.byteorder == "little":
+            words.byteswap()
+        nwords = RABIN_WINDOW // 2
+        block_vals = list(words[0::nwords])
+        for column in range(1, nwords):
+            block_vals = [(((val & 0x7FFF) << 16) | pair) ^ tango_pairs[val >> 15] for val, pair in zip(block_vals, words[column::nwords])]
+        del words
+        for index in range(entries - 1, -1, -1):
+            val = block_vals[index]
+            if val == prev_val:
+                continue
+            prev_val = val
+            vals.append(val)
+            ptrs.append(index * RABIN_WINDOW + RABIN_WINDOW)
+            counts[(val & hash_mask) + 1] += 1
+        del block_vals
+        # Bucket the entries (lowest offset first within each bucket)
+        for index in range(hsize):
+            counts[index + 1] += counts[index]
+        starts = array.array("I", counts)
+        fill = counts[:-1]
+        entry_vals = array.array("I", bytes(4 * len(vals)))
+        entry_ptrs = array.array("I", bytes(4 * len(ptrs)))
+        for index in range(len(vals) - 1, -1, -1):
+            val = vals[index]
+            eindex = fill[val & hash_mask]
+            fill[val & hash_mask] = eindex + 1
+            entry_vals[eindex] = val
+            entry_ptrs[eindex] = ptrs[index]
+        # Cull over populated buckets uniformly (see CIdiomsDeltaIndex).
+        if any(starts[index + 1] - starts[index] > self.HASH_LIMIT for index in range(hsize)):
+            culled_vals = array.array("I")
+            culled_ptrs = array.array("I")
+            culled_starts = array.array("I", [0])
+            for index in range(hsize):
+                kept = list(range(starts[index], starts[index + 1]))
+                if len(kept) > self.HASH_LIMIT:
+                    eindex = 1
+                    acc = 0
+                    acc_step = len(kept) - self.HASH_LIMIT
+                    for _dummy in range(self.HASH_LIMIT):
+                        acc += acc_step
+                        while acc > 0:
+                            del kept[eindex]
+                            acc -= self.HASH_LIMIT
+                        eindex += 1
+                    assert len(kept) == self.HASH_LIMIT
+                culled_vals.extend(entry_vals[k] for k in kept)
+                culled_ptrs.extend(entry_ptrs[k] for k in kept)
+                culled_starts.append(len(culled_vals))
+            entry_vals, entry_ptrs, starts = culled_vals, culled_ptrs, culled_starts
+        self._bucket_starts = starts
+        self._entry_vals = entry_vals
+        self._entry_ptrs = entry_ptrs
+    def get_entries(self, val):
+        bucket = val & self._hash_mask
+        return [(self._entry_vals[k], self._entry_ptrs[k]) for k in range(self._bucket_starts[bucket], self._bucket_starts[bucket + 1])]
+
+def create_delta_index(data):
+    return DeltaIndex(data) if data and len(data) > 0 else 0
+
+def create_delta(delta_index, after_data, max_delta_size=None):
+    if isinstance(delta_index, CIdiomsDeltaIndex):
+        return c_idioms_create_delta(delta_index, after_data, max_delta_size)
+    if not after_data or len(after_data) == 0:
+        raise EmptyTargetBuffer
+    tango = TANGO
+    tango_pairs = _get_tango_pairs()
+    uniform = UNIFORM
+    before_data = delta_index.data
+    before_size = len(before_data)
+    hash_mask = delta_index._hash_mask
+    bucket_starts = delta_index._bucket_starts
+    entry_vals = delta_index._entry_vals
+    entry_ptrs = delta_index._entry_ptrs
+    trg_data = _as_byte_buffer(after_data)
+    trg_size = len(trg_data)
+    outsize = DEFAULT_OUTSIZE if (not max_delta_size or max_delta_size > DEFAULT_OUTSIZE) else max_delta_size + MAX_OP_SIZE + 1
+    out = bytearray(outsize)
+    outpos = 0
+    # store buffer sizes in order 'before' then 'after'
+    for size in [before_size, trg_size]:
+        while size >= 0x80:
+            out[outpos] = (size | 0x80) & 0xFF
+            outpos += 1
+            size >>= 7
+        out[outpos] = size
+        outpos += 1
+    # leave room for the first insert count
+    outpos += 1
+    val = 0
+    trg_pos = min(RABIN_WINDOW, trg_size)
+    for byte in trg_data[:trg_pos]:
+        out[outpos] = byte
+        outpos += 1
+        val = (((val << 8) & 0xFFFFFFFF) | byte) ^ tango[val >> RABIN_SHIFT]
+    inscnt = trg_pos
+    moff = 0
+    msize = 0
+    while trg_pos < trg_size:
+        if msize < 4096:
+            val ^= uniform[trg_data[trg_pos - RABIN_WINDOW]]
+            val = (((val << 8) & 0xFFFFFFFF) | trg_data[trg_pos]) ^ tango[val >> RABIN_SHIFT]
+            bucket = val & hash_mask
+            for eindex in range(bucket_starts[bucket], bucket_starts[bucket + 1]):
+                if entry_vals[eindex] != val:
+                    continue
+                ref_pos = entry_ptrs[eindex]
+                max_possible = min(before_size - ref_pos, trg_size - trg_pos)
+                if max_possible <= msize:
+                    break
+                matches = _common_prefix_length(before_data, ref_pos, trg_data, trg_pos, max_possible)
+                if msize < matches:
+                    # this our best match so far
+                    msize = matches
+                    moff = ref_pos
+                    if msize >= 4096: # good enough
+                        break
+        if msize < 4:
+            if not inscnt:
+                # leave room for the insert count
+                outpos += 1
+            out[outpos] = trg_data[trg_pos]
+            outpos += 1
+            trg_pos += 1
+            inscnt += 1
+            if inscnt == 0x7f:
+                out[outpos - inscnt - 1] = inscnt
+                inscnt = 0
+            msize = 0
+        else:
+            if inscnt:
+                while moff and before_data[moff - 1] == trg_data[trg_pos - 1]:
+                    # we can match one byte back
+                    msize += 1
+                    moff -= 1
+                    trg_pos -= 1
+                    outpos -= 1
+                    inscnt -= 1
+                    if inscnt:
+                        continue
+                    outpos -= 1 # remove count slot and make inscnt -1
+                    inscnt -= 1
+                    break
+                out[outpos - inscnt - 1] = inscnt & 0xFF
+                inscnt = 0
+            # A copy op is currently limited to 64KB (pack v2)
+            left = max(0, msize - 0x10000)
+            msize -= left
+            op_index = outpos
+            outpos += 1
+            cmd = 0x80
+            for value, nbytes, first_bit in [(moff, 4, 0x01), (msize, 2, 0x10)]:
+                for kkk in range(nbytes):
+                    if value & (0xFF << (8 * kkk)):
+                        out[outpos] = (value >> (8 * kkk)) & 0xFF
+                        outpos += 1
+                        cmd |= first_bit << kkk
+            out[op_index] = cmd
+            trg_pos += msize
+            moff += msize
+            msize = left
+            if msize < 4096:
+                val = _rabin_window_hash(trg_data, trg_pos - RABIN_WINDOW, tango_pairs)
+        if outpos >= outsize - MAX_OP_SIZE:
+            outsize = outsize * 3 // 2
+            if max_delta_size and outsize >= max_delta_size:
+                outsize = max_delta_size + MAX_OP_SIZE + 1
+            if max_delta_size and outpos > max_delta_size:
+                break
+            out.extend(bytes(outsize - len(out)))
+    if inscnt:
+        out[outpos - inscnt - 1] = inscnt
+    return out[:outpos]
+
+def diff_delta(before_data, after_data, max_delta_size=None):
+    delta_index = create_delta_index(before_data)
+    if delta_index:
+        return create_delta(delta_index, after_data, max_delta_size)
+    return None
+
+def _get_delta_hdr_size(delta, index):
+    size = 0
+    lshft = 0
+    while index < len(delta):
+        cmd = delta[index]
+        index += 1
+        size |= (cmd & 0x7F) << lshft
+        lshft += 7
+        if not cmd & 0x80:
+            break
+    return size, index
+
+def get_delta_result_size(src_data, delta):
+    '''Return the size of the result of applying delta to src_data
+    (from the delta's header) and the offset of the delta's first op'''
+    if not delta or len(delta) < DELTA_SIZE_MIN:
+        raise InvalidDelta
+    # make sure the orig file size matches what we expect
+    size, index = _get_delta_hdr_size(delta, 0)
+    if size != len(src_data):
+        raise InvalidSourceSize
+    return _get_delta_hdr_size(delta, index)
+
+def _iter_delta_chunks(src_data, delta, index, expected_result_size):
+    '''Generate the chunks (views of src_data or delta) making up the result'''
+    delta_size = len(delta)
+    outsize = 0
+    try:
+        while index < delta_size:
+            cmd = delta[index]
+            index += 1
+            if cmd & 0x80:
+                cp_off = cp_size = 0
+                for kkk in range(4):
+                    if cmd & (0x01 << kkk):
+                        cp_off |= delta[index] << (8 * kkk)
+                        index += 1
+                for kkk in range(3):
+                    if cmd & (0x10 << kkk):
+                        cp_size |= delta[index] << (8 * kkk)
+                        index += 1
+                if cp_size == 0:
+                    cp_size = 0x10000
+                if cp_off + cp_size > len(src_data) or cp_size > expected_result_size - outsize:
+                    break
+                outsize += cp_size
+                yield src_data[cp_off:cp_off + cp_size]
+            elif cmd:
+                if cmd > expected_result_size - outsize or index + cmd > delta_size:
+                    break
+                outsize += cmd
+                index += cmd
+                yield delta[index - cmd:index]
+            else:
+                # cmd == 0 is reserved for future encoding
+                # extensions. In the mean time we must fail when
+                # encountering them (might be data corruption).
+                raise PatchError("unexpected delta opcode 0")
+    except IndexError:
+        raise InvalidDelta
+    # sanity check
+    if index != delta_size or expected_result_size != outsize:
+        raise PatchError("delta replay has gone wild {0}:{1}:{2}".format(delta_size - index, expected_result_size, outsize))
+
+def patch_delta(src_data, delta):
+    src_data = _as_byte_buffer(src_data)
+    delta = _as_byte_buffer(delta)
+    expected_result_size, index = get_delta_result_size(src_data, delta)
+    out_data = bytearray(expected_result_size)
+    outpos = 0
+    for chunk in _iter_delta_chunks(src_data, delta, index, expected_result_size):
+        out_data[outpos:outpos + len(chunk)] = chunk
+        outpos += len(chunk)
+    return out_data
+
+def patch_delta_into(src_data, delta, sink):
+    '''Apply delta to src_data writing the result to the file-like sink
+    and return the number of bytes written.  Data is copied straight
+    from (views of) src_data and delta so peak memory use does not grow
+    with the size of the result.  src_data may be any bytes-like object
+    (e.g. an mmap) or a binary file object (which will be memory mapped).
+    NB: if the delta turns out to be corrupt an exception is raised after
+    some of the result may have been written to sink.'''
+    if hasattr(src_data, "fileno"):
+        if os.fstat(src_data.fileno()).st_size == 0:
+            return _patch_delta_into(b"", delta, sink)
+        with mmap.mmap(src_data.fileno(), 0, access=mmap.ACCESS_READ) as src_map:
+            return _patch_delta_into(src_map, delta, sink)
+    return _patch_delta_into(src_data, delta, sink)
+
+def _patch_delta_into(src_data, delta, sink):
+    src_data = _as_byte_buffer(src_data)
+    delta = _as_byte_buffer(delta)
+    expected_result_size, index = get_delta_result_size(src_data, delta)
+    chunks = _iter_delta_chunks(src_data, delta, index, expected_result_size)
+    try:
+        for chunk in chunks:
+            sink.write(chunk)
+    finally:
+        # let go of all views of src_data so that an mmap can be closed
+        chunk = None
+        chunks.close()
+        if isinstance(src_data, memoryview):
+            src_data.release()
+    return expected_result_size
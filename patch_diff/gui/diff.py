@@ -16,6 +16,7 @@
 import re
 import os
 import hashlib
+import threading
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -454,6 +455,182 @@ class DiffTextsWidget(DiffPlusNotebook, FileAndRefreshActions):
     def window_title(self):
         return ""
 
+class LazyDiffPage(Gtk.VBox):
+    def __init__(self, diff_file):
+        Gtk.VBox.__init__(self)
+        self.diff_file = diff_file
+        self.display = None
+        self.is_stale = True
+        self._label = Gtk.Label(_("Loading..."))
+        self.pack_start(self._label, expand=True, fill=True, padding=0)
+    def set_diff_plus(self, diff_plus):
+        self.is_stale = False
+        if diff_plus is None:
+            if self.display is not None:
+                self.remove(self.display)
+                self.display = None
+                self.pack_start(self._label, expand=True, fill=True, padding=0)
+            self._label.set_text(_("No differences"))
+        elif self.display is None:
+            self.remove(self._label)
+            self.display = DiffPlusDisplay(diff_plus)
+            self.pack_start(self.display, expand=True, fill=True, padding=0)
+        else:
+            self.display.update(diff_plus)
+        self.show_all()
+    def set_unparsable(self, edata):
+        self.set_diff_plus(None)
+        self._label.set_text(_("Unparsable diff: {0}: {1}").format(edata.lineno, edata.message))
+
+class LazyDiffTextsWidget(DiffPlusNotebook, FileAndRefreshActions):
+    '''A DiffTextsWidget for diffs that may be huge.  The pages (and their
+    TWS markers) are set up from a cheap list of the files in the diff and
+    each file's diff is only fetched, parsed and displayed when its page is
+    first shown.  Its neighbours' are fetched in the background meanwhile.
+    Children provide:
+    _get_diff_files(): a list of objects with file_path and adds_tws
+    _get_diff_args(): (optional) the arguments that select the diff
+    _get_file_diff_text(diff_args, diff_file): may be called from another thread
+    _get_diff_text(): the whole diff (for saving)'''
+    A_NAME_LIST = ["diff_save", "diff_save_as", "diff_refresh"]
+    NUM_PREFETCH = 2
+    def __init__(self, num_strip_levels=1, **kwargs):
+        self._diff_files = self._get_diff_files()
+        self._tws_file_paths = set(diff_file.file_path for diff_file in self._diff_files if diff_file.adds_tws)
+        self._prefetch_lock = threading.Lock()
+        self._generation = 0
+        self._prefetched = {}
+        self._prefetch_queue = []
+        self._prefetching = False
+        DiffPlusNotebook.__init__(self, num_strip_levels=num_strip_levels)
+        FileAndRefreshActions.__init__(self)
+        self.diff_buttons = gutils.ActionButtonList([self._action_group], self.A_NAME_LIST)
+        self.connect("switch-page", self._switch_page_cb)
+        self._load_page(self.get_current_page())
+    def _get_diff_files(self):
+        assert False, _("_get_diff_files() must be defined in children")
+    def _get_diff_args(self):
+        # NB: only called from the main thread as it may consult widgets
+        return []
+    def _get_file_diff_text(self, diff_args, diff_file):
+        assert False, _("_get_file_diff_text() must be defined in children")
+    def _get_diff_text(self):
+        assert False, _("_get_diff_text() must be defined in children")
+    @staticmethod
+    def _parse_diff_plus(diff_text):
+        diff_pluses = patchlib.Patch.parse_text(diff_text).diff_pluses
+        return diff_pluses[0] if diff_pluses else None
+    def _set_page_labels(self, page, adds_tws):
+        file_icon = self._file_icon_for_condition(not adds_tws)
+        self.set_tab_label(page, self._make_file_label(page.diff_file.file_path, file_icon))
+        self.set_menu_label(page, self._make_file_label(page.diff_file.file_path, file_icon))
+    def _populate_pages(self):
+        for diff_file in self._diff_files:
+            page = LazyDiffPage(diff_file)
+            self.diff_displays[diff_file.file_path] = page
+            file_icon = self._file_icon_for_condition(not diff_file.adds_tws)
+            self.append_page_menu(page, self._make_file_label(diff_file.file_path, file_icon), self._make_file_label(diff_file.file_path, file_icon))
+        self.tws_display.set_value(len(self._tws_file_paths))
+    def _update_pages(self):
+        existing = set(self.diff_displays)
+        for diff_file in self._diff_files:
+            page = self.diff_displays.get(diff_file.file_path)
+            if page is None:
+                page = self.diff_displays[diff_file.file_path] = LazyDiffPage(diff_file)
+                file_icon = self._file_icon_for_condition(not diff_file.adds_tws)
+                self.append_page_menu(page, self._make_file_label(diff_file.file_path, file_icon), self._make_file_label(diff_file.file_path, file_icon))
+                page.show_all()
+            else:
+                existing.remove(diff_file.file_path)
+                page.diff_file = diff_file
+                page.is_stale = True
+                self._set_page_labels(page, diff_file.adds_tws)
+        for gone in existing:
+            self.remove_page(self.page_num(self.diff_displays.pop(gone)))
+        self.tws_display.set_value(len(self._tws_file_paths))
+    def _load_page(self, page_num):
+        page = self.get_nth_page(page_num) if page_num >= 0 else None
+        if page is None:
+            return
+        if page.is_stale:
+            key = (self._generation, page.diff_file.file_path)
+            with self._prefetch_lock:
+                diff_plus = self._prefetched.pop(key, False)
+            if diff_plus is False:
+                try:
+                    diff_text = self._get_file_diff_text(self._get_diff_args(), page.diff_file)
+                except CmdFailure as failure:
+                    dialogue.main_window.report_failure(failure)
+                    diff_text = failure.result.stdout
+                try:
+                    diff_plus = self._parse_diff_plus(diff_text)
+                except patchlib.ParseError as edata:
+                    page.set_unparsable(edata)
+                    self._prefetch_neighbours(page_num)
+                    return
+            page.set_diff_plus(diff_plus)
+            # the cheap list's verdict on TWS may have been wrong
+            adds_tws = bool(diff_plus and diff_plus.report_trailing_whitespace())
+            if adds_tws != (page.diff_file.file_path in self._tws_file_paths):
+                if adds_tws:
+                    self._tws_file_paths.add(page.diff_file.file_path)
+                else:
+                    self._tws_file_paths.discard(page.diff_file.file_path)
+                self._set_page_labels(page, adds_tws)
+                self.tws_display.set_value(len(self._tws_file_paths))
+        self._prefetch_neighbours(page_num)
+    def _prefetch_neighbours(self, page_num):
+        wanted = []
+        for offset in range(1, self.NUM_PREFETCH + 1):
+            for neighbour_num in (page_num + offset, page_num - offset):
+                page = self.get_nth_page(neighbour_num) if neighbour_num >= 0 else None
+                if page is not None and page.is_stale:
+                    wanted.append(page.diff_file)
+        # work out the arguments here as the widgets they come from mustn't
+        # be touched from the prefetching thread
+        diff_args = self._get_diff_args()
+        with self._prefetch_lock:
+            self._prefetch_queue = [(self._generation, diff_args, diff_file) for diff_file in wanted if (self._generation, diff_file.file_path) not in self._prefetched]
+            if not self._prefetch_queue or self._prefetching:
+                return
+            self._prefetching = True
+        threading.Thread(target=self._prefetch, daemon=True).start()
+    def _prefetch(self):
+        while True:
+            with self._prefetch_lock:
+                if not self._prefetch_queue:
+                    self._prefetching = False
+                    return
+                generation, diff_args, diff_file = self._prefetch_queue.pop(0)
+            try:
+                diff_plus = self._parse_diff_plus(self._get_file_diff_text(diff_args, diff_file))
+            except (CmdFailure, patchlib.ParseError):
+                # it'll be fetched (and the problem reported) when it's shown
+                continue
+            with self._prefetch_lock:
+                if generation == self._generation:
+                    self._prefetched[(generation, diff_file.file_path)] = diff_plus
+    def _switch_page_cb(self, _notebook, _page, page_num):
+        self._load_page(page_num)
+    def _refresh_acb(self, _action):
+        self.update()
+    def update(self):
+        diff_files = self._get_diff_files()
+        with self._prefetch_lock:
+            self._generation += 1
+            self._prefetched = {}
+            self._prefetch_queue = []
+        self._diff_files = diff_files
+        self._tws_file_paths = set(diff_file.file_path for diff_file in diff_files if diff_file.adds_tws)
+        self._update_pages()
+        self._load_page(self.get_current_page())
+    def __str__(self):
+        return self._get_diff_text()
+    def _get_text_to_save(self):
+        return str(self)
+    def window_title(self):
+        return ""
+
 class GenericDiffDialog(dialogue.ListenerDialog):
     DIFFS_WIDGET = None
     def __init__(self, parent=None, **kwargs):
@@ -15,9 +15,13 @@
 
 '''Classes and functions for operations on patch files'''
 
+import array
+import codecs
 import collections
+import itertools
 import re
 import os
+import threading
 import email
 import zlib
 import hashlib
@@ -109,34 +113,43 @@ class DiffStat:
                 return True
         return False
     class Stats:
-        '''Class to hold diffstat statistics.'''
-        def __init__(self):
-            self._counts = {}
-            for key in DiffStat._ORDERED_KEYS:
-                self._counts[key] = 0
-            assert len(self._counts) == len(DiffStat._ORDERED_KEYS)
+        '''Class to hold diffstat statistics (a fixed set of counters).'''
+        __slots__ = ('inserted', 'deleted', 'modified', 'unchanged')
+        def __init__(self, inserted=0, deleted=0, modified=0, unchanged=0):
+            self.inserted = inserted
+            self.deleted = deleted
+            self.modified = modified
+            self.unchanged = unchanged
         def __add__(self, other):
-            result = DiffStat.Stats()
-            for key in DiffStat._ORDERED_KEYS:
-                result._counts[key] = self._counts[key] + other._counts[key]
-            return result
+            return DiffStat.Stats(self.inserted + other.inserted, self.deleted + other.deleted, self.modified + other.modified, self.unchanged + other.unchanged)
+        def __iadd__(self, other):
+            self.inserted += other.inserted
+            self.deleted += other.deleted
+            self.modified += other.modified
+            self.unchanged += other.unchanged
+            return self
         def __len__(self):
-            return len(self._counts)
+            return len(DiffStat._ORDERED_KEYS)
+        def __iter__(self):
+            return iter((self.inserted, self.deleted, self.modified, self.unchanged))
         def __getitem__(self, key):
             if isinstance(key, int):
                 key = DiffStat._ORDERED_KEYS[key]
-            return self._counts[key]
+            elif key not in DiffStat._ORDERED_KEYS:
+                raise KeyError(key)
+            return getattr(self, key)
         def get_total(self):
-            return sum(list(self))
+            return self.inserted + self.deleted + self.modified + self.unchanged
         def get_total_changes(self):
-            return sum([self._counts[key] for key in ['inserted', 'deleted', 'modified']])
+            return self.inserted + self.deleted + self.modified
         def incr(self, key):
-            self._counts[key] += 1
-            return self._counts[key]
+            count = self[key] + 1
+            setattr(self, key, count)
+            return count
         def as_string(self, joiner=', ', prefix=', '):
             strings = []
             for key in DiffStat._ORDERED_KEYS:
-                num = self._counts[key]
+                num = getattr(self, key)
                 if num:
                     strings.append(DiffStat._FMT_DATA[key].format(num, '' if num == 1 else 's'))
             if strings:
@@ -146,11 +159,12 @@ class DiffStat:
         def as_bar(self, scale=lambda x: x):
             string = ''
             for key in DiffStat._ORDERED_KEYS:
-                count = scale(self._counts[key])
+                count = scale(getattr(self, key))
                 char = DiffStat._FMT_DATA[key][-2]
                 string += char * count
             return string
     class PathStats:
+        __slots__ = ('path', 'diff_stats')
         def __init__(self, path, diff_stats):
             self.path = path
             self.diff_stats = diff_stats
@@ -210,20 +224,75 @@ class DiffStat:
                 string += '\n'
             return string
 
+class _SharedLines:
+    '''A read only list-like sequence of lines stored as a range of the
+    line start offsets into one text string that's shared by all slices'''
+    __slots__ = ('text', 'offsets', 'start', 'stop')
+    SCAN_BLOCK_SIZE = 1 << 20
+    @staticmethod
+    def fm_text(text):
+        '''Return a _SharedLines for text split as per str.splitlines(True)'''
+        offsets = array.array('I' if len(text) < (1 << 32) else 'Q', [0])
+        for block_start in range(0, len(text), _SharedLines.SCAN_BLOCK_SIZE):
+            base = offsets[-1]
+            lines = text[base:block_start + _SharedLines.SCAN_BLOCK_SIZE].splitlines(True)
+            # the last line may be incomplete (or be a '\r' awaiting its '\n')
+            if lines:
+                del lines[-1]
+            offsets.extend(itertools.islice(itertools.accumulate(map(len, lines), initial=base), 1, None))
+        if offsets[-1] < len(text):
+            offsets.append(len(text))
+        return _SharedLines(text, offsets)
+    def __init__(self, text, offsets, start=0, stop=None):
+        self.text = text
+        self.offsets = offsets
+        self.start = start
+        self.stop = len(offsets) - 1 if stop is None else stop
+    def __len__(self):
+        return self.stop - self.start
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.stop - self.start)
+            assert step == 1
+            return _SharedLines(self.text, self.offsets, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += self.stop - self.start
+        index += self.start
+        if index < self.start or index >= self.stop:
+            raise IndexError(index)
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+    def __iter__(self):
+        text = self.text
+        offsets = self.offsets
+        for index in range(self.start, self.stop):
+            yield text[offsets[index]:offsets[index + 1]]
+    def __str__(self):
+        return self.text[self.offsets[self.start]:self.offsets[self.stop]]
+
 class _Lines:
+    __slots__ = ('lines',)
     def __init__(self, contents=None):
         if contents is None:
             self.lines = list()
         elif isinstance(contents, str):
             self.lines = contents.splitlines(True)
+        elif isinstance(contents, _SharedLines):
+            # NB: no copying (until/unless we're modified)
+            self.lines = contents
         else:
             self.lines = list(contents)
     def __str__(self):
+        if isinstance(self.lines, _SharedLines):
+            return str(self.lines)
         return ''.join(self.lines)
     def __iter__(self):
         for line in self.lines:
             yield line
+    def _make_mutable(self):
+        if not isinstance(self.lines, list):
+            self.lines = list(self.lines)
     def append(self, data):
+        self._make_mutable()
         if isinstance(data, str):
             self.lines += data.splitlines(True)
         else:
@@ -291,6 +360,18 @@ def _file_outcome_fm_pair(pair):
         return 1
     return 0
 
+# Preamble and Diff subtypes each declare the (fixed length) prefix that
+# their first line must have so that lines can be dispatched on it
+_LINE_PREFIX_LEN = 4
+
+def _build_dispatch_table(subtypes):
+    '''Map line prefixes to the subtypes (in precedence order) that may start there'''
+    dispatch_table = dict()
+    for subtype in subtypes:
+        assert len(subtype.LINE_PREFIX) == _LINE_PREFIX_LEN
+        dispatch_table.setdefault(subtype.LINE_PREFIX, list()).append(subtype)
+    return dispatch_table
+
 def _file_data_consistent_with_strip_one(pair):
     strip = gen_strip_level_function(1)
     get_path = lambda x: x if isinstance(x, str) else x.path
@@ -309,6 +390,7 @@ class FilePathPlus:
     ADDED = '+'
     EXTANT = ' '
     DELETED = '-'
+    __slots__ = ('path', 'status', 'expath')
     def __init__(self, path, status, expath=None):
         self.path = path
         self.status = status
@@ -331,10 +413,12 @@ class FilePathPlus:
         return FilePathPlus(path=path, status=status, expath=None)
 
 class Preamble(_Lines):
+    __slots__ = ('preamble_type', 'file_data', 'extras')
     subtypes = list()
+    dispatch_table = dict()
     @staticmethod
     def get_preamble_at(lines, index, raise_if_malformed, exclude_subtypes_in=set()):
-        for subtype in Preamble.subtypes:
+        for subtype in Preamble.dispatch_table.get(lines[index][:_LINE_PREFIX_LEN], ()):
             if subtype in exclude_subtypes_in:
                 continue
             preamble, next_index = subtype.get_preamble_at(lines, index, raise_if_malformed)
@@ -376,6 +460,8 @@ class Preamble(_Lines):
         return None
 
 class GitPreamble(Preamble):
+    __slots__ = ()
+    LINE_PREFIX = 'diff'
     DIFF_CRE = re.compile("^diff\s+--git\s+({0})\s+({1})$".format(_PATH_RE_STR, _PATH_RE_STR))
     EXTRAS_CRES = {
         'old mode' : re.compile('^(old mode)\s+(\d*)$'),
@@ -400,16 +486,16 @@ class GitPreamble(Preamble):
         extras = {}
         next_index = index + 1
         while next_index < len(lines):
-            found = False
-            for cre in GitPreamble.EXTRAS_CRES:
-                match = GitPreamble.EXTRAS_CRES[cre].match(lines[next_index])
-                if match:
-                    extras[match.group(1)] = match.group(2)
-                    next_index += 1
-                    found = True
+            # no key is a prefix of another so at most one regex needs trying
+            match = None
+            for key, cre in GitPreamble.EXTRAS_CRES.items():
+                if lines[next_index].startswith(key):
+                    match = cre.match(lines[next_index])
                     break
-            if not found:
+            if not match:
                 break
+            extras[match.group(1)] = match.group(2)
+            next_index += 1
         return (GitPreamble(lines[index:next_index], _PAIR(file1, file2), extras), next_index)
     def __init__(self, lines, file_data, extras=None):
         if extras is None:
@@ -442,6 +528,8 @@ class GitPreamble(Preamble):
 Preamble.subtypes.append(GitPreamble)
 
 class DiffPreamble(Preamble):
+    __slots__ = ()
+    LINE_PREFIX = 'diff'
     CRE = re.compile('^diff(\s.+)\s+({0})\s+({1})$'.format(_PATH_RE_STR, _PATH_RE_STR))
     @staticmethod
     def get_preamble_at(lines, index, raise_if_malformed):
@@ -461,6 +549,8 @@ class DiffPreamble(Preamble):
 Preamble.subtypes.append(DiffPreamble)
 
 class IndexPreamble(Preamble):
+    __slots__ = ()
+    LINE_PREFIX = 'Inde'
     FILE_RCE = re.compile("^Index:\s+({0})(.*)$".format(_PATH_RE_STR))
     SEP_RCE = re.compile("^==*$")
     @staticmethod
@@ -478,8 +568,10 @@ class IndexPreamble(Preamble):
         return strip(self.file_data)
 
 Preamble.subtypes.append(IndexPreamble)
+Preamble.dispatch_table = _build_dispatch_table(Preamble.subtypes)
 
 class Preambles(list):
+    __slots__ = ()
     path_precedence = ['index', 'git', 'diff']
     expath_precedence = ['git', 'index', 'diff']
     @staticmethod
@@ -551,19 +643,27 @@ class Preambles(list):
         return None
 
 class DiffHunk(_Lines):
+    __slots__ = ('before', 'after')
     def __init__(self, lines, before, after):
         _Lines.__init__(self, lines)
         self.before = before
         self.after = after
+    def add_diffstat_stats_to(self, stats):
+        '''Accumulate this hunk's diffstat statistics into stats'''
+        pass
     def get_diffstat_stats(self):
-        return DiffStat.Stats()
+        stats = DiffStat.Stats()
+        self.add_diffstat_stats_to(stats)
+        return stats
     def fix_trailing_whitespace(self):
         return list()
     def report_trailing_whitespace(self):
         return list()
 
 class Diff:
+    __slots__ = ('header', 'diff_type', 'file_data', 'hunks')
     subtypes = list()
+    dispatch_table = dict()
     @staticmethod
     def _get_file_data_at(cre, lines, index):
         match = cre.match(lines[index])
@@ -600,7 +700,7 @@ class Diff:
         return (subtype(lines[start_index:start_index + 2], _PAIR(before_file_data, after_file_data), hunks), index)
     @staticmethod
     def get_diff_at(lines, index, raise_if_malformed):
-        for subtype in Diff.subtypes:
+        for subtype in Diff.dispatch_table.get(lines[index][:_LINE_PREFIX_LEN], ()):
             diff, next_index = subtype.get_diff_at(lines, index, raise_if_malformed)
             if diff is not None:
                 return (diff, next_index)
@@ -642,7 +742,7 @@ class Diff:
     def get_diffstat_stats(self):
         stats = DiffStat.Stats()
         for hunk in self.hunks:
-            stats += hunk.get_diffstat_stats()
+            hunk.add_diffstat_stats_to(stats)
         return stats
     def get_file_path(self, strip_level=0):
         strip = gen_strip_level_function(strip_level)
@@ -666,6 +766,7 @@ class Diff:
         return None
 
 class UnifiedDiffHunk(DiffHunk):
+    __slots__ = ()
     def __init__(self, lines, before, after):
         DiffHunk.__init__(self, lines, before, after)
     def _process_tws(self, fix=False):
@@ -678,31 +779,35 @@ class UnifiedDiffHunk(DiffHunk):
                 if len(repl_line) != len(self.lines[index]):
                     bad_lines.append(str(self.after.start + after_count - 1))
                     if fix:
+                        self._make_mutable()
                         self.lines[index] = repl_line
             elif self.lines[index].startswith(' '):
                 after_count += 1
             elif DEBUG and not self.lines[index].startswith('-'):
                 raise Bug('Unexpected end of unified diff hunk.')
         return bad_lines
-    def get_diffstat_stats(self):
-        stats = DiffStat.Stats()
-        for index in range(len(self.lines)):
-            if self.lines[index].startswith('-'):
-                stats.incr('deleted')
-            elif self.lines[index].startswith('+'):
-                stats.incr('inserted')
-            elif DEBUG and not self.lines[index].startswith(' '):
+    def add_diffstat_stats_to(self, stats):
+        # NB: the first line is the hunk's "@@" header
+        for line in itertools.islice(self.lines, 1, None):
+            if line.startswith('-'):
+                stats.deleted += 1
+            elif line.startswith('+'):
+                stats.inserted += 1
+            elif DEBUG and not line.startswith((' ', '\\')):
                 raise Bug('Unexpected end of unified diff hunk.')
-        return stats
     def fix_trailing_whitespace(self):
         return self._process_tws(fix=True)
     def report_trailing_whitespace(self):
         return self._process_tws(fix=False)
 
 class UnifiedDiff(Diff):
+    __slots__ = ()
+    LINE_PREFIX = '--- '
     BEFORE_FILE_CRE = re.compile('^--- ({0})(\s+{1})?(.*)$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     AFTER_FILE_CRE = re.compile('^\+\+\+ ({0})(\s+{1})?(.*)$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     HUNK_DATA_CRE = re.compile("^@@\s+-(\d+)(,(\d+))?\s+\+(\d+)(,(\d+))?\s+@@\s*(.*)$")
+    # (before, after) line count increments keyed by a hunk line's first character
+    HUNK_LINE_COUNTS = {'-': (1, 0), '+': (0, 1), ' ': (1, 1), '\\': (0, 0)}
     @staticmethod
     def get_before_file_data_at(lines, index):
         return Diff._get_file_data_at(UnifiedDiff.BEFORE_FILE_CRE, lines, index)
@@ -719,17 +824,15 @@ class UnifiedDiff(Diff):
         after_length = int(match.group(6)) if match.group(6) is not None else 1
         index += 1
         before_count = after_count = 0
+        line_counts = UnifiedDiff.HUNK_LINE_COUNTS
         try:
             while before_count < before_length or after_count < after_length:
-                if lines[index].startswith('-'):
-                    before_count += 1
-                elif lines[index].startswith('+'):
-                    after_count += 1
-                elif lines[index].startswith(' '):
-                    before_count += 1
-                    after_count += 1
-                elif not lines[index].startswith('\\'):
+                try:
+                    before_incr, after_incr = line_counts[lines[index][:1]]
+                except KeyError:
                     raise ParseError(_('Unexpected end of unified diff hunk.'), index)
+                before_count += before_incr
+                after_count += after_incr
                 index += 1
             if index < len(lines) and lines[index].startswith('\\'):
                 index += 1
@@ -747,6 +850,7 @@ class UnifiedDiff(Diff):
 Diff.subtypes.append(UnifiedDiff)
 
 class ContextDiffHunk(DiffHunk):
+    __slots__ = ()
     def __init__(self, lines, before, after):
         DiffHunk.__init__(self, lines, before, after)
     def _process_tws(self, fix=False):
@@ -758,33 +862,34 @@ class ContextDiffHunk(DiffHunk):
                 if len(repl_line) != len(self.lines[index]):
                     bad_lines.append(str(self.after.start + after_count))
                     if fix:
+                        self._make_mutable()
                         self.lines[index] = repl_line
             elif DEBUG and not self.lines[index].startswith('  '):
                 raise Bug('Unexpected end of context diff hunk.')
         return bad_lines
-    def get_diffstat_stats(self):
-        stats = DiffStat.Stats()
-        for index in range(self.before.offset + 1, self.before.offset + self.before.numlines):
-            if self.lines[index].startswith('- '):
-                stats.incr('deleted')
-            elif self.lines[index].startswith('! '):
-                stats.incr('modified')
-            elif DEBUG and not self.lines[index].startswith('  '):
+    def add_diffstat_stats_to(self, stats):
+        for line in self.lines[self.before.offset + 1:self.before.offset + self.before.numlines]:
+            if line.startswith('- '):
+                stats.deleted += 1
+            elif line.startswith('! '):
+                stats.modified += 1
+            elif DEBUG and not line.startswith('  '):
                 raise Bug('Unexpected end of context diff "before" hunk.')
-        for index in range(self.after.offset + 1, self.after.offset + self.after.numlines):
-            if self.lines[index].startswith('+ '):
-                stats.incr('inserted')
-            elif self.lines[index].startswith('! '):
-                stats.incr('modified')
-            elif DEBUG and not self.lines[index].startswith('  '):
+        for line in self.lines[self.after.offset + 1:self.after.offset + self.after.numlines]:
+            if line.startswith('+ '):
+                stats.inserted += 1
+            elif line.startswith('! '):
+                stats.modified += 1
+            elif DEBUG and not line.startswith('  '):
                 raise Bug('Unexpected end of context diff "after" hunk.')
-        return stats
     def fix_trailing_whitespace(self):
         return self._process_tws(fix=True)
     def report_trailing_whitespace(self):
         return self._process_tws(fix=False)
 
 class ContextDiff(Diff):
+    __slots__ = ()
+    LINE_PREFIX = '*** '
     BEFORE_FILE_CRE = re.compile('^\*\*\* ({0})(\s+{1})?$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     AFTER_FILE_CRE = re.compile('^--- ({0})(\s+{1})?$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     HUNK_START_CRE = re.compile('^\*{15}\s*(.*)$')
@@ -868,20 +973,71 @@ class ContextDiff(Diff):
 Diff.subtypes.append(ContextDiff)
 
 class GitBinaryDiffData(_Lines):
+    '''Binary payload whose data is only decoded/inflated on demand'''
+    __slots__ = ('method', 'size_raw', '_data_lines', '_data_zipped', '_data_raw')
     LITERAL, DELTA = ('literal', 'delta')
-    def __init__(self, lines, method, size_raw, data_zipped):
+    # payloads larger than this are not kept once decoded/inflated
+    MAX_CACHED_SIZE = 1024 * 1024
+    INFLATE_CHUNK_SIZE = 64 * 1024
+    DECODE_BLOCK_LINES = 1024
+    def __init__(self, lines, method, size_raw, data_lines):
         _Lines.__init__(self, lines)
         self.method = method
         self.size_raw = size_raw
-        self.data_zipped = data_zipped
+        self._data_lines = data_lines
+        self._data_zipped = None
+        self._data_raw = None
     @property
     def size_zipped(self):
-        return len(self.data_zipped)
+        return sum(gitbase85.decode_size(line[0]) for line in self._data_lines)
+    @property
+    def data_zipped(self):
+        if self._data_zipped is not None:
+            return self._data_zipped
+        try:
+            data_zipped = gitbase85.decode_lines(self._data_lines)
+        except (AssertionError, gitbase85.Error):
+            raise DataError(_('Inconsistent git binary patch data.'))
+        if len(data_zipped) <= self.MAX_CACHED_SIZE:
+            self._data_zipped = data_zipped
+        return data_zipped
     @property
     def data_raw(self):
-        return zlib.decompress(bytes(self.data_zipped))
+        if self._data_raw is not None:
+            return self._data_raw
+        try:
+            data_raw = zlib.decompress(bytes(self.data_zipped))
+        except zlib.error:
+            raise DataError(_('Inconsistent git binary patch data.'))
+        if len(data_raw) != self.size_raw:
+            raise DataError(_('Git binary patch expected {0} bytes. Got {1} bytes.').format(self.size_raw, len(data_raw)))
+        if len(data_raw) <= self.MAX_CACHED_SIZE:
+            self._data_raw = data_raw
+        return data_raw
+    def get_inflated_size(self):
+        '''Return the inflated size of the payload without holding all of
+        the decoded or inflated data in memory at once'''
+        dobj = zlib.decompressobj()
+        size = 0
+        try:
+            for index in range(0, len(self._data_lines), self.DECODE_BLOCK_LINES):
+                data = gitbase85.decode_lines(self._data_lines[index:index + self.DECODE_BLOCK_LINES])
+                while data:
+                    size += len(dobj.decompress(data, self.INFLATE_CHUNK_SIZE))
+                    data = dobj.unconsumed_tail
+            size += len(dobj.flush())
+        except (AssertionError, gitbase85.Error, zlib.error):
+            raise DataError(_('Inconsistent git binary patch data.'))
+        return size
+    def check_size(self):
+        '''Raise DataError if the payload does not inflate to size_raw bytes'''
+        size = self.get_inflated_size()
+        if size != self.size_raw:
+            raise DataError(_('Git binary patch expected {0} bytes. Got {1} bytes.').format(self.size_raw, size))
 
 class GitBinaryDiff(Diff):
+    __slots__ = ('forward', 'reverse')
+    LINE_PREFIX = 'GIT '
     START_CRE = re.compile('^GIT binary patch$')
     DATA_START_CRE = re.compile('^(literal|delta) (\d+)$')
     DATA_LINE_CRE = gitbase85.LINE_CRE
@@ -898,20 +1054,13 @@ class GitBinaryDiff(Diff):
             index += 1
         end_data = index
         # absorb the blank line if there is one
-        if GitBinaryDiff.BLANK_LINE_CRE.match(lines[index]):
+        if index < len(lines) and GitBinaryDiff.BLANK_LINE_CRE.match(lines[index]):
             has_blank = True
             index += 1
         else:
             has_blank = False
-        dlines = lines[start_index:index]
-        try:
-            data_zipped = gitbase85.decode_lines(lines[start_index + 1:end_data])
-        except AssertionError:
-            raise DataError('Inconsistent git binary patch data.', lineno=start_index)
-        raw_size = len(zlib.decompress(bytes(data_zipped)))
-        if raw_size != size:
-            raise DataError(_('Git binary patch expected {0} bytes. Got {1} bytes.'.format(size, raw_size)), lineno=start_index)
-        return (GitBinaryDiffData(dlines, method, raw_size, data_zipped), index)
+        # NB: the payload isn't decoded until it's needed
+        return (GitBinaryDiffData(lines[start_index:index], method, size, lines[start_index + 1:end_data]), index)
     @staticmethod
     def get_diff_at(lines, start_index, raise_if_malformed=True):
         if not GitBinaryDiff.START_CRE.match(lines[start_index]):
@@ -929,10 +1078,14 @@ class GitBinaryDiff(Diff):
         return None
 
 Diff.subtypes.append(GitBinaryDiff)
+Diff.dispatch_table = _build_dispatch_table(Diff.subtypes)
 
 class DiffPlus:
     '''Class to hold diff (headerless) information relavent to a single file.
     Includes (optional) preambles and trailing junk such as quilt's separators.'''
+    __slots__ = ('preambles', 'diff', 'trailing_junk')
+    # lines that don't start with one of these can't start a DiffPlus
+    START_PREFIXES = frozenset(list(Preamble.dispatch_table) + list(Diff.dispatch_table))
     @staticmethod
     def get_diff_plus_at(lines, start_index, raise_if_malformed=False):
         preambles, index = Preambles.get_preambles_at(lines, start_index, raise_if_malformed)
@@ -1025,6 +1178,62 @@ class DiffPlus:
         h.update(str(self).encode())
         return h.digest()
 
+def _iter_file_lines(fileobj, block_size=1 << 16):
+    '''Generate the lines (as per str.splitlines(True)) read from a text or
+    binary file object (or anything else with a read() method, e.g. mmap)'''
+    decoder = None
+    partial = ''
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            break
+        if isinstance(block, (bytes, bytearray)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            block = decoder.decode(block)
+        lines = (partial + block).splitlines(True)
+        # the last line may be incomplete (or be a '\r' awaiting its '\n')
+        partial = lines.pop()
+        yield from lines
+    if decoder is not None:
+        partial += decoder.decode(b'', final=True)
+    if partial:
+        yield partial
+
+class _LineWindow:
+    '''A window onto the lines of a stream that only holds (a little more
+    than) what the parser currently needs to look at'''
+    COMPACT_THRESHOLD = 4096
+    def __init__(self, fileobj):
+        self._line_iter = _iter_file_lines(fileobj)
+        self.lines = list()
+        self.start = 0
+        self.num_discarded = 0
+        self.at_eof = False
+    def __len__(self):
+        return len(self.lines) - self.start
+    def fill(self, count):
+        '''Read lines until at least count are available or EOF is reached'''
+        shortfall = count - len(self)
+        if shortfall > 0 and not self.at_eof:
+            self.lines.extend(itertools.islice(self._line_iter, shortfall))
+            self.at_eof = len(self) < count
+        return len(self) > 0
+    def advance(self, index):
+        '''Discard the lines before lines[index]'''
+        self.start = index
+        if self.start >= self.COMPACT_THRESHOLD:
+            del self.lines[:self.start]
+            self.num_discarded += self.start
+            self.start = 0
+
+# The number of lines read ahead for each DiffPlus parse attempt when
+# streaming (doubled until the parse provably didn't run out of lines)
+_STREAM_LOOKAHEAD = 512
+# The most lines beyond the end of a DiffPlus (or the start of a failed
+# attempt) that the parser may have examined before deciding where it ends
+_PARSE_OVERRUN = 4
+
 class Patch:
     '''Class to hold patch information relavent to multiple files with
     an optional header (or a single file with a header).'''
@@ -1035,17 +1244,22 @@ class Patch:
         diff_pluses = list()
         index = 0
         last_diff_plus = None
-        while index < len(lines):
-            raise_if_malformed = diff_starts_at is not None
-            starts_at = index
-            diff_plus, index = DiffPlus.get_diff_plus_at(lines, index, raise_if_malformed)
-            if diff_plus:
-                if diff_starts_at is None:
-                    diff_starts_at = starts_at
-                diff_pluses.append(diff_plus)
-                last_diff_plus = diff_plus
-                continue
-            elif last_diff_plus:
+        start_prefixes = DiffPlus.START_PREFIXES
+        num_lines = len(lines)
+        while index < num_lines:
+            # classify the line by its first few characters so that only
+            # plausible diff starts get the (expensive) full parse attempt
+            if lines[index][:_LINE_PREFIX_LEN] in start_prefixes:
+                raise_if_malformed = diff_starts_at is not None
+                diff_plus, next_index = DiffPlus.get_diff_plus_at(lines, index, raise_if_malformed)
+                if diff_plus:
+                    if diff_starts_at is None:
+                        diff_starts_at = index
+                    diff_pluses.append(diff_plus)
+                    last_diff_plus = diff_plus
+                    index = next_index
+                    continue
+            if last_diff_plus:
                 last_diff_plus.trailing_junk.append(lines[index])
             index += 1
         patch = Patch(num_strip_levels=num_strip_levels)
@@ -1053,9 +1267,61 @@ class Patch:
         patch.set_header(''.join(lines[0:diff_starts_at]))
         return patch
     @staticmethod
-    def parse_text(text, num_strip_levels=0):
-        '''Parse text and return a Patch instance.'''
-        return Patch.parse_lines(text.splitlines(True), num_strip_levels=num_strip_levels)
+    def iter_diff_pluses(fileobj):
+        '''Generate the patch's Header followed by its DiffPlus instances
+        (complete with trailing junk) read incrementally from fileobj so
+        that arbitrarily large patches can be processed in bounded memory'''
+        window = _LineWindow(fileobj)
+        header_lines = list()
+        last_diff_plus = None
+        start_prefixes = DiffPlus.START_PREFIXES
+        while window.fill(1):
+            index = window.start
+            line = window.lines[index]
+            if line[:_LINE_PREFIX_LEN] in start_prefixes:
+                raise_if_malformed = last_diff_plus is not None
+                wanted = _STREAM_LOOKAHEAD
+                while True:
+                    window.fill(wanted)
+                    try:
+                        diff_plus, next_index = DiffPlus.get_diff_plus_at(window.lines, index, raise_if_malformed)
+                    except (ParseError, IndexError) as edata:
+                        if not window.at_eof:
+                            wanted *= 2
+                            continue
+                        if getattr(edata, "lineno", None) is not None:
+                            edata.lineno += window.num_discarded
+                        raise
+                    # the outcome can't have been affected by the lack of lines
+                    # if there are lines beyond those it could have examined
+                    if window.at_eof or next_index + _PARSE_OVERRUN < len(window.lines):
+                        break
+                    wanted *= 2
+                if diff_plus:
+                    if last_diff_plus is None:
+                        yield Header(''.join(header_lines))
+                        header_lines = None
+                    else:
+                        yield last_diff_plus
+                    last_diff_plus = diff_plus
+                    window.advance(next_index)
+                    continue
+            if last_diff_plus:
+                last_diff_plus.trailing_junk.append(line)
+            else:
+                header_lines.append(line)
+            window.advance(index + 1)
+        if last_diff_plus is None:
+            yield Header(''.join(header_lines))
+        else:
+            yield last_diff_plus
+    @staticmethod
+    def parse_text(text, num_strip_levels=0, compact=False):
+        '''Parse text and return a Patch instance.
+        If compact is True, the parsed components share text rather than
+        holding their own copies of their lines.'''
+        lines = _SharedLines.fm_text(text) if compact else text.splitlines(True)
+        return Patch.parse_lines(lines, num_strip_levels=num_strip_levels)
     @staticmethod
     def parse_email_text(text, num_strip_levels=0):
         '''Parse email text and return a Patch instance.'''
@@ -1072,9 +1338,9 @@ class Patch:
             patch.set_description('\n'.join([subject, descr]))
         return patch
     @staticmethod
-    def parse_text_file(filepath, num_strip_levels=0):
+    def parse_text_file(filepath, num_strip_levels=0, compact=False):
         '''Parse a text file and return a Patch instance.'''
-        patch = Patch.parse_text(open(filepath).read(), num_strip_levels=num_strip_levels)
+        patch = Patch.parse_text(open(filepath).read(), num_strip_levels=num_strip_levels, compact=compact)
         patch.source_name = filepath
         return patch
     @staticmethod
@@ -1088,6 +1354,15 @@ class Patch:
         self.num_strip_levels = int(num_strip_levels)
         self.header = Header()
         self.diff_pluses = list()
+    def __copy__(self):
+        '''Return a copy whose header, strip level and list of DiffPlus
+        instances may be changed without affecting self.
+        NB: the DiffPlus instances themselves are shared.'''
+        patch = Patch(num_strip_levels=self.num_strip_levels)
+        patch.source_name = self.source_name
+        patch.header = None if self.header is None else Header(str(self.header))
+        patch.diff_pluses = list(self.diff_pluses)
+        return patch
     def _adjusted_strip_level(self, strip_level):
         return int(strip_level) if strip_level is not None else self.num_strip_levels
     def set_strip_level(self, strip_level):
@@ -1200,3 +1475,82 @@ class Patch:
         h = hashlib.sha1()
         h.update(str(self).encode())
         return h.digest()
+
+class PatchFileCache:
+    '''A process wide cache of the patches parsed from files keyed by the
+    files' identity and modification state with LRU eviction (to keep
+    within both an entry count and a memory budget).  The patches that it
+    returns are shared and must not be modified (parse afresh instead).'''
+    _CacheEntry = collections.namedtuple('_CacheEntry', ['key', 'patch', 'size'])
+    def __init__(self, max_entries=256, max_size=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._total_size = 0
+    @staticmethod
+    def get_file_key(filepath):
+        '''Return a key that changes whenever the file does'''
+        stat_data = os.stat(filepath)
+        return (stat_data.st_mtime_ns, stat_data.st_size, stat_data.st_ino)
+    def _remove(self, abspath):
+        entry = self._entries.pop(abspath, None)
+        if entry is not None:
+            self._total_size -= entry.size
+    def get_patch(self, filepath, get_text=None):
+        '''Return the Patch parsed from the file at filepath (reading it
+        with get_text(filepath) if the cached version is out of date)'''
+        abspath = os.path.abspath(filepath)
+        key = self.get_file_key(abspath)
+        with self._lock:
+            entry = self._entries.get(abspath)
+            if entry is not None:
+                if entry.key == key:
+                    self._entries.move_to_end(abspath)
+                    return entry.patch
+                self._remove(abspath)
+        text = get_text(filepath) if get_text else open(filepath).read()
+        patch = Patch.parse_text(text)
+        patch.source_name = filepath
+        # NB: size (being in bytes) is only a rough guide to memory usage
+        size = key[1]
+        # don't cache if the file changed while we were reading it
+        if size > self.max_size or self.get_file_key(abspath) != key:
+            return patch
+        with self._lock:
+            self._remove(abspath)
+            self._entries[abspath] = self._CacheEntry(key, patch, size)
+            self._total_size += size
+            while len(self._entries) > self.max_entries or self._total_size > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return patch
+    def get_text_patch(self, text):
+        '''Return the Patch parsed from text (which has usually already
+        been read from a file) keyed by the text's digest so that it's only
+        parsed again if the text changes'''
+        digest = hashlib.sha1(text.encode(errors="surrogateescape")).digest()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                return entry.patch
+        patch = Patch.parse_text(text)
+        size = len(text)
+        if size > self.max_size:
+            return patch
+        with self._lock:
+            self._remove(digest)
+            self._entries[digest] = self._CacheEntry(digest, patch, size)
+            self._total_size += size
+            while len(self._entries) > self.max_entries or self._total_size > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return patch
+    def forget(self, filepath):
+        with self._lock:
+            self._remove(os.path.abspath(filepath))
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_size = 0
+
+PATCH_FILE_CACHE = PatchFileCache()
@@ -19,6 +19,8 @@ Provide an interface for the GUI to access the PM controlling the patches
 
 import os
 
+from ...scm import pgnd_markers
+
 from . import pm_wspce
 
 _BACKEND = {}
@@ -57,7 +59,11 @@ def playground_type(dirpath=None):
     # TODO: cope with nested playgrounds of different type and go for closest
     # TODO: give preference to quilt if both found to allow quilt to be used on hg?
     for bname in list(_BACKEND.keys()):
-        if _BACKEND[bname].dir_is_in_valid_pgnd(dirpath):
+        root = pgnd_markers.get_playground_root(bname, dirpath)
+        if root is NotImplemented:
+            if _BACKEND[bname].dir_is_in_valid_pgnd(dirpath):
+                return bname
+        elif root is not None:
             return bname
     return None
 
@@ -55,6 +55,7 @@ def set_patch_file_description(patch_file_path, description, overwrite=False):
     from ..bab import utils
     if os.path.isfile(patch_file_path):
         try:
+            # NB: parse afresh as the cached (shared) version mustn't be modified
             patch_obj = patchlib.Patch.parse_text(utils.get_file_contents(patch_file_path))
         except IOError as edata:
             return CmdResult.error(stderr=str(edata))
@@ -73,7 +74,7 @@ def get_patch_file_description(patch_file_path):
     assert os.path.isfile(patch_file_path), _("Patch file \"{0}\" does not exist\n").format(patch_file_path)
     from ..patch_diff import patchlib
     from ..bab import utils
-    pobj = patchlib.Patch.parse_text(utils.get_file_contents(patch_file_path))
+    pobj = patchlib.PATCH_FILE_CACHE.get_patch(patch_file_path, utils.get_file_contents)
     return pobj.get_description()
 
 options.define("export", "replace_spc_in_name_with", options.Defn(str, None, _("Character to replace spaces in patch names with during export")))
@@ -69,7 +69,9 @@ PATCHLIB_TO_STATUS_MAP = {
 def iterate_patchlib_file_data(patch_text):
     if not patch_text:
         return
-    for fdata in patchlib.Patch.parse_text(patch_text).iterate_file_paths_plus(1):
+    # only (re)parsed if the text has changed since it was last parsed
+    epatch = patchlib.PATCH_FILE_CACHE.get_text_patch(patch_text)
+    for fdata in epatch.iterate_file_paths_plus(1):
         yield (fdata.path, PATCHLIB_TO_STATUS_MAP[fdata.status], fdata.expath)
 
 class TopPatchFileDb(fsdb.GenericTopPatchFileDb):
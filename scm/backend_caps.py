@@ -0,0 +1,150 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Registry of the capabilities of the back end tools (git, hg, etc.).
+Each tool is probed once (all in parallel when this module is imported)
+and whether the current directory is in a valid work space is remembered
+until the working directory or SCM changes.
+"""
+
+__all__ = ["get_tool", "get_in_valid_wspce", "forget_wspce_states"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import errno
+import os
+import re
+import subprocess
+import threading
+
+from ..bab import enotify
+
+from . import pgnd_markers
+from .scm_events import E_NEW_SCM
+
+_VERSION_RE = re.compile(r"(\d+(?:\.\d+)+)")
+
+# the features that we care about and the tool version that introduced them
+TOOL_FEATURES = {
+    "git": {
+        "check_ignore_stdin": (1, 8, 5),
+        "for_each_ref_merged": (2, 7),
+        "for_each_ref_ahead_behind": (2, 41),
+        "status_porcelain_v2": (2, 11),
+        "no_optional_locks": (2, 15),
+    },
+    "hg": {
+    },
+}
+
+VERSION_CMDS = {
+    "git": ["git", "version"],
+    "hg": ["hg", "version", "-q"],
+}
+
+class ToolCaps:
+    '''The capabilities of a back end tool found by running its version command
+    in a background thread.  Attribute access waits for the probe to finish.
+    '''
+    def __init__(self, name, version_cmd):
+        self.name = name
+        self.version_cmd = version_cmd
+        self._is_available = False
+        self._version = None
+        self._version_text = ""
+        self._error = None
+        self._thread = threading.Thread(target=self._probe, daemon=True)
+        self._thread.start()
+    def _probe(self):
+        try:
+            result = subprocess.run(self.version_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        except OSError as edata:
+            if edata.errno != errno.ENOENT:
+                self._error = edata
+            return
+        self._is_available = result.returncode == 0
+        if self._is_available:
+            self._version_text = result.stdout.strip()
+            match = _VERSION_RE.search(self._version_text)
+            if match:
+                self._version = tuple(int(part) for part in match.group(1).split("."))
+    def _wait(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+    @property
+    def is_available(self):
+        self._wait()
+        return self._is_available
+    @property
+    def version(self):
+        self._wait()
+        return self._version
+    @property
+    def version_text(self):
+        self._wait()
+        return self._version_text
+    def has_feature(self, feature):
+        version = self.version
+        if version is None:
+            return False
+        return version >= TOOL_FEATURES.get(self.name, {})[feature]
+
+_TOOLS = dict()
+_TOOLS_LOCK = threading.Lock()
+
+def probe_tools(names=None):
+    '''Start probing the named (or all known) tools that haven't been already'''
+    with _TOOLS_LOCK:
+        for name in (VERSION_CMDS if names is None else names):
+            if name not in _TOOLS:
+                _TOOLS[name] = ToolCaps(name, VERSION_CMDS[name])
+
+def get_tool(name):
+    '''Return the (memoized) capabilities of the named tool'''
+    try:
+        return _TOOLS[name]
+    except KeyError:
+        probe_tools([name])
+        return _TOOLS[name]
+
+# (backend name, working directory) -> is it in a valid work space
+_WSPCE_STATES = dict()
+_WSPCE_LOCK = threading.Lock()
+
+def get_in_valid_wspce(name, probe):
+    '''Return whether the current directory is in a valid "name" work space
+    using the playground markers or, if they're not enough, probe()
+    '''
+    key = (name, os.getcwd())
+    with _WSPCE_LOCK:
+        try:
+            return _WSPCE_STATES[key]
+        except KeyError:
+            pass
+    root = pgnd_markers.get_playground_root(name)
+    state = probe() if root is NotImplemented else root is not None
+    with _WSPCE_LOCK:
+        _WSPCE_STATES[key] = state
+    return state
+
+def forget_wspce_states(*args, **kwargs):
+    with _WSPCE_LOCK:
+        _WSPCE_STATES.clear()
+
+enotify.add_notification_cb(enotify.E_CHANGE_WD|E_NEW_SCM, forget_wspce_states)
+
+probe_tools()
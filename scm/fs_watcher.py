@@ -0,0 +1,316 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Watch the current playground's work tree and the SCM/PM meta data that
+affects its status (.git/index, refs, info/exclude, the user's excludes
+file, .hg/dirstate, .hg/patches, .pc) so that file data need only be
+refetched from the SCM/PM when something relevant has changed.
+
+Linux's inotify (via ctypes) is used where available with a (rate
+limited) polling fallback.  Bursts of changes between queries are
+coalesced into a single new generation.  The inotify watches are set up
+in the background and nothing is cached until they're all in place.
+"""
+
+__all__ = ["get_generation", "get_cached_output"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import os
+import struct
+import threading
+import time
+
+from ..bab import enotify
+from ..bab import options
+from ..bab import os_utils
+from ..bab import runext
+
+from .. import pm
+from . import scm_events
+
+options.define("file_watcher", "enabled", options.Defn(bool, True, _("Watch the playground's files for changes rather than asking the SCM/PM for their status at every update")))
+
+# the meta data directories that we don't descend into and the entries
+# within them that affect the status
+_META_DIRS = {
+    ".git": frozenset(["index", "HEAD", "packed-refs", "MERGE_HEAD", "CHERRY_PICK_HEAD", "REVERT_HEAD", "config", "info"]),
+    ".hg": frozenset(["dirstate", "bookmarks", "bookmarks.current", "branch", "undo.dirstate"]),
+}
+# meta data sub directories all of whose contents are relevant
+_META_TREES = [os.path.join(".git", "refs"), os.path.join(".git", "info"), os.path.join(".hg", "patches")]
+
+def _get_excludes_file_paths(root):
+    # the user's excludes file lives outside the playground
+    if not os.path.isdir(os.path.join(root, ".git")):
+        return []
+    file_path = runext.run_get_cmd(["git", "config", "--path", "core.excludesFile"], default="")
+    if not file_path:
+        config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+        file_path = os.path.join(config_home, "git", "ignore")
+    return [os.path.join(root, file_path)]
+
+def _iter_work_tree_dirs(root):
+    for dir_path, sub_dir_names, _file_names in os.walk(root):
+        if dir_path == root:
+            sub_dir_names[:] = [name for name in sub_dir_names if name not in _META_DIRS]
+        yield dir_path
+
+def _iter_watched_dirs(root, extra_file_paths=()):
+    '''Iterate over (dir_path, relevant entry names or None for all) for root
+    and the directories containing extra_file_paths'''
+    for file_path in extra_file_paths:
+        yield (os.path.dirname(file_path), frozenset([os.path.basename(file_path)]))
+    for dir_path in _iter_work_tree_dirs(root):
+        yield (dir_path, None)
+    for meta_dir_name, names in _META_DIRS.items():
+        meta_dir_path = os.path.join(root, meta_dir_name)
+        if os.path.isdir(meta_dir_path):
+            yield (meta_dir_path, names)
+    for meta_tree in _META_TREES:
+        for dir_path, _sub_dir_names, _file_names in os.walk(os.path.join(root, meta_tree)):
+            yield (dir_path, None)
+
+class _Watcher:
+    failed = False
+    def __init__(self, root):
+        self.root = root
+        self._generation = 0
+        self._lock = threading.Lock()
+    def mark_changed(self):
+        with self._lock:
+            self._generation += 1
+    def get_generation(self):
+        with self._lock:
+            if self._check_for_changes():
+                self._generation += 1
+            return self._generation
+    def close(self):
+        pass
+
+class _PollingWatcher(_Watcher):
+    '''Detect changes by comparing a digest of the stat() data of everything
+    in the watched directories at most every POLL_INTERVAL seconds'''
+    POLL_INTERVAL = 2.0
+    def __init__(self, root):
+        _Watcher.__init__(self, root)
+        self._extra_file_paths = _get_excludes_file_paths(root)
+        self._last_poll = time.monotonic()
+        self._digest = self._get_digest()
+    def _get_digest(self):
+        h = hashlib.sha1()
+        for dir_path, names in _iter_watched_dirs(self.root, self._extra_file_paths):
+            try:
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if names is not None and entry.name not in names:
+                            continue
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        h.update("{0}\0{1}\0{2}\0{3}\0".format(entry.path, stat.st_mtime_ns, stat.st_size, stat.st_mode).encode(errors="surrogateescape"))
+            except OSError:
+                continue
+        return h.digest()
+    def _check_for_changes(self):
+        now = time.monotonic()
+        if now - self._last_poll < self.POLL_INTERVAL:
+            return False
+        self._last_poll = now
+        digest = self._get_digest()
+        if digest == self._digest:
+            return False
+        self._digest = digest
+        return True
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+_IN_WATCH_MASK = _IN_MODIFY|_IN_ATTRIB|_IN_MOVED_FROM|_IN_MOVED_TO|_IN_CREATE|_IN_DELETE|_IN_DELETE_SELF|_IN_MOVE_SELF
+_EVENT_HDR = struct.Struct("iIII")
+
+_LIBC = None
+
+def _get_libc():
+    global _LIBC
+    if _LIBC is None:
+        _LIBC = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _LIBC.inotify_init1.argtypes = [ctypes.c_int]
+        _LIBC.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _LIBC
+
+class _InotifyWatcher(_Watcher):
+    '''Detect changes with inotify watches on every watched directory.
+    Walking a big work tree to set them up takes a while so it's done in
+    the background and the generation is None until it's finished.'''
+    def __init__(self, root):
+        _Watcher.__init__(self, root)
+        self._libc = _get_libc()
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK|_IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._fd_lock = threading.Lock()
+        self._watches = dict() # watch descriptor -> (dir_path, relevant names)
+        self._extra_file_paths = _get_excludes_file_paths(root)
+        self._ready = threading.Event()
+        threading.Thread(target=self._add_initial_watches, daemon=True).start()
+    def _add_initial_watches(self):
+        try:
+            for dir_path, names in _iter_watched_dirs(self.root, self._extra_file_paths):
+                self._add_watch(dir_path, names)
+        except OSError:
+            # e.g. out of watches so our owner will have to poll instead
+            self.failed = True
+            self.close()
+            return
+        self._ready.set()
+    def get_generation(self):
+        if not self._ready.is_set():
+            return None
+        return _Watcher.get_generation(self)
+    def _add_watch(self, dir_path, names):
+        with self._fd_lock:
+            if self._fd < 0:
+                raise OSError(errno.EBADF, "inotify_add_watch", dir_path)
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), _IN_WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return # it's gone already
+            raise OSError(error, "inotify_add_watch", dir_path)
+        self._watches[wd] = (dir_path, names)
+    def _add_tree_watches(self, dir_path):
+        for sub_dir_path, _sub_dir_names, _file_names in os.walk(dir_path):
+            self._add_watch(sub_dir_path, None)
+    def _check_for_changes(self):
+        changed = False
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _cookie, name_len = _EVENT_HDR.unpack_from(buf, offset)
+                offset += _EVENT_HDR.size
+                name = os.fsdecode(buf[offset:offset + name_len].rstrip(b"\0"))
+                offset += name_len
+                if mask & _IN_Q_OVERFLOW:
+                    changed = True
+                    continue
+                dir_path, names = self._watches.get(wd, (None, None))
+                if mask & _IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                if dir_path is None or (names is not None and name not in names):
+                    continue
+                changed = True
+                if mask & _IN_ISDIR and mask & (_IN_CREATE|_IN_MOVED_TO):
+                    try:
+                        self._add_tree_watches(os.path.join(dir_path, name))
+                    except OSError:
+                        pass # we'll miss changes in there so be pessimistic
+        return changed
+    def close(self):
+        with self._fd_lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+_WATCHER = None
+_WATCHER_LOCK = threading.Lock()
+
+def _can_watch(root):
+    # the meta data must be where we expect it (i.e. not a worktree's,
+    # submodule's or shared repository's) for us to see it change
+    if os.path.exists(os.path.join(root, ".git")) and not os.path.isdir(os.path.join(root, ".git")):
+        return False
+    return not os.path.exists(os.path.join(root, ".hg", "sharedpath"))
+
+def _get_watcher():
+    global _WATCHER
+    if not options.get("file_watcher", "enabled"):
+        return None
+    root = os.getcwd()
+    with _WATCHER_LOCK:
+        if _WATCHER is not None and _WATCHER.root == root and not _WATCHER.failed:
+            return _WATCHER
+        if _WATCHER is not None and _WATCHER.root == root:
+            # inotify couldn't watch it all
+            _WATCHER = _PollingWatcher(root)
+            return _WATCHER
+        if _WATCHER is not None:
+            _WATCHER.close()
+            _WATCHER = None
+        if not _can_watch(root):
+            return None
+        try:
+            _WATCHER = _InotifyWatcher(root)
+        except (OSError, AttributeError):
+            # no inotify (not Linux) or it has run out of watches
+            _WATCHER = _PollingWatcher(root)
+        return _WATCHER
+
+def get_generation():
+    '''Return a number that changes whenever something that could affect
+    the status of the current directory's files changes or None if the
+    directory isn't being watched'''
+    watcher = _get_watcher()
+    return None if watcher is None else watcher.get_generation()
+
+def mark_changed(*args, **kwargs):
+    with _WATCHER_LOCK:
+        if _WATCHER is not None:
+            _WATCHER.mark_changed()
+
+# our own file changing operations may beat the poller to it
+enotify.add_notification_cb(os_utils.E_FILE_CHANGES|scm_events.E_FILE_CHANGES|scm_events.E_INDEX_MOD|scm_events.E_CS_CHANGES|scm_events.E_WD_CHANGES|pm.E_FILE_CHANGES|pm.E_PATCH_STACK_CHANGES|pm.E_PATCH_LIST_CHANGES, mark_changed)
+
+_OUTPUT_CACHE = dict()
+_OUTPUT_CACHE_LOCK = threading.Lock()
+
+def get_cached_output(key, get_output):
+    '''Return get_output() as cached for key (e.g. the command) and the
+    current directory until the watcher reports a change'''
+    generation = get_generation()
+    if generation is None:
+        return get_output()
+    cache_key = (key, os.getcwd())
+    with _OUTPUT_CACHE_LOCK:
+        cached = _OUTPUT_CACHE.get(cache_key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+    output = get_output()
+    with _OUTPUT_CACHE_LOCK:
+        if len(_OUTPUT_CACHE) > 64:
+            _OUTPUT_CACHE.clear()
+        _OUTPUT_CACHE[cache_key] = (generation, output)
+    return output
@@ -0,0 +1,51 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Work out what has changed between two file status snapshots (i.e.
+{file_path: (status, related_file_data)} maps) so that structures derived
+from a snapshot (e.g. the status trie) can be brought up to date without
+being rebuilt.
+"""
+
+__all__ = ["SnapshotDelta", "get_snapshot_delta"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+class SnapshotDelta:
+    '''The changes between two snapshots:
+    changed: file_path -> (old data or None, new data or None) for each file
+    whose data was added, removed or changed
+    '''
+    __slots__ = ("changed",)
+    def __init__(self, changed):
+        self.changed = changed
+    def __bool__(self):
+        return bool(self.changed)
+    def __len__(self):
+        return len(self.changed)
+
+_ABSENT = object()
+
+def get_snapshot_delta(old_fsd, new_fsd):
+    '''Return the SnapshotDelta for going from old_fsd to new_fsd'''
+    old_get = old_fsd.get
+    changed = {file_path: (old_get(file_path), data) for file_path, data in new_fsd.items() if old_get(file_path, _ABSENT) != data}
+    num_added = sum(1 for old_data, _new_data in changed.values() if old_data is None)
+    if len(new_fsd) - num_added != len(old_fsd):
+        # some files have gone
+        for file_path in old_fsd.keys() - new_fsd.keys():
+            changed[file_path] = (old_fsd[file_path], None)
+    return SnapshotDelta(changed)
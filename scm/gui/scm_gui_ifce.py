@@ -21,6 +21,9 @@ Provide an interface for the GUI to access the SCM controlling the source
 
 from ...gtx.table import NullTableData as DummyTableData
 
+from .. import backend_caps
+from .. import pgnd_markers
+
 _BACKEND = {}
 _MISSING_BACKEND = {}
 
@@ -48,7 +51,11 @@ def playground_type(dir_path=None):
     # TODO: cope with nested playgrounds of different type and go for closest
     # TODO: give preference to quilt if both found to allow quilt to be used on hg?
     for bname in list(_BACKEND.keys()):
-        if _BACKEND[bname].dir_is_in_valid_pgnd(dir_path):
+        root = pgnd_markers.get_playground_root(bname, dir_path)
+        if root is NotImplemented:
+            if _BACKEND[bname].dir_is_in_valid_pgnd(dir_path):
+                return bname
+        elif root is not None:
             return bname
     return None
 
@@ -170,13 +177,25 @@ class _NULL_BACKEND:
         Is the SCM in a position to accept an import?
         '''
         return (False, _("No (or unsupported) underlying SCM."))
+    @staticmethod
+    def new_refresh_generation():
+        '''
+        Discard any status data shared during the previous refresh
+        '''
+        pass
 
 SCM = _NULL_BACKEND
 
 def reset_scm_ifce(dir_path=None):
     global SCM
     pgt = playground_type(dir_path)
-    SCM = _NULL_BACKEND if pgt is None else _BACKEND[pgt]
+    new_scm = _NULL_BACKEND if pgt is None else _BACKEND[pgt]
+    if new_scm != SCM:
+        # don't wait for the E_NEW_SCM notification as our caller may look first
+        backend_caps.forget_wspce_states()
+    SCM = new_scm
+    # this is called at the start of each auto update tick
+    SCM.new_refresh_generation()
     return SCM
 
 def reset_pm_ifce(events=0):
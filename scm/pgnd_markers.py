@@ -0,0 +1,195 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Find playgrounds from the markers (.git, .hg, .pc, etc.) they leave in
+the file system rather than by asking the SCM/PM tools.  Where the markers
+can't give a definitive answer NotImplemented is returned and the caller
+should fall back to asking the tool.
+"""
+
+__all__ = ["get_playground_root", "get_superproject_root"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import os
+import stat
+import threading
+
+_DIR, _FILE = "dir", "file"
+
+# dir_path -> (st_mtime_ns, {entry_name: kind}) which is valid for as long
+# as the directory's mtime doesn't change (i.e. no entries added or removed)
+_ENTRY_CACHE = dict()
+_ENTRY_CACHE_MAX = 4096
+_LOCK = threading.RLock()
+
+def _get_kind(path):
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return None
+    if stat.S_ISDIR(mode):
+        return _DIR
+    elif stat.S_ISREG(mode):
+        return _FILE
+    return None
+
+class _DirEntries:
+    __slots__ = ("dir_path", "dir_stat", "kinds")
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.dir_stat = os.stat(dir_path)
+        with _LOCK:
+            cached = _ENTRY_CACHE.get(dir_path)
+            if cached is None or cached[0] != self.dir_stat.st_mtime_ns:
+                if len(_ENTRY_CACHE) >= _ENTRY_CACHE_MAX:
+                    _ENTRY_CACHE.clear()
+                cached = (self.dir_stat.st_mtime_ns, dict())
+                _ENTRY_CACHE[dir_path] = cached
+        self.kinds = cached[1]
+    def kind(self, entry_name):
+        try:
+            return self.kinds[entry_name]
+        except KeyError:
+            kind = self.kinds[entry_name] = _get_kind(os.path.join(self.dir_path, entry_name))
+            return kind
+    def sub_kind(self, entry_name, sub_entry_name):
+        if self.kind(entry_name) != _DIR:
+            return None
+        try:
+            return _DirEntries(os.path.join(self.dir_path, entry_name)).kind(sub_entry_name)
+        except OSError:
+            return None
+
+def _iter_dir_entries(dir_path=None):
+    dir_path = os.path.abspath(os.getcwd() if dir_path is None else dir_path)
+    while True:
+        yield _DirEntries(dir_path)
+        dir_path, basename = os.path.split(dir_path)
+        if not basename:
+            break
+
+class _Undecided(Exception):
+    pass
+
+_GIT_DISCOVERY_EVARS = ("GIT_DIR", "GIT_WORK_TREE", "GIT_CEILING_DIRECTORIES", "GIT_DISCOVERY_ACROSS_FILESYSTEM")
+
+def _looks_like_git_dir(entries):
+    return entries.kind("HEAD") == _FILE and entries.kind("objects") == _DIR and entries.kind("refs") == _DIR
+
+def _is_valid_gitfile(dir_path):
+    try:
+        with open(os.path.join(dir_path, ".git")) as fobj:
+            line = fobj.readline()
+    except (OSError, UnicodeError):
+        return False
+    if not line.startswith("gitdir: "):
+        return False
+    return os.path.isdir(os.path.join(dir_path, line[len("gitdir: "):].rstrip("\n")))
+
+def _find_git_root(dir_path):
+    if any(evar in os.environ for evar in _GIT_DISCOVERY_EVARS):
+        raise _Undecided
+    start_dev = None
+    for entries in _iter_dir_entries(dir_path):
+        if start_dev is None:
+            start_dev = entries.dir_stat.st_dev
+        elif entries.dir_stat.st_dev != start_dev:
+            # git won't look beyond the file system boundary
+            return None
+        kind = entries.kind(".git")
+        if kind == _DIR:
+            git_entries = _DirEntries(os.path.join(entries.dir_path, ".git"))
+            if not _looks_like_git_dir(git_entries):
+                raise _Undecided
+            if hasattr(os, "getuid") and entries.dir_stat.st_uid != os.getuid():
+                # git may refuse to use it depending on "safe.directory"
+                raise _Undecided
+            return entries.dir_path
+        elif kind == _FILE:
+            if not _is_valid_gitfile(entries.dir_path):
+                raise _Undecided
+            if hasattr(os, "getuid") and entries.dir_stat.st_uid != os.getuid():
+                raise _Undecided
+            return entries.dir_path
+        elif _looks_like_git_dir(entries):
+            # inside a .git directory or a bare repository
+            raise _Undecided
+    return None
+
+def _find_hg_root(dir_path):
+    for entries in _iter_dir_entries(dir_path):
+        kind = entries.kind(".hg")
+        if kind == _DIR:
+            return entries.dir_path
+        elif kind is not None:
+            raise _Undecided
+    return None
+
+def _find_mq_root(dir_path):
+    root = _find_hg_root(dir_path)
+    if root is None:
+        return None
+    return root if _DirEntries(root).sub_kind(".hg", "patches") == _DIR else None
+
+def _find_quilt_root(dir_path):
+    if "QUILT_PATCHES" in os.environ or "QUILT_PC" in os.environ:
+        raise _Undecided
+    # like quilt, use the nearest directory with either marker
+    for entries in _iter_dir_entries(dir_path):
+        if entries.kind(".pc") == _DIR:
+            return entries.dir_path
+        if entries.kind("patches") == _DIR:
+            if entries.sub_kind("patches", "series") == _FILE:
+                return entries.dir_path
+            # plenty of other playgrounds have a "patches" directory
+            raise _Undecided
+    return None
+
+_FINDERS = {
+    "git": _find_git_root,
+    "hg": _find_hg_root,
+    "mq": _find_mq_root,
+    "quilt": _find_quilt_root,
+}
+
+def get_playground_root(backend_name, dir_path=None):
+    '''Return the root of the "backend_name" playground containing dir_path
+    (or the current directory), None if it isn't in one or NotImplemented if
+    the markers aren't enough to decide.
+    '''
+    finder = _FINDERS.get(backend_name)
+    if finder is None:
+        return NotImplemented
+    try:
+        return finder(dir_path)
+    except (_Undecided, OSError):
+        return NotImplemented
+
+def get_superproject_root(dir_path=None):
+    '''Return the nearest directory at or above the git playground's root
+    with a real .git directory (rather than a submodule's .git file).
+    '''
+    root = get_playground_root("git", dir_path)
+    if root is None or root is NotImplemented:
+        return root
+    try:
+        for entries in _iter_dir_entries(root):
+            if entries.kind(".git") == _DIR:
+                return entries.dir_path
+    except OSError:
+        return NotImplemented
+    return None
@@ -19,6 +19,8 @@
 Provide an interface for the CLI to access the SCM controlling the source
 '''
 
+from . import pgnd_markers
+
 _BACKEND = {}
 _MISSING_BACKEND = {}
 
@@ -45,7 +47,11 @@ def playground_type(dir_path=None):
     # TODO: cope with nested playgrounds of different type and go for closest
     # TODO: give preference to quilt if both found to allow quilt to be used on hg?
     for bname in list(_BACKEND.keys()):
-        if _BACKEND[bname].dir_is_in_valid_pgnd(dir_path):
+        root = pgnd_markers.get_playground_root(bname, dir_path)
+        if root is NotImplemented:
+            if _BACKEND[bname].dir_is_in_valid_pgnd(dir_path):
+                return bname
+        elif root is not None:
             return bname
     return None
 
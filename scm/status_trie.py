@@ -0,0 +1,163 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""A path trie whose directory nodes count the statuses of the files
+beneath them so that a directory's display status (the most important
+status present) is available without rescanning its contents.
+"""
+
+__all__ = ["StatusRanking", "StatusTrie"]
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import os
+
+class StatusRanking:
+    '''An ordered (most important first) list of statuses and a fast way
+    to pick the most important of a collection of them'''
+    __slots__ = ("statuses", "rank")
+    def __init__(self, ordered_statuses):
+        self.statuses = tuple(ordered_statuses)
+        self.rank = {status: index for index, status in enumerate(self.statuses)}
+    def select(self, statuses, default=None):
+        '''Return the most important of statuses (or default if none are ranked)'''
+        rank = self.rank
+        best = None
+        for status in statuses:
+            index = rank.get(status)
+            if index is not None and (best is None or index < best):
+                best = index
+        return default if best is None else self.statuses[best]
+
+class _DirNode:
+    __slots__ = ("sub_dirs", "files", "counts", "selected")
+    def __init__(self):
+        self.sub_dirs = dict()
+        self.files = dict()
+        self.counts = dict()
+        self.selected = None
+
+def _split_path(path):
+    return [part for part in path.replace(os.sep, "/").split("/") if part and part != os.curdir]
+
+class StatusTrie:
+    '''Map file paths to statuses with each directory node keeping a count
+    of each status below it, updated incrementally as files change.
+    '''
+    def __init__(self, fsd=None):
+        self._root = _DirNode()
+        if fsd:
+            self._build(fsd)
+    def _build(self, fsd):
+        # each path component is visited once so this is linear in the
+        # total length of the paths
+        root = self._root
+        for file_path, data in fsd.items():
+            status = data[0]
+            if status is None:
+                continue
+            parts = _split_path(file_path)
+            if not parts:
+                continue
+            node = root
+            counts = node.counts
+            counts[status] = counts.get(status, 0) + 1
+            for part in parts[:-1]:
+                sub_dirs = node.sub_dirs
+                node = sub_dirs.get(part)
+                if node is None:
+                    node = sub_dirs[part] = _DirNode()
+                counts = node.counts
+                counts[status] = counts.get(status, 0) + 1
+            if parts[-1] in node.files:
+                # same file under two spellings e.g. "./x" and "x"
+                self._adjust_counts(self._get_nodes(parts), status, -1)
+                self.set_status(file_path, status)
+            else:
+                node.files[parts[-1]] = status
+    def _get_nodes(self, parts):
+        node = self._root
+        nodes = [node]
+        for part in parts[:-1]:
+            node = node.sub_dirs[part]
+            nodes.append(node)
+        return nodes
+    def _adjust_counts(self, nodes, status, delta):
+        for node in nodes:
+            count = node.counts.get(status, 0) + delta
+            if count:
+                node.counts[status] = count
+            else:
+                del node.counts[status]
+            if (count == 0 or count == delta) and node.selected:
+                # the set of statuses present has changed
+                node.selected.clear()
+    def set_status(self, file_path, status):
+        '''Set (or, if status is None, remove) file_path's status'''
+        parts = _split_path(file_path)
+        if not parts:
+            return
+        node = self._root
+        nodes = [node]
+        for part in parts[:-1]:
+            sub_dir = node.sub_dirs.get(part)
+            if sub_dir is None:
+                if status is None:
+                    return
+                sub_dir = node.sub_dirs[part] = _DirNode()
+            node = sub_dir
+            nodes.append(node)
+        name = parts[-1]
+        old_status = node.files.get(name, None)
+        if name in node.files:
+            if old_status == status:
+                return
+            self._adjust_counts(nodes, old_status, -1)
+        if status is None:
+            node.files.pop(name, None)
+        else:
+            node.files[name] = status
+            self._adjust_counts(nodes, status, 1)
+    def remove(self, file_path):
+        self.set_status(file_path, None)
+    def apply_delta(self, delta):
+        '''Apply a fsdb_delta.SnapshotDelta to bring the trie up to date'''
+        for file_path, (_old_data, new_data) in delta.changed.items():
+            self.set_status(file_path, None if new_data is None else new_data[0])
+    def _find_dir(self, dir_path):
+        node = self._root
+        for part in _split_path(dir_path):
+            node = node.sub_dirs.get(part)
+            if node is None:
+                return None
+        return node
+    def get_status_counts(self, dir_path):
+        '''Return {status: count} for the files below dir_path'''
+        node = self._find_dir(dir_path)
+        return dict() if node is None else dict(node.counts)
+    def get_dir_status(self, dir_path, ranking, default=None):
+        '''Return the most important (according to ranking) status of the
+        files below dir_path'''
+        node = self._find_dir(dir_path)
+        if node is None:
+            return default
+        if node.selected is None:
+            node.selected = dict()
+        try:
+            return node.selected[ranking]
+        except KeyError:
+            selected = node.selected[ranking] = ranking.select(node.counts, default)
+            return selected
@@ -0,0 +1,31 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Parity checks for the hot paths that have been optimised (patch
+parsing, git's delta and base85 encodings) so that later changes to them
+can be checked against reference implementations and git itself.
+"""
+
+__all__ = []
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import builtins
+import gettext
+
+# the application installs _() but we're not running it
+if "_" not in builtins.__dict__:
+    gettext.NullTranslations().install()
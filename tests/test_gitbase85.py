@@ -0,0 +1,109 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Check gitbase85 against the original (a character at a time)
+implementation and against the standard library's base 85 encoder (which
+uses the same alphabet).
+"""
+
+__all__ = []
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import base64
+import random
+import unittest
+
+from ..patch_diff import gitbase85
+
+def _reference_encode(data):
+    index = 0
+    estring = bytes()
+    size = len(data)
+    while index < size:
+        acc = 0
+        for cnt in (24, 16, 8, 0):
+            acc |= data[index] << cnt
+            index += 1
+            if index == size:
+                break
+        snippet = bytes()
+        for _cnt in range(5):
+            val = acc % 85
+            acc //= 85
+            snippet = bytes([gitbase85.ENCODE[val]]) + snippet
+        estring += snippet
+    return gitbase85.Encoding(estring.decode("utf8"), size)
+
+def _reference_decode(encoding):
+    data = bytearray(encoding.size)
+    dindex = 0
+    sindex = 0
+    while dindex < encoding.size:
+        acc = 0
+        for _cnt in range(5):
+            acc = acc * 85 + gitbase85.DECODE[encoding.string[sindex]]
+            sindex += 1
+        for _cnt in range(4):
+            if dindex == encoding.size:
+                break
+            acc = (acc << 8) | (acc >> 24)
+            data[dindex] = acc % 256
+            dindex += 1
+    return data
+
+def _reference_encode_to_lines(data, bytes_per_line=gitbase85.MAX_BYTES_PER_LINE):
+    lines = []
+    for index in range(0, len(data), bytes_per_line):
+        encoding = _reference_encode(data[index:index + bytes_per_line])
+        lines.append("{0}{1}\n".format(gitbase85.encode_size(encoding.size), encoding.string))
+    return lines
+
+class Base85ParityTests(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(85)
+    def _random_bytes(self, size):
+        return bytes(self.rng.getrandbits(8) for _i in range(size))
+    def test_encode_decode_match_reference(self):
+        for size in range(0, 260):
+            data = self._random_bytes(size)
+            encoding = gitbase85.encode(data)
+            self.assertEqual(encoding, _reference_encode(data))
+            self.assertEqual(gitbase85.decode(encoding), _reference_decode(encoding))
+            self.assertEqual(gitbase85.decode(encoding), data)
+    def test_extreme_values(self):
+        for data in (b"", b"\0", b"\0" * 8, b"\xff" * 8, b"\xff\xff\xff\xfe", b"\x00\xff" * 7):
+            self.assertEqual(gitbase85.encode(data), _reference_encode(data))
+            self.assertEqual(gitbase85.decode(gitbase85.encode(data)), data)
+    def test_encode_matches_standard_library(self):
+        for size in range(0, 200, 4):
+            data = self._random_bytes(size)
+            self.assertEqual(gitbase85.encode(data).string, base64.b85encode(data).decode("ascii"))
+    def test_lines_match_reference(self):
+        for size in (1, 26, 27, 51, 52, 53, 520, 1001):
+            data = self._random_bytes(size)
+            for max_line_length in (6, 21, 66):
+                bytes_per_line = min(((max_line_length - 1) // 5) * 4, gitbase85.MAX_BYTES_PER_LINE)
+                lines = gitbase85.encode_to_lines(data, max_line_length)
+                self.assertEqual(lines, _reference_encode_to_lines(data, bytes_per_line))
+                self.assertEqual(b"".join(gitbase85.decode_line(line) for line in lines), data)
+                decoded = gitbase85.decode_lines(lines)
+                self.assertIs(type(decoded), bytes)
+                self.assertEqual(decoded, data)
+    def test_bad_input_is_rejected(self):
+        self.assertRaises(gitbase85.ParseError, gitbase85.decode, gitbase85.Encoding("0000\"", 4))
+        self.assertRaises(gitbase85.ParseError, gitbase85.decode, gitbase85.Encoding("0000é", 4))
+        self.assertRaises(gitbase85.RangeError, gitbase85.decode, gitbase85.Encoding("~~~~~", 4))
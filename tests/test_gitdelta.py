@@ -0,0 +1,116 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Check the native gitdelta engine against the retained c_idioms
+translation of git's C code (deltas must be byte identical) and that
+deltas round trip through all of the ways of applying them.
+"""
+
+__all__ = []
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import io
+import random
+import tempfile
+import unittest
+
+from ..patch_diff import gitdelta
+
+def _make_pairs(rng):
+    '''Generate (name, before, after) test cases that exercise copies,
+    inserts, reordering and the hash bucket limits'''
+    def random_bytes(size):
+        return bytes(rng.getrandbits(8) for _i in range(size))
+    base = random_bytes(12000)
+    edited = bytearray(base)
+    for _i in range(40):
+        offset = rng.randrange(len(edited))
+        edited[offset:offset + rng.randrange(1, 64)] = random_bytes(rng.randrange(0, 64))
+    blocks = [base[index:index + 700] for index in range(0, len(base), 700)]
+    rng.shuffle(blocks)
+    text = "".join("line {0} of some text that repeats a lot\n".format(i % 50) for i in range(600)).encode()
+    yield ("edited", base, bytes(edited))
+    yield ("reordered", base, b"".join(blocks))
+    yield ("unrelated", base, random_bytes(5000))
+    yield ("repetitive", b"\0" * 9000, b"\0" * 4000 + b"x" + b"\0" * 70000)
+    yield ("text", text, text.replace(b"line 7 ", b"LINE SEVEN ") + b"the end\n")
+    yield ("tiny", b"abc", b"abcabcabd")
+    yield ("prefix", base[:20], base)
+
+def _encode_size(size):
+    data = bytearray()
+    while size >= 0x80:
+        data.append((size & 0x7F) | 0x80)
+        size >>= 7
+    data.append(size)
+    return data
+
+def _insert_only_delta(data):
+    '''Return a delta that creates data from an empty source'''
+    delta = _encode_size(0) + _encode_size(len(data))
+    for index in range(0, len(data), 0x7F):
+        chunk = data[index:index + 0x7F]
+        delta += bytes([len(chunk)]) + chunk
+    return bytes(delta)
+
+class DeltaParityTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pairs = list(_make_pairs(random.Random(1)))
+    def test_native_deltas_match_reference(self):
+        for name, before, after in self.pairs:
+            for max_delta_size in (None, len(after) // 2, 64):
+                native = gitdelta.create_delta(gitdelta.create_delta_index(before), after, max_delta_size)
+                reference = gitdelta.create_delta(gitdelta.CIdiomsDeltaIndex(before), after, max_delta_size)
+                self.assertEqual(native, reference, (name, max_delta_size))
+    def test_deltas_round_trip(self):
+        for name, before, after in self.pairs:
+            delta = gitdelta.diff_delta(before, after)
+            self.assertEqual(gitdelta.patch_delta(before, delta), after, name)
+            self.assertEqual(gitdelta.c_idioms_patch_delta(before, delta), after, name)
+            self.assertEqual(gitdelta.patch_delta(memoryview(before), bytearray(delta)), after, name)
+            sink = io.BytesIO()
+            self.assertEqual(gitdelta.patch_delta_into(before, delta, sink), len(after))
+            self.assertEqual(sink.getvalue(), after, name)
+    def test_patch_delta_into_from_file(self):
+        name, before, after = self.pairs[0]
+        delta = gitdelta.diff_delta(before, after)
+        with tempfile.TemporaryFile() as src_file:
+            src_file.write(before)
+            src_file.flush()
+            sink = io.BytesIO()
+            gitdelta.patch_delta_into(src_file, delta, sink)
+        self.assertEqual(sink.getvalue(), after)
+        # an empty source can't be memory mapped
+        delta = _insert_only_delta(after)
+        with tempfile.TemporaryFile() as src_file:
+            sink = io.BytesIO()
+            gitdelta.patch_delta_into(src_file, delta, sink)
+        self.assertEqual(sink.getvalue(), after)
+    def test_bad_deltas_are_rejected(self):
+        name, before, after = self.pairs[0]
+        delta = bytearray(gitdelta.diff_delta(before, after))
+        self.assertRaises(gitdelta.InvalidSourceSize, gitdelta.patch_delta, before + b"x", delta)
+        self.assertRaises(gitdelta.InvalidDelta, gitdelta.patch_delta, before, delta[:2])
+        self.assertRaises(gitdelta.PatchError, gitdelta.patch_delta, before, delta[:-1])
+        with tempfile.TemporaryFile() as src_file:
+            src_file.write(before)
+            src_file.flush()
+            self.assertRaises(gitdelta.PatchError, gitdelta.patch_delta_into, src_file, delta[:-1], io.BytesIO())
+    def test_empty_buffers(self):
+        self.assertIsNone(gitdelta.diff_delta(b"", b"abc"))
+        self.assertRaises(gitdelta.EmptyTargetBuffer, gitdelta.create_delta, gitdelta.create_delta_index(b"abc"), b"")
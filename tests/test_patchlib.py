@@ -0,0 +1,242 @@
+### -*- coding: utf-8 -*-
+###
+###  Copyright (C) 2016 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Check that the ways of parsing a patch (whole text, compact, streamed
+from text or binary files) agree with each other and reproduce the text
+exactly, and that git binary patches decode to what git says they do.
+"""
+
+__all__ = []
+__author__ = "Peter Williams <pwil3058@gmail.com>"
+
+import difflib
+import io
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+from ..patch_diff import gitdelta
+from ..patch_diff import patchlib
+
+def _make_lines(rng, num_lines):
+    words = ["alpha", "beta", "gamma", "delta", "", "  indented", "tab\tbed", "trailing "]
+    return ["{0} {1}\n".format(index, rng.choice(words)) for index in range(num_lines)]
+
+def _edit_lines(rng, lines):
+    lines = list(lines)
+    for _i in range(rng.randrange(1, 6)):
+        index = rng.randrange(len(lines))
+        choice = rng.randrange(3)
+        if choice == 0:
+            del lines[index:index + rng.randrange(1, 4)]
+        elif choice == 1:
+            lines.insert(index, "inserted {0}  \n".format(index))
+        else:
+            lines[index] = "changed " + lines[index]
+    return lines
+
+def _make_difflib_patch(rng, num_files):
+    '''Return a patch of unified and context diffs (with assorted
+    preambles, a header and junk) made with difflib'''
+    chunks = ["Subject: a generated patch\n", "\n", "Some description.\n", "---\n"]
+    for index in range(num_files):
+        before = _make_lines(rng, rng.randrange(5, 60))
+        after = _edit_lines(rng, before)
+        path = "dir{0}/file{1}.txt".format(index % 3, index)
+        style = index % 4
+        if style == 0:
+            chunks.append("diff --git a/{0} b/{0}\nindex 1234567..89abcde 100644\n".format(path))
+            chunks.extend(difflib.unified_diff(before, after, "a/" + path, "b/" + path))
+        elif style == 1:
+            chunks.append("Index: {0}\n{1}\n".format(path, "=" * 67))
+            chunks.extend(difflib.unified_diff(before, after, "a/" + path, "b/" + path, n=1))
+        elif style == 2:
+            chunks.append("diff -c a/{0} b/{0}\n".format(path))
+            chunks.extend(difflib.context_diff(before, after, "a/" + path, "b/" + path))
+            # NB: the parser has always needed a line after a context diff
+            # whose last "after" chunk is empty (i.e. only has deletions)
+            chunks.append("\n")
+        else:
+            chunks.extend(difflib.unified_diff(before, after, "a/" + path, "b/" + path, n=5))
+            # e.g. quilt's separators
+            chunks.append("\n")
+    return "".join(chunks)
+
+def _git(repo_dir, *args):
+    return subprocess.check_output(["git", "-C", repo_dir] + list(args), stderr=subprocess.DEVNULL)
+
+def _make_git_patches(repo_dir):
+    '''Make two commits in a new repository at repo_dir and return the
+    contents of their files and git's patches between them'''
+    rng = random.Random(2)
+    def write(path, data):
+        path = os.path.join(repo_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fobj:
+            fobj.write(data)
+    def text(lines):
+        return "".join(lines).encode()
+    _git(repo_dir, "init", "-q")
+    _git(repo_dir, "config", "user.name", "Tester")
+    _git(repo_dir, "config", "user.email", "tester@example.com")
+    a_lines = _make_lines(rng, 200)
+    before = {
+        "a.txt": text(a_lines),
+        "c.txt": text(_make_lines(rng, 10)),
+        "d.txt": text(_make_lines(rng, 40)),
+        "e.sh": b"#!/bin/sh\necho hello\n",
+        "noeol.txt": b"no newline here",
+        "sub_dir/odd-name.txt": text(_make_lines(rng, 8)),
+        "bin1.dat": bytes(rng.getrandbits(8) for _i in range(20000)),
+    }
+    for path, data in before.items():
+        write(path, data)
+    _git(repo_dir, "add", "-A")
+    _git(repo_dir, "commit", "-q", "-m", "before")
+    after = dict(before)
+    after["a.txt"] = text(_edit_lines(rng, a_lines))
+    after["new.txt"] = text(_make_lines(rng, 15))
+    after["empty.txt"] = b""
+    after["noeol.txt"] = b"no newline here\nstill none"
+    after["sub_dir/odd-name.txt"] += b"one more line\n"
+    after["bin2.dat"] = bytes(rng.getrandbits(8) for _i in range(3000))
+    bin1 = bytearray(before["bin1.dat"])
+    bin1[5000:5010] = b"0123456789"
+    after["bin1.dat"] = bytes(bin1)
+    after["sub/d2.txt"] = before["d.txt"] + b"renamed and edited\n"
+    del after["c.txt"]
+    del after["d.txt"]
+    os.remove(os.path.join(repo_dir, "c.txt"))
+    os.remove(os.path.join(repo_dir, "d.txt"))
+    for path, data in after.items():
+        write(path, data)
+    os.chmod(os.path.join(repo_dir, "e.sh"), 0o755)
+    _git(repo_dir, "add", "-A")
+    _git(repo_dir, "commit", "-q", "-m", "after\n\nWith a description.")
+    patches = [
+        _git(repo_dir, "diff", "--binary", "-M", "HEAD~1", "HEAD").decode(),
+        _git(repo_dir, "format-patch", "--stdout", "--binary", "-M", "-1").decode(),
+        _git(repo_dir, "log", "-p", "-M", "-2").decode(),
+    ]
+    return before, after, patches
+
+def _diffstat(patch):
+    return [(path_stats.path, list(path_stats.diff_stats)) for path_stats in patch.get_diffstat_stats()]
+
+class PatchParseParityMixin:
+    def check_patch_text(self, text):
+        patch = patchlib.Patch.parse_text(text)
+        self.assertEqual(str(patch), text)
+        # the compact (shared text) form must be indistinguishable
+        compact = patchlib.Patch.parse_text(text, compact=True)
+        self.assertEqual(str(compact), text)
+        self.assertEqual([str(diff_plus) for diff_plus in compact.diff_pluses], [str(diff_plus) for diff_plus in patch.diff_pluses])
+        self.assertEqual(compact.get_file_paths(1), patch.get_file_paths(1))
+        self.assertEqual(_diffstat(compact), _diffstat(patch))
+        self.assertEqual(compact.report_trailing_whitespace(), patch.report_trailing_whitespace())
+        # as must streaming it (including when the look ahead is too short)
+        expected = [str(patch.get_header())] + [str(diff_plus) for diff_plus in patch.diff_pluses]
+        for lookahead in (patchlib._STREAM_LOOKAHEAD, 1):
+            with unittest.mock.patch.object(patchlib, "_STREAM_LOOKAHEAD", lookahead):
+                for fileobj in (io.StringIO(text), io.BytesIO(text.encode())):
+                    items = [str(item) for item in patchlib.Patch.iter_diff_pluses(fileobj)]
+                    self.assertEqual(items, expected)
+        return patch
+
+class DifflibPatchTests(PatchParseParityMixin, unittest.TestCase):
+    def test_round_trips(self):
+        rng = random.Random(5)
+        for num_files in (0, 1, 2, 7, 30):
+            patch = self.check_patch_text(_make_difflib_patch(rng, num_files))
+            self.assertEqual(len(patch.diff_pluses), num_files)
+    def test_junk_is_kept(self):
+        text = _make_difflib_patch(random.Random(6), 4)
+        lines = text.splitlines(True)
+        junked = "".join(("junk\n" if line.startswith(("diff ", "Index: ")) else "") + line for line in lines)
+        self.check_patch_text(junked)
+        self.check_patch_text("just a header\nwith no diffs\n")
+        self.check_patch_text("")
+    def test_malformed_patches_fail_alike(self):
+        text = _make_difflib_patch(random.Random(7), 3)
+        # truncate the second diff's first hunk
+        lines = text.splitlines(True)
+        starts = [index for index, line in enumerate(lines) if line.startswith("@@")]
+        del lines[starts[1] + 1:starts[1] + 3]
+        text = "".join(lines)
+        with self.assertRaises(patchlib.ParseError) as whole:
+            patchlib.Patch.parse_text(text)
+        with unittest.mock.patch.object(patchlib, "_STREAM_LOOKAHEAD", 1):
+            with self.assertRaises(patchlib.ParseError) as streamed:
+                list(patchlib.Patch.iter_diff_pluses(io.StringIO(text)))
+        self.assertEqual(streamed.exception.lineno, whole.exception.lineno)
+
+@unittest.skipUnless(shutil.which("git"), "needs git")
+class GitPatchTests(PatchParseParityMixin, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.repo_dir = tempfile.mkdtemp()
+        cls.before, cls.after, cls.patches = _make_git_patches(cls.repo_dir)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.repo_dir)
+    def test_round_trips(self):
+        for text in self.patches:
+            self.check_patch_text(text)
+    def test_file_paths(self):
+        patch = patchlib.Patch.parse_text(self.patches[0])
+        # NB: d.txt is renamed and e.sh only changes mode
+        expected = sorted([path for path in set(self.before) | set(self.after) if self.before.get(path) != self.after.get(path) and path != "d.txt"] + ["e.sh"])
+        self.assertEqual(sorted(patch.get_file_paths(1)), expected)
+    def test_binary_data(self):
+        methods = set()
+        for diff_plus in patchlib.Patch.parse_text(self.patches[0]).diff_pluses:
+            if not isinstance(diff_plus.diff, patchlib.GitBinaryDiff):
+                continue
+            path = diff_plus.get_file_path(1)
+            old, new = self.before.get(path, b""), self.after[path]
+            for data, src, target in ((diff_plus.diff.forward, old, new), (diff_plus.diff.reverse, new, old)):
+                methods.add(data.method)
+                self.assertEqual(data.get_inflated_size(), data.size_raw)
+                data.check_size()
+                if data.method == data.LITERAL:
+                    self.assertEqual(data.data_raw, target)
+                else:
+                    self.assertEqual(gitdelta.patch_delta(src, data.data_raw), target)
+        self.assertEqual(methods, {"literal", "delta"})
+
+class PatchFileCacheTests(unittest.TestCase):
+    def test_cache_hits_and_misses(self):
+        cache = patchlib.PatchFileCache()
+        text = _make_difflib_patch(random.Random(8), 3)
+        with tempfile.TemporaryDirectory() as dir_path:
+            file_path = os.path.join(dir_path, "a.patch")
+            with open(file_path, "w") as fobj:
+                fobj.write(text)
+            patch = cache.get_patch(file_path)
+            self.assertEqual(str(patch), text)
+            self.assertIs(cache.get_patch(file_path), patch)
+            new_text = text.replace("Some description.", "A longer description.")
+            with open(file_path, "w") as fobj:
+                fobj.write(new_text)
+            self.assertEqual(str(cache.get_patch(file_path)), new_text)
+        text_patch = cache.get_text_patch(text)
+        self.assertEqual(str(text_patch), text)
+        self.assertIs(cache.get_text_patch(text), text_patch)